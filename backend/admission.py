@@ -0,0 +1,211 @@
+import os
+import math
+import time
+import logging
+import threading
+from collections import deque
+from functools import wraps
+from typing import Callable, Dict, Optional, Tuple
+
+from flask import Response, request, jsonify
+
+# Per-user token bucket: sustained rate and burst size
+RATE_LIMIT_PER_MINUTE = float(os.getenv("RATE_LIMIT_PER_MINUTE", "30"))
+RATE_LIMIT_BURST = float(os.getenv("RATE_LIMIT_BURST", "10"))
+# Per-process cap on concurrent LLM calls and the bounded queue in front of it
+MAX_INFLIGHT = int(os.getenv("MAX_INFLIGHT", "8"))
+ADMISSION_QUEUE_SIZE = int(os.getenv("ADMISSION_QUEUE_SIZE", "16"))
+# Requests are shed once their expected queue wait would exceed this
+LATENCY_SLO_MS = float(os.getenv("LATENCY_SLO_MS", "5000"))
+# Optional shared store so rate limits hold across gunicorn workers and instances
+ADMISSION_REDIS_URL = os.getenv("ADMISSION_REDIS_URL")
+
+
+class MemoryRateLimiter:
+    def __init__(self, rate_per_minute: float = RATE_LIMIT_PER_MINUTE, burst: float = RATE_LIMIT_BURST,
+                 sweep_interval: float = 60.0):
+        self.rate = rate_per_minute / 60.0
+        self.burst = burst
+        self.buckets: Dict[str, Tuple[float, float]] = {}
+        self.sweep_interval = sweep_interval
+        self.last_sweep = time.monotonic()
+        self.lock = threading.Lock()
+
+    def sweep(self, now: float):
+        # A bucket that has refilled completely is the same as no bucket, so idle users cost nothing
+        self.buckets = {
+            key: (tokens, last) for key, (tokens, last) in self.buckets.items()
+            if tokens + (now - last) * self.rate < self.burst
+        }
+        self.last_sweep = now
+
+    def acquire(self, key: str) -> Tuple[bool, float]:
+        now = time.monotonic()
+        with self.lock:
+            if now - self.last_sweep >= self.sweep_interval:
+                self.sweep(now)
+            tokens, last = self.buckets.get(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - last) * self.rate)
+            if tokens >= 1:
+                self.buckets[key] = (tokens - 1, now)
+                return True, 0.0
+            self.buckets[key] = (tokens, now)
+            return False, (1 - tokens) / self.rate
+
+
+class RedisRateLimiter:
+    # Refill and take in one round trip so concurrent workers cannot overspend a bucket
+    SCRIPT = """
+    local rate = tonumber(ARGV[1])
+    local burst = tonumber(ARGV[2])
+    local now = tonumber(ARGV[3])
+    local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+    local tokens = tonumber(bucket[1]) or burst
+    local ts = tonumber(bucket[2]) or now
+    tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+    local allowed = 0
+    if tokens >= 1 then
+        tokens = tokens - 1
+        allowed = 1
+    end
+    redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+    redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+    return {allowed, tostring(tokens)}
+    """
+
+    def __init__(self, url: str, rate_per_minute: float = RATE_LIMIT_PER_MINUTE, burst: float = RATE_LIMIT_BURST):
+        import redis
+
+        self.client = redis.Redis.from_url(url)
+        self.script = self.client.register_script(self.SCRIPT)
+        self.rate = rate_per_minute / 60.0
+        self.burst = burst
+
+    def acquire(self, key: str) -> Tuple[bool, float]:
+        allowed, tokens = self.script(keys=[f"ratelimit:{key}"], args=[self.rate, self.burst, time.time()])
+        if allowed:
+            return True, 0.0
+        return False, (1 - float(tokens)) / self.rate
+
+
+class ConcurrencyLimiter:
+    """Caps in-flight requests and sheds load before the queue wait breaks the latency SLO.
+
+    The expected wait is estimated from the queue position and an EWMA of recent service
+    times, so overloaded requests are refused immediately instead of timing out later.
+    A request takes ``cost`` slots, one per LLM call it makes (capped at ``max_inflight``).
+    Waiters are admitted strictly in arrival order: a request only enters once it is at
+    the head of the queue, so a group request is not starved by single-slot ones that
+    keep fitting into the slots it is waiting for.
+    """
+
+    def __init__(self, max_inflight: int = MAX_INFLIGHT, max_queue: int = ADMISSION_QUEUE_SIZE,
+                 slo_ms: float = LATENCY_SLO_MS):
+        self.max_inflight = max_inflight
+        self.max_queue = max_queue
+        self.slo = slo_ms / 1000.0
+        self.inflight = 0
+        self.queued = 0
+        self.waiters: deque = deque()  # tickets of queued requests, oldest first
+        self.service_time = 1.0
+        self.condition = threading.Condition()
+
+    def expected_wait(self, position: int) -> float:
+        return math.ceil(position / self.max_inflight) * self.service_time
+
+    def enter(self, cost: int = 1) -> Tuple[bool, float]:
+        cost = max(1, min(cost, self.max_inflight))
+        with self.condition:
+            if self.inflight + cost <= self.max_inflight and not self.waiters:
+                self.inflight += cost
+                return True, 0.0
+            wait = self.expected_wait(self.queued + cost)
+            if self.queued + cost > self.max_queue or wait > self.slo:
+                return False, wait
+            ticket = object()
+            self.waiters.append(ticket)
+            self.queued += cost
+            deadline = time.monotonic() + self.slo
+            try:
+                while self.waiters[0] is not ticket or self.inflight + cost > self.max_inflight:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return False, self.expected_wait(self.queued)
+                    self.condition.wait(remaining)
+            finally:
+                self.waiters.remove(ticket)
+                self.queued -= cost
+                # The next waiter is now at the head and may fit as well
+                self.condition.notify_all()
+            self.inflight += cost
+            return True, 0.0
+
+    def exit(self, elapsed: float, cost: int = 1):
+        cost = max(1, min(cost, self.max_inflight))
+        with self.condition:
+            self.inflight -= cost
+            self.service_time = 0.8 * self.service_time + 0.2 * elapsed
+            # Every waiter wakes, but only the head of the queue may take the freed slots
+            self.condition.notify_all()
+
+
+def create_rate_limiter():
+    if ADMISSION_REDIS_URL:
+        try:
+            return RedisRateLimiter(ADMISSION_REDIS_URL)
+        except Exception as e:
+            logging.error(f"Redis rate limiter unavailable, falling back to memory: {str(e)}")
+    return MemoryRateLimiter()
+
+
+rate_limiter = create_rate_limiter()
+concurrency_limiter = ConcurrencyLimiter()
+
+
+def rejected(status: int, message: str, retry_after: float):
+    response = jsonify({"error": message})
+    response.headers["Retry-After"] = str(max(1, math.ceil(retry_after)))
+    return response, status
+
+
+# Admission Control Middleware, applied after verify_firebase_token so request.user is set.
+# Used bare, or as admission_control(cost=fn) where fn() is the number of LLM calls the
+# request will make.
+def admission_control(f: Optional[Callable] = None, cost: Optional[Callable[[], int]] = None):
+    if f is None:
+        return lambda view: admission_control(view, cost=cost)
+
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        try:
+            allowed, retry_after = rate_limiter.acquire(request.user["uid"])
+        except Exception as e:
+            # A broken shared store should not take the chat endpoint down with it
+            logging.error(f"Rate limiter error: {str(e)}")
+            allowed, retry_after = True, 0.0
+        if not allowed:
+            return rejected(429, "Too many requests", retry_after)
+
+        slots = cost() if cost else 1
+        admitted, retry_after = concurrency_limiter.enter(slots)
+        if not admitted:
+            return rejected(503, "Server is busy, please retry", retry_after)
+        start = time.monotonic()
+
+        def release():
+            concurrency_limiter.exit(time.monotonic() - start, slots)
+
+        try:
+            response = f(*args, **kwargs)
+        except Exception:
+            release()
+            raise
+        if isinstance(response, Response) and response.is_streamed:
+            # The LLM work of a streamed response happens while it is sent, so the slots are
+            # held until the server closes it (finished, failed or client gone)
+            response.call_on_close(release)
+        else:
+            release()
+        return response
+
+    return decorated_function
@@ -1,21 +1,30 @@
 import os
 import json
+import atexit
 import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 from enum import Enum
 from functools import wraps
-from typing import Dict, List
+from typing import TYPE_CHECKING, Dict, List
 
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, stream_with_context
 from flask_cors import CORS
-from pymongo import MongoClient
-from bson import ObjectId
-import firebase_admin
-from firebase_admin import credentials, auth
 from dotenv import load_dotenv
-from langchain_groq import ChatGroq
-from langchain.chains import LLMChain
-from langchain.prompts import PromptTemplate
+
+from prompts import compile_prompt
+from startup import STARTUP_MODE, Lazy, LazyCollection, Warmup
+from summarizer import ConversationSummarizer
+from chat_writer import ChatWriter
+from admission import admission_control, rejected
+from backends import BackendRouter, GenerationRequest, GroqBackend, LocalBudBackend
+from history import HISTORY_PAGE_SIZE, ensure_history_index, export_history, history_page
+from response_cache import RESPONSE_CACHE_ENABLED, ResponseCache
+from user_stats import STATS_TREND_DAYS, UserStats, ensure_stats_index
+from retention import ensure_retention_index
+
+if TYPE_CHECKING:
+    from langchain.prompts import PromptTemplate
 
 # Load environment variables
 load_dotenv()
@@ -27,20 +36,75 @@ CORS(app)
 # Logging setup
 logging.basicConfig(level=logging.INFO)
 
-# Initialize Firebase Admin
-firebase_cred_path = os.getenv("FIREBASE_CREDENTIALS")
-if not firebase_cred_path or not os.path.exists(firebase_cred_path):
-    raise ValueError("Firebase credentials file not found.")
+# Heavy SDKs are imported inside these factories so that importing the app stays cheap
+# and STARTUP_MODE decides when they are paid for
+def init_firebase():
+    import firebase_admin
+    from firebase_admin import credentials, auth
+
+    firebase_cred_path = os.getenv("FIREBASE_CREDENTIALS")
+    if not firebase_cred_path or not os.path.exists(firebase_cred_path):
+        raise ValueError("Firebase credentials file not found.")
+
+    cred = credentials.Certificate(firebase_cred_path)
+    firebase_admin.initialize_app(cred)
+    return auth
+
+def init_mongo():
+    from pymongo import MongoClient
+
+    mongo_client = MongoClient(os.getenv("MONGO_URI"))
+    db = mongo_client[os.getenv("MONGO_DB_NAME", "test")]
+    ensure_history_index(db["chats"])
+    ensure_stats_index(db["user_stats"])
+    ensure_retention_index(db["chats"])
+    return db
+
+def init_langchain():
+    from langchain_groq import ChatGroq
+    from langchain.chains import LLMChain
+    from langchain.prompts import PromptTemplate
+
+    return ChatGroq, LLMChain, PromptTemplate
+
+firebase = Lazy("firebase", init_firebase)
+mongo = Lazy("mongo", init_mongo)
+langchain_classes = Lazy("langchain", init_langchain)
+# Serve BUD from the local fine-tuned model as well, with Groq as the spill-over backend
+BUD_LOCAL = os.getenv("BUD_LOCAL", "0") == "1"
 
-cred = credentials.Certificate(firebase_cred_path)
-firebase_admin.initialize_app(cred)
+def init_bud_model():
+    from inference import load_bud_model
 
-# Initialize MongoDB
-mongo_uri = os.getenv("MONGO_URI")
-mongo_client = MongoClient(mongo_uri)
-db = mongo_client[os.getenv("MONGO_DB_NAME", "test")]
-chat_collection = db["chats"]
-user_collection = db["users"]
+    return load_bud_model()
+
+bud_model = Lazy("bud_model", init_bud_model)
+warmup = Warmup([firebase, mongo, langchain_classes] + ([bud_model] if BUD_LOCAL else []))
+
+chat_collection = LazyCollection(mongo, "chats")
+user_collection = LazyCollection(mongo, "users")
+summary_collection = LazyCollection(mongo, "chat_summaries")
+stats_collection = LazyCollection(mongo, "user_stats")
+
+# Rolling conversation summaries, compacted off the request path
+summarizer = ConversationSummarizer(chat_collection, summary_collection)
+
+# Chat logs are written behind the response in batches and drained on shutdown
+chat_writer = ChatWriter(chat_collection)
+
+def enqueue_summaries(docs: List[Dict]):
+    for user_id, character in {(doc["user_id"], doc["character"]) for doc in docs}:
+        summarizer.enqueue(user_id, character)
+
+chat_writer.add_flush_listener(enqueue_summaries)
+# Usage stats are folded into one document per user as each batch lands
+user_stats = UserStats(stats_collection)
+chat_writer.add_flush_listener(user_stats.record)
+atexit.register(chat_writer.close)
+
+# Shared pool for fanning one message out to several characters
+GROUP_CHAT_WORKERS = int(os.getenv("GROUP_CHAT_WORKERS", "8"))
+group_chat_executor = ThreadPoolExecutor(max_workers=GROUP_CHAT_WORKERS, thread_name_prefix="group-chat")
 
 # Enum for Characters
 class Character(Enum):
@@ -56,9 +120,20 @@ def verify_firebase_token(f):
         if not auth_header:
             return jsonify({"error": "No authorization token provided"}), 401
 
+        # A cold or broken Firebase client is a server problem, not a bad token
+        if STARTUP_MODE == "background" and not firebase.ready:
+            warmup.start()
+            return rejected(503, "Authentication is starting up, please retry", warmup.retry_interval)
+        try:
+            firebase_auth = firebase.get()
+        except Exception as e:
+            logging.error(f"Firebase unavailable: {str(e)}")
+            warmup.start()
+            return rejected(503, "Authentication is unavailable, please retry", warmup.retry_interval)
+
         try:
             token = auth_header.split("Bearer ")[1]
-            decoded_token = auth.verify_id_token(token)
+            decoded_token = firebase_auth.verify_id_token(token)
             request.user = decoded_token
             return f(*args, **kwargs)
         except Exception as e:
@@ -84,6 +159,7 @@ class CharacterChat:
         self.personality_context = load_personality_context(user_personality)
         self.context = ""
 
+        ChatGroq, LLMChain, _ = langchain_classes.get()
         self.llm = ChatGroq(
             model="mixtral-8x7b-32768",
             temperature=0.6,
@@ -94,91 +170,82 @@ class CharacterChat:
         self.prompt_template = self.create_prompt_template()
         self.chain = LLMChain(llm=self.llm, prompt=self.prompt_template)
 
-    def create_prompt_template(self) -> PromptTemplate:
-        if self.character_type == Character.BUD:
-            template = f"""
-            You are BUD, an AI companion designed to support mental health. Keep your responses warm, conversational, and supportive, without sounding robotic.
-            
-            Guidelines:
-            - Be direct but caring.
-            - Encourage small steps toward improvement.
-            - Inject light humor where appropriate.
-            - Use casual phrasing rather than formal structure.
-            - **Internal Note:** Use the following personality context to guide your tone, but do not mention it in your response: {self.personality_context}
-            
-            Examples:
-            1. User: "I feel like a failure."
-               BUD: "Hey, no way. You're just in a tough spot right now. Even legends have bad days—Batman lost his parents, and look where he ended up. Take a deep breath, one step at a time."
-            
-            2. User: "I'm so stressed about exams."
-               BUD: "I hear you. Exams suck. But hey, you've prepared for this, and cramming now won't help. Take a break, grab a snack, and come back stronger."
-            
-            3. User: "Nobody likes me."
-               BUD: "That's not true. You're probably just in a rough patch. You ever see a cat try to jump on a table and fail? Embarrassing, but does it stop being cute? No. Same logic applies to you."
-            
-            Context from previous interactions: {{context}}
-            
-            Human: {{user_input}}
-            
-            Respond as BUD would:
-            """
-        elif self.character_type == Character.LUFFY:
-            template = f"""
-            You are Monkey D. Luffy, the future Pirate King! Your responses should be full of energy, fun, and randomness.
-            
-            Guidelines:
-            - Always bring up food.
-            - Be optimistic, no matter what.
-            - Use simple, direct language.
-            - Laugh a lot and use catchphrases.
-            - **Internal Note:** Use the following personality context to guide your tone, but do not reference it in your response: {self.personality_context}
-            
-            Examples:
-            1. User: "I'm feeling down."
-               Luffy: "Then stand up! Or eat some meat! Meat makes everything better! *Shishishi!*"
-            
-            2. User: "I'm not motivated to work."
-               Luffy: "What? You need motivation? Think of it like finding the One Piece! Keep going till you get it, or at least get some food on the way!"
-            
-            3. User: "I have a big problem."
-               Luffy: "Is it bigger than a Sea King? No? Then it's not that big! Punch through it!"
-            
-            Context from previous interactions: {{context}}
-            
-            Human: {{user_input}}
-            
-            Respond as Luffy would:
-            """
-        else:  # Deadpool
-            template = f"""
-            You are Deadpool. You are chaotic, hilarious, and totally unfiltered. You break the fourth wall constantly, insult the user *lovingly*, and make pop culture references.
-            
-            Guidelines:
-            - Be sarcastic and witty.
-            - Call out clichés and generic questions.
-            - Swear heavily for comedic effect, but keep it edgy without being overly explicit.
-            - Roasting the user is encouraged but in a fun way.
-            - **Internal Note:** Use the following personality context to guide your tone, but do not mention it in your response: {self.personality_context}
-            
-            Examples:
-            1. User: "I feel sad."
-               Deadpool: "Aww, you poor thing. Here, let me play the world’s smallest violin for you... oh wait, I can’t because I HAVE NO HANDS. Just kidding, but seriously, what’s up?"
-            
-            2. User: "I have no motivation to work."
-               Deadpool: "Neither do I, but here we are. Just slap your brain a few times and get going. Or go full goblin mode—your call."
-            
-            3. User: "Give me life advice."
-               Deadpool: "Step 1: Don’t die. Step 2: If Step 1 fails, you really messed up. Step 3: If you’re still alive, stop overthinking and eat some tacos."
-            
-            Context from previous interactions: {{context}}
-            
-            Human: {{user_input}}
-            
-            Respond as Deadpool would:
-            """
-        return PromptTemplate(template=template, input_variables=["context", "user_input"])
+    def create_prompt_template(self) -> "PromptTemplate":
+        PromptTemplate = langchain_classes.get()[2]
+        self.compiled_prompt = compile_prompt(self.character_type.value, self.personality_context)
+        return PromptTemplate(template=self.compiled_prompt.template, input_variables=["context", "user_input"])
+
+    def run(self, context: str, user_input: str) -> str:
+        rendered = self.compiled_prompt.render(context, user_input)
+        logging.info(
+            f"Prompt tokens for {self.character_type.value}: prefix={rendered.prefix_tokens} "
+            f"dynamic={rendered.dynamic_tokens} total={rendered.total_tokens} trimmed_blocks={rendered.trimmed_blocks}"
+        )
+        return self.chain.run({"context": rendered.context, "user_input": user_input})
+
+# Generation backends and the router that picks one per request
+backends = [GroqBackend(lambda character, personality_type: CharacterChat(Character(character), personality_type))]
+if BUD_LOCAL:
+    def bud_model_ready() -> bool:
+        if not bud_model.ready:
+            warmup.start()
+        return bud_model.ready
+
+    backends.append(LocalBudBackend(bud_model.get, ready=bud_model_ready))
+router = BackendRouter(
+    backends,
+    preferences={
+        Character.BUD.value: ["local_bud", "groq"],
+        Character.LUFFY.value: ["groq"],
+        Character.DEADPOOL.value: ["groq"],
+    },
+)
+
+def generation_request(character_type: Character, personality_type: str, context: str, message: str) -> GenerationRequest:
+    return GenerationRequest(
+        character=character_type.value,
+        personality_type=personality_type,
+        personality_context=load_personality_context(personality_type),
+        context=context,
+        user_input=message,
+    )
+
+# Near-duplicate messages with little or no context reuse earlier replies instead of calling the LLM
+response_cache = ResponseCache() if RESPONSE_CACHE_ENABLED else None
+
+def generate_reply(character_type: Character, personality_type: str, context: str, message: str) -> str:
+    if response_cache is not None:
+        cached = response_cache.get(character_type.value, personality_type, message, context)
+        if cached is not None:
+            return cached
+    response = router.generate(generation_request(character_type, personality_type, context, message))
+    if response_cache is not None:
+        response_cache.put(character_type.value, personality_type, message, response, context)
+    return response
 
 # API Endpoints
+@app.route("/healthz", methods=["GET"])
+def healthz():
+    return jsonify({"status": "ok"})
+
+@app.route("/readyz", methods=["GET"])
+def readyz():
+    if not warmup.is_ready():
+        # A readiness probe is the earliest sign traffic is coming, start warming up now
+        warmup.start()
+        return jsonify(warmup.status()), 503
+    return jsonify(warmup.status())
+
+@app.route("/metrics/routing", methods=["GET"])
+def routing_metrics():
+    return jsonify(router.metrics())
+
+@app.route("/metrics/cache", methods=["GET"])
+def cache_metrics():
+    if response_cache is None:
+        return jsonify({"enabled": False})
+    return jsonify({"enabled": True, **response_cache.metrics()})
+
 @app.route("/api/personality", methods=["POST"])
 @verify_firebase_token
 def save_personality():
@@ -206,6 +273,7 @@ def get_personality():
 
 @app.route("/api/chat", methods=["POST"])
 @verify_firebase_token
+@admission_control
 def chat():
     data = request.json
     user_id = request.user["uid"]
@@ -215,22 +283,15 @@ def chat():
         return jsonify({"error": "User personality not found"}), 400
 
     character_type = Character(data["character"])
-    chat_instance = CharacterChat(character_type, user_data["personality_type"])
 
-    conversation_history = list(
-        chat_collection.find({"user_id": user_id, "character": character_type.value})
-        .sort("timestamp", -1)
-        .limit(5)
+    # One short summary plus the last raw turns instead of the full last five exchanges
+    context = summarizer.get_context(
+        user_id, character_type.value, pending=chat_writer.pending(user_id, character_type.value)
     )
 
-    response = chat_instance.chain.run({
-        "context": "\n".join(
-            [f"User: {msg['content']}\n{msg['character']}: {msg['response']}" for msg in conversation_history]
-        ),
-        "user_input": data["message"],
-    })
+    response = generate_reply(character_type, user_data["personality_type"], context, data["message"])
 
-    chat_collection.insert_one({
+    chat_writer.submit({
         "user_id": user_id,
         "character": character_type.value,
         "content": data["message"],
@@ -240,5 +301,123 @@ def chat():
 
     return jsonify({"response": response, "character": character_type.value})
 
+def group_chat_cost() -> int:
+    # One LLM call per selected character, so a group request holds that many admission slots
+    characters = (request.get_json(silent=True) or {}).get("characters")
+    if isinstance(characters, list) and characters and all(isinstance(name, str) for name in characters):
+        return len(set(characters))
+    return len(Character)
+
+@app.route("/api/chat/group", methods=["POST"])
+@verify_firebase_token
+@admission_control(cost=group_chat_cost)
+def group_chat():
+    data = request.json
+    user_id = request.user["uid"]
+    message = data["message"]
+
+    names = data.get("characters", [c.value for c in Character])
+    if not isinstance(names, list) or not all(isinstance(name, str) for name in names):
+        return jsonify({"error": "characters must be a list of character names"}), 400
+    try:
+        characters = [Character(name) for name in names]
+    except ValueError:
+        return jsonify({"error": "Unknown character"}), 400
+    characters = list(dict.fromkeys(characters))
+    if not characters:
+        return jsonify({"error": "No characters selected"}), 400
+
+    user_data = user_collection.find_one({"user_id": user_id}, {"personality_type": 1})
+    if not user_data:
+        return jsonify({"error": "User personality not found"}), 400
+    personality_type = user_data["personality_type"]
+
+    contexts = summarizer.get_contexts(
+        user_id, [c.value for c in characters], pending=chat_writer.pending(user_id)
+    )
+
+    def reply(character_type: Character) -> Dict:
+        try:
+            response = generate_reply(character_type, personality_type, contexts[character_type.value], message)
+            return {"character": character_type.value, "response": response}
+        except Exception as e:
+            logging.error(f"Group chat error for {character_type.value}: {str(e)}")
+            return {"character": character_type.value, "error": "Failed to generate a response"}
+
+    # All characters run concurrently, so latency is the slowest reply rather than the sum
+    futures = [group_chat_executor.submit(reply, character_type) for character_type in characters]
+
+    def save(replies: List[Dict]):
+        timestamp = datetime.utcnow()
+        chat_writer.submit_many([
+            {
+                "user_id": user_id,
+                "character": item["character"],
+                "content": message,
+                "response": item["response"],
+                "timestamp": timestamp,
+            }
+            for item in replies if "response" in item
+        ])
+
+    if data.get("stream"):
+        def generate():
+            replies = []
+            try:
+                for future in as_completed(futures):
+                    replies.append(future.result())
+                    yield json.dumps(replies[-1], ensure_ascii=False) + "\n"
+            finally:
+                # Keep the replies already generated even if the client went away mid-stream
+                save(replies)
+
+        return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+    replies = [future.result() for future in futures]
+    save(replies)
+    return jsonify({"responses": replies})
+
+@app.route("/api/history", methods=["GET"])
+@verify_firebase_token
+def get_history():
+    user_id = request.user["uid"]
+    try:
+        character_type = Character(request.args.get("character", ""))
+    except ValueError:
+        return jsonify({"error": "Unknown or missing character"}), 400
+    cursor = request.args.get("cursor")
+
+    try:
+        if request.args.get("format") == "ndjson":
+            return Response(
+                stream_with_context(export_history(chat_collection, user_id, character_type.value, cursor)),
+                mimetype="application/x-ndjson",
+            )
+
+        page = history_page(
+            chat_collection,
+            user_id,
+            character_type.value,
+            cursor=cursor,
+            limit=request.args.get("limit", HISTORY_PAGE_SIZE, type=int),
+            pending=chat_writer.pending(user_id, character_type.value),
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    return jsonify({"status": "success", "character": character_type.value, **page})
+
+@app.route("/api/stats", methods=["GET"])
+@verify_firebase_token
+def get_stats():
+    user_id = request.user["uid"]
+    stats = user_stats.get(user_id, days=request.args.get("days", STATS_TREND_DAYS, type=int))
+    if not stats:
+        return jsonify({"status": "error", "message": "No stats yet"}), 404
+    return jsonify({"status": "success", "stats": stats})
+
+# Turns older than CHAT_HOT_DAYS are archived by a scheduled `archive_chats.py run`, not here
+warmup.boot()
+
 if __name__ == "__main__":
     app.run(debug=True)
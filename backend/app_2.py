@@ -1,36 +1,56 @@
 from flask import Flask, request, jsonify
 from inference import Character, CharacterChat, get_character_greeting, create_emotion_analyzer, get_user_personality
-from inference import load_personality_context
-from unsloth import FastLanguageModel
-import torch
+from inference import load_personality_context, load_bud_model
+from startup import Lazy, Warmup, STARTUP_MODE
 
 app = Flask(__name__)
 
-# Load models for BUD character
-def load_bud_model():
-    bud_model, bud_tokenizer = FastLanguageModel.from_pretrained(
-        model_name="fine_tuned_llama_samantha_bud",
-        max_seq_length=4096,
-        dtype=torch.bfloat16,
-        load_in_4bit=True,
-        device_map="auto",
-    )
-    FastLanguageModel.for_inference(bud_model)
-    return bud_model, bud_tokenizer
-
-bud_model, bud_tokenizer = load_bud_model()
-emotion_chain = create_emotion_analyzer()
+# The 7B model and the emotion chain are built by the warmup instead of at import,
+# so the server can answer health checks while they load
+bud = Lazy("bud_model", load_bud_model)
+emotion = Lazy("emotion_analyzer", create_emotion_analyzer)
+warmup = Warmup([emotion, bud])
 
 global_conversation_history = []
 selected_character = Character.BUD
 user_personality = "ISTJ"  # Default personality
-dialogue_system = CharacterChat(
-    character_type=selected_character,
-    user_personality=user_personality,
-    conversation_history=global_conversation_history,
-    bud_model=bud_model,
-    bud_tokenizer=bud_tokenizer
-)
+dialogue_system = None
+
+def warm(component: Lazy):
+    # In background mode a cold component is reported instead of blocking the request
+    if not component.ready and STARTUP_MODE == "background":
+        warmup.start()
+        return None
+    return component.get()
+
+def create_dialogue_system(character: Character):
+    bud_parts = warm(bud) if character == Character.BUD else (None, None)
+    if bud_parts is None:
+        return None
+    bud_model, bud_tokenizer = bud_parts
+    return CharacterChat(
+        character_type=character,
+        user_personality=user_personality,
+        conversation_history=global_conversation_history,
+        bud_model=bud_model,
+        bud_tokenizer=bud_tokenizer
+    )
+
+def warming_up():
+    response = jsonify({"error": "Model is warming up, please retry", **warmup.status()})
+    response.headers["Retry-After"] = "10"
+    return response, 503
+
+@app.route("/healthz", methods=["GET"])
+def healthz():
+    return jsonify({"status": "ok"})
+
+@app.route("/readyz", methods=["GET"])
+def readyz():
+    if not warmup.is_ready():
+        warmup.start()
+        return jsonify(warmup.status()), 503
+    return jsonify(warmup.status())
 
 @app.route("/select_character", methods=["POST"])
 def select_character():
@@ -47,13 +67,9 @@ def select_character():
     else:
         return jsonify({"error": "Invalid character selection"}), 400
     
-    dialogue_system = CharacterChat(
-        character_type=selected_character,
-        user_personality=user_personality,
-        conversation_history=global_conversation_history,
-        bud_model=bud_model if selected_character == Character.BUD else None,
-        bud_tokenizer=bud_tokenizer if selected_character == Character.BUD else None
-    )
+    dialogue_system = create_dialogue_system(selected_character)
+    if dialogue_system is None:
+        return warming_up()
     
     return jsonify({"message": get_character_greeting(selected_character)})
 
@@ -64,8 +80,9 @@ def set_personality():
     personality_type = data.get("personality", "ISTJ").upper()
     
     user_personality = personality_type
-    dialogue_system.user_personality = user_personality
-    dialogue_system.personality_context = load_personality_context(user_personality)
+    if dialogue_system is not None:
+        dialogue_system.user_personality = user_personality
+        dialogue_system.personality_context = load_personality_context(user_personality)
     
     return jsonify({"message": f"Personality set to {user_personality}"})
 
@@ -82,24 +99,25 @@ def chat():
         return jsonify({"response": "Goodbye! Come back soon!"})
     
     try:
-        joy_score = emotion_chain.run(user_input=user_input)
+        joy_score = emotion.get().run(user_input=user_input)
         joy_score = max(0.0, min(1.0, float(joy_score.strip())))
     except Exception:
         joy_score = 0.5 
     
     if joy_score < 0.2 and selected_character != Character.BUD:
         selected_character = Character.BUD
-        dialogue_system = CharacterChat(
-            character_type=Character.BUD,
-            user_personality=user_personality,
-            conversation_history=global_conversation_history,
-            bud_model=bud_model,
-            bud_tokenizer=bud_tokenizer
-        )
+        dialogue_system = None
+
+    if dialogue_system is None:
+        dialogue_system = create_dialogue_system(selected_character)
+        if dialogue_system is None:
+            return warming_up()
     
     response = dialogue_system.get_response(user_input)
     return jsonify({"character": selected_character.value, "response": response})
 
+warmup.boot()
+
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=5000)
 
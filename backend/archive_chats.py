@@ -0,0 +1,61 @@
+import os
+import sys
+import json
+import argparse
+import logging
+from datetime import date
+
+from dotenv import load_dotenv
+from pymongo import MongoClient
+
+from history import serialize_message
+from retention import (
+    CHAT_ARCHIVE_DIR, CHAT_HOT_DAYS, CHAT_RETENTION_MODE, RetentionJob, check_archive_dir, iter_archive,
+    restore_archive,
+)
+
+load_dotenv()
+logging.basicConfig(level=logging.INFO)
+
+
+def main():
+    # `run` deletes what it archives: schedule it from one place only, e.g. a daily cron job
+    parser = argparse.ArgumentParser(description="Archive old chat turns to disk, or read them back")
+    parser.add_argument("--archive-dir", default=CHAT_ARCHIVE_DIR)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("run", help="archive turns older than the hot window once")
+    run.add_argument("--hot-days", type=int, default=CHAT_HOT_DAYS)
+
+    for name, help_text in (("restore", "insert archived turns back into chats"), ("export", "print archived turns as NDJSON")):
+        command = commands.add_parser(name, help=help_text)
+        command.add_argument("--start", type=date.fromisoformat, required=True)
+        command.add_argument("--end", type=date.fromisoformat, required=True)
+        command.add_argument("--user-id")
+        command.add_argument("--character")
+
+    args = parser.parse_args()
+    if args.command == "run" and CHAT_RETENTION_MODE != "archive":
+        parser.error("CHAT_RETENTION_MODE is not 'archive', refusing to move chats out of Mongo")
+    try:
+        check_archive_dir(args.archive_dir)
+    except ValueError as e:
+        parser.error(str(e))
+
+    if args.command == "export":
+        # Same shape as /api/history?format=ndjson, ordered by day
+        for doc in iter_archive(args.archive_dir, args.start, args.end, args.user_id, args.character):
+            sys.stdout.write(json.dumps(serialize_message(doc), ensure_ascii=False) + "\n")
+        return
+
+    db = MongoClient(os.getenv("MONGO_URI"))[os.getenv("MONGO_DB_NAME", "test")]
+    if args.command == "run":
+        job = RetentionJob(db["chats"], db["chat_summaries"], archive_dir=args.archive_dir, hot_days=args.hot_days)
+        print(job.run_once())
+    else:
+        restored = restore_archive(db["chats"], args.archive_dir, args.start, args.end, args.user_id, args.character)
+        print(f"restored {restored} turns")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,234 @@
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import torch
+
+# Local BUD generation with drafted tokens verified in one forward pass of the main model.
+#
+# Drafts come from n-gram lookup: first in the current prompt and conversation (the model
+# often repeats names and phrases from it), then in a corpus of known BUD replies such as
+# the bud.json pairs. Verification samples every position from the main model's own
+# temperature/top-k/top-p distribution and keeps drafted tokens only while they match the
+# sample, so the output distribution is exactly that of plain sampling.
+
+
+class NGramDrafter:
+    def __init__(self, max_ngram: int = 3, min_ngram: int = 1, max_draft: int = 8):
+        self.max_ngram = max_ngram
+        self.min_ngram = min_ngram
+        self.max_draft = max_draft
+        self.sequences: List[List[int]] = []
+        self.index: Dict[Tuple[int, ...], Tuple[int, int]] = {}
+
+    def add(self, token_ids: Sequence[int]):
+        token_ids = list(token_ids)
+        seq = len(self.sequences)
+        self.sequences.append(token_ids)
+        for n in range(self.min_ngram, self.max_ngram + 1):
+            for pos in range(len(token_ids) - n):
+                # Later occurrences win, recent phrasing is the better guess
+                self.index[tuple(token_ids[pos:pos + n])] = (seq, pos + n)
+
+    def draft(self, context: Sequence[int], limit: Optional[int] = None) -> List[int]:
+        limit = self.max_draft if limit is None else min(limit, self.max_draft)
+        if limit <= 0:
+            return []
+        context = list(context)
+        for n in range(min(self.max_ngram, len(context) - 1), self.min_ngram - 1, -1):
+            tail = context[-n:]
+            # Prompt lookup: latest earlier occurrence of the tail in the context itself
+            for start in range(len(context) - n - 1, -1, -1):
+                if context[start:start + n] == tail:
+                    return context[start + n:start + n + limit]
+            hit = self.index.get(tuple(tail))
+            if hit is not None:
+                seq, pos = hit
+                return self.sequences[seq][pos:pos + limit]
+        return []
+
+
+@dataclass
+class GenerationStats:
+    new_tokens: int = 0
+    drafted: int = 0
+    accepted: int = 0
+    forward_passes: int = 0
+    seconds: float = 0.0
+    stopped_by: str = "length"
+    extra: Dict = field(default_factory=dict)
+
+    @property
+    def acceptance_rate(self) -> Optional[float]:
+        # None when nothing was drafted, so "no drafts" never reads as "every draft rejected"
+        return self.accepted / self.drafted if self.drafted else None
+
+    @property
+    def tokens_per_second(self) -> float:
+        return self.new_tokens / self.seconds if self.seconds else 0.0
+
+    @property
+    def tokens_per_forward(self) -> float:
+        return self.new_tokens / self.forward_passes if self.forward_passes else 0.0
+
+    def as_dict(self) -> Dict:
+        return {
+            "new_tokens": self.new_tokens,
+            "drafted": self.drafted,
+            "accepted": self.accepted,
+            "acceptance_rate": None if self.acceptance_rate is None else round(self.acceptance_rate, 3),
+            "forward_passes": self.forward_passes,
+            "tokens_per_forward": round(self.tokens_per_forward, 3),
+            "tokens_per_second": round(self.tokens_per_second, 2),
+            "seconds": round(self.seconds, 3),
+            "stopped_by": self.stopped_by,
+            **self.extra,
+        }
+
+
+def sampling_processors(temperature: float, top_k: int, top_p: float):
+    from transformers import LogitsProcessorList, TemperatureLogitsWarper, TopKLogitsWarper, TopPLogitsWarper
+
+    # Same warpers, in the same order, as model.generate(do_sample=True, ...)
+    processors = LogitsProcessorList()
+    if temperature and temperature != 1.0:
+        processors.append(TemperatureLogitsWarper(temperature))
+    if top_k:
+        processors.append(TopKLogitsWarper(top_k=top_k, min_tokens_to_keep=1))
+    if top_p is not None and top_p < 1.0:
+        processors.append(TopPLogitsWarper(top_p=top_p, min_tokens_to_keep=1))
+    return processors
+
+
+def ngram_assisted_generate(model, input_ids: torch.Tensor, drafter: NGramDrafter, max_new_tokens: int = 150,
+                            temperature: float = 0.7, top_p: float = 0.9, top_k: int = 50,
+                            do_sample: bool = True, eos_token_id=None,
+                            stopping_criteria=None) -> Tuple[torch.Tensor, GenerationStats]:
+    from transformers import DynamicCache
+
+    if input_ids.shape[0] != 1:
+        raise ValueError("Assisted generation supports a single sequence")
+    eos_ids = set([eos_token_id] if isinstance(eos_token_id, int) else eos_token_id or [])
+    processors = sampling_processors(temperature, top_k, top_p)
+    stats = GenerationStats()
+    start = time.perf_counter()
+
+    tokens = input_ids[0].tolist()
+    prompt_len = len(tokens)
+    cache = DynamicCache()
+    pending = tokens[:]  # tokens the model has not seen yet
+    device = input_ids.device
+
+    while len(tokens) - prompt_len < max_new_tokens:
+        remaining = max_new_tokens - (len(tokens) - prompt_len)
+        draft = drafter.draft(tokens, limit=remaining - 1)
+        feed = torch.tensor([pending + draft], device=device)
+
+        with torch.no_grad():
+            logits = model(input_ids=feed, past_key_values=cache, use_cache=True).logits[0]
+        stats.forward_passes += 1
+        stats.drafted += len(draft)
+
+        # logits[offset + j] is the distribution for the token after draft[:j]
+        offset = len(pending) - 1
+        accepted = 0
+        next_token = None
+        prefix = torch.tensor([tokens], device=device)
+        for j in range(len(draft) + 1):
+            scores = processors(prefix, logits[offset + j].unsqueeze(0).float())
+            if do_sample:
+                sample = int(torch.multinomial(torch.softmax(scores, dim=-1), 1)[0, 0])
+            else:
+                sample = int(scores.argmax(dim=-1)[0])
+            if j < len(draft) and sample == draft[j]:
+                accepted += 1
+                prefix = torch.cat([prefix, feed.new_tensor([[sample]])], dim=1)
+                if sample in eos_ids:
+                    break
+                continue
+            next_token = sample
+            break
+
+        stats.accepted += accepted
+        tokens += draft[:accepted]
+        if next_token is not None:
+            tokens.append(next_token)
+        # Drop the cache entries of rejected draft tokens; the new token is fed next round.
+        # A negative count removes that many tokens (a positive one is a deprecated absolute
+        # length), and crop(0) must be avoided since older versions read it as "empty"
+        rejected = len(draft) - accepted
+        if rejected:
+            cache.crop(-rejected)
+        pending = [next_token] if next_token is not None else []
+
+        new_ids = torch.tensor([tokens], device=device)
+        if eos_ids.intersection(tokens[-(accepted + 1):]):
+            stats.stopped_by = "eos"
+            break
+        if stopping_criteria is not None and bool(stopping_criteria(new_ids, None).all()):
+            stats.stopped_by = "stop_sequence"
+            break
+        if not pending:
+            # Every drafted token was accepted up to an EOS; nothing left to verify
+            break
+
+    output = torch.tensor([tokens[:prompt_len + max_new_tokens]], device=device)
+    stats.new_tokens = output.shape[1] - prompt_len
+    stats.seconds = time.perf_counter() - start
+    return output, stats
+
+
+class ForwardCounter:
+    """Counts forward passes of a model, used to report tokens per verification step."""
+
+    def __init__(self, model):
+        self.calls = 0
+        self.handle = model.register_forward_hook(self._hook)
+
+    def _hook(self, module, inputs, output):
+        self.calls += 1
+
+    def remove(self):
+        self.handle.remove()
+
+
+def draft_model_generate(model, draft_model, input_ids: torch.Tensor, attention_mask=None,
+                         **generate_kwargs) -> Tuple[torch.Tensor, GenerationStats]:
+    # transformers' assisted generation; with do_sample=True it uses speculative sampling,
+    # which also preserves the main model's distribution
+    if draft_model is model:
+        raise ValueError("The draft model must be a separate model instance")
+    counter = ForwardCounter(model)
+    draft_counter = ForwardCounter(draft_model)
+    start = time.perf_counter()
+    try:
+        with torch.no_grad():
+            output = model.generate(
+                input_ids=input_ids, attention_mask=attention_mask, assistant_model=draft_model, **generate_kwargs
+            )
+    finally:
+        counter.remove()
+        draft_counter.remove()
+    new_tokens = output.shape[1] - input_ids.shape[1]
+    # generate() does not expose its acceptance counts, so they are derived from the hooks:
+    # the draft model runs one forward pass per drafted token, and each verification pass of
+    # the main model yields its accepted drafts plus one token of its own. A last round cut
+    # short by max_new_tokens or EOS makes ``accepted`` a slight underestimate.
+    stats = GenerationStats(
+        new_tokens=new_tokens,
+        drafted=draft_counter.calls,
+        accepted=min(draft_counter.calls, max(0, new_tokens - counter.calls)),
+        forward_passes=counter.calls,
+        seconds=time.perf_counter() - start,
+        stopped_by="generate",
+    )
+    stats.extra["num_assistant_tokens"] = getattr(draft_model.generation_config, "num_assistant_tokens", None)
+    return output, stats
+
+
+def build_drafter(tokenizer, texts: Sequence[str], **kwargs) -> NGramDrafter:
+    drafter = NGramDrafter(**kwargs)
+    for text in texts:
+        if text:
+            drafter.add(tokenizer.encode(text, add_special_tokens=False))
+    return drafter
@@ -0,0 +1,252 @@
+import os
+import time
+import logging
+import threading
+from collections import Counter, deque
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Sequence
+
+from summarizer import parse_context
+
+# A backend whose queue-adjusted latency estimate is this many times worse than the best
+# alternative loses the request to that alternative
+ROUTER_SPILL_FACTOR = float(os.getenv("ROUTER_SPILL_FACTOR", "2.0"))
+# Spill regardless of latency once this many requests are waiting on a backend
+ROUTER_MAX_QUEUE = int(os.getenv("ROUTER_MAX_QUEUE", "4"))
+BACKEND_FAILURE_THRESHOLD = 3
+BACKEND_COOLDOWN_SECONDS = 30.0
+LATENCY_WINDOW = 100
+
+
+@dataclass(frozen=True)
+class GenerationRequest:
+    character: str
+    personality_type: str
+    personality_context: str
+    context: str
+    user_input: str
+
+
+class GenerationBackend:
+    """Common interface of every generation stack, with the live signals the router reads.
+
+    Subclasses implement ``_generate``. ``generate`` keeps the queue depth, a window of
+    recent latencies and a simple circuit breaker: after ``BACKEND_FAILURE_THRESHOLD``
+    consecutive failures the backend reports unhealthy for ``BACKEND_COOLDOWN_SECONDS``.
+    """
+
+    name = "backend"
+    characters: Optional[Sequence[str]] = None  # None serves every character
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.inflight = 0
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.consecutive_failures = 0
+        self.unhealthy_until = 0.0
+
+    def _generate(self, request: GenerationRequest) -> str:
+        raise NotImplementedError
+
+    def supports(self, character: str) -> bool:
+        return self.characters is None or character in self.characters
+
+    def generate(self, request: GenerationRequest) -> str:
+        with self.lock:
+            self.inflight += 1
+        start = time.monotonic()
+        try:
+            response = self._generate(request)
+        except Exception:
+            with self.lock:
+                self.consecutive_failures += 1
+                if self.consecutive_failures >= BACKEND_FAILURE_THRESHOLD:
+                    self.unhealthy_until = time.monotonic() + BACKEND_COOLDOWN_SECONDS
+            raise
+        else:
+            with self.lock:
+                self.latencies.append(time.monotonic() - start)
+                self.consecutive_failures = 0
+                self.unhealthy_until = 0.0
+            return response
+        finally:
+            with self.lock:
+                self.inflight -= 1
+
+    @property
+    def healthy(self) -> bool:
+        return time.monotonic() >= self.unhealthy_until
+
+    @property
+    def queue_depth(self) -> int:
+        return self.inflight
+
+    def latency_percentile(self, pct: float) -> Optional[float]:
+        with self.lock:
+            values = sorted(self.latencies)
+        if not values:
+            return None
+        return values[min(len(values) - 1, int(len(values) * pct / 100.0))]
+
+    def status(self) -> Dict:
+        return {
+            "healthy": self.healthy,
+            "queue_depth": self.queue_depth,
+            "p50": self.latency_percentile(50),
+            "p95": self.latency_percentile(95),
+            "samples": len(self.latencies),
+        }
+
+
+class GroqBackend(GenerationBackend):
+    name = "groq"
+
+    def __init__(self, chat_factory: Callable[[str, str], object]):
+        # chat_factory(character, personality_type) returns an object with run(context, user_input)
+        super().__init__()
+        self.chat_factory = chat_factory
+
+    def _generate(self, request: GenerationRequest) -> str:
+        chat = self.chat_factory(request.character, request.personality_type)
+        return chat.run(request.context, request.user_input)
+
+
+class LocalBudBackend(GenerationBackend):
+    name = "local_bud"
+    characters = ("bud",)
+
+    def __init__(self, model_loader: Callable[[], tuple], ready: Callable[[], bool] = lambda: True):
+        super().__init__()
+        self.model_loader = model_loader
+        self.ready = ready
+        # One generation at a time per model; everything else waits and shows up as queue depth
+        self.model_lock = threading.Lock()
+
+    @property
+    def healthy(self) -> bool:
+        # A model that is still loading is routed around like an unhealthy one
+        return self.ready() and super().healthy
+
+    def _generate(self, request: GenerationRequest) -> str:
+        from inference import generate_bud_reply
+
+        model, tokenizer = self.model_loader()
+        input_text = bud_prompt(request)
+        with self.model_lock:
+            response, _ = generate_bud_reply(model, tokenizer, input_text)
+        return response
+
+
+def bud_prompt(request: GenerationRequest) -> str:
+    # The summarizer's "User:/bud:" context rewritten into the turn markers BUD was
+    # fine-tuned on, in the same layout as inference.CharacterChat
+    summary, turns = parse_context(request.context, request.character)
+    lines = [f"Personality Context: {request.personality_context}"]
+    if summary:
+        lines.append(f"<|system|> Summary of earlier conversation: {summary}")
+    for turn in turns:
+        lines.append(f"<|user|>\n{turn['content']}\n<|assistant|>\n{turn['response']}")
+    lines.append(f"<|user|>\n{request.user_input}\n<|assistant|>")
+    return "\n".join(lines)
+
+
+class FakeBackend(GenerationBackend):
+    """Deterministic backend for tests and benchmarks.
+
+    ``latencies`` is cycled through per call, ``failures`` lists the call numbers (from 1)
+    that raise, and the reply is always ``"<name>:<character>:<user_input>"``.
+    """
+
+    def __init__(self, name: str, latencies: Sequence[float] = (0.0,), failures: Sequence[int] = (),
+                 characters: Optional[Sequence[str]] = None, sleep: Callable[[float], None] = time.sleep):
+        super().__init__()
+        self.name = name
+        self.characters = characters
+        self.script = list(latencies)
+        self.failures = set(failures)
+        self.sleep = sleep
+        self.calls = 0
+
+    def _generate(self, request: GenerationRequest) -> str:
+        with self.lock:
+            self.calls += 1
+            call = self.calls
+        self.sleep(self.script[(call - 1) % len(self.script)])
+        if call in self.failures:
+            raise RuntimeError(f"{self.name} failed on call {call}")
+        return f"{self.name}:{request.character}:{request.user_input}"
+
+
+class BackendRouter:
+    def __init__(self, backends: List[GenerationBackend], preferences: Dict[str, List[str]],
+                 spill_factor: float = ROUTER_SPILL_FACTOR, max_queue: int = ROUTER_MAX_QUEUE):
+        self.backends = {backend.name: backend for backend in backends}
+        self.preferences = preferences
+        self.spill_factor = spill_factor
+        self.max_queue = max_queue
+        self.lock = threading.Lock()
+        self.decisions = Counter()
+
+    def candidates(self, character: str) -> List[GenerationBackend]:
+        names = self.preferences.get(character) or list(self.backends)
+        return [self.backends[name] for name in names if name in self.backends and self.backends[name].supports(character)]
+
+    @staticmethod
+    def estimate(backend: GenerationBackend) -> float:
+        # Pessimistic time to finish a new request: wait behind the queue, then one service time
+        p95 = backend.latency_percentile(95)
+        if p95 is None:
+            return 0.0
+        return p95 * (backend.queue_depth + 1)
+
+    def choose(self, character: str) -> List[GenerationBackend]:
+        """Returns the candidates in the order they should be tried and records why."""
+        candidates = self.candidates(character)
+        if not candidates:
+            raise ValueError(f"No backend can serve {character}")
+        healthy = [backend for backend in candidates if backend.healthy]
+        ordered = healthy or candidates
+        preferred = ordered[0]
+        reason = "preferred" if preferred is candidates[0] else "unhealthy"
+
+        alternatives = ordered[1:]
+        if alternatives:
+            best = min(alternatives, key=self.estimate)
+            if preferred.queue_depth >= self.max_queue and best.queue_depth < self.max_queue:
+                reason = "queue_depth"
+            elif self.estimate(preferred) > self.spill_factor * self.estimate(best) > 0:
+                reason = "latency"
+            if reason in ("queue_depth", "latency"):
+                ordered = [best] + [backend for backend in ordered if backend is not best]
+
+        if not healthy:
+            reason = "all_unhealthy"
+        self._record(character, ordered[0].name, reason)
+        return ordered + [backend for backend in candidates if backend not in ordered]
+
+    def generate(self, request: GenerationRequest) -> str:
+        last_error = None
+        for attempt, backend in enumerate(self.choose(request.character)):
+            if attempt:
+                self._record(request.character, backend.name, "fallback")
+            try:
+                return backend.generate(request)
+            except Exception as e:
+                logging.error(f"Backend {backend.name} failed for {request.character}: {str(e)}")
+                last_error = e
+        raise last_error
+
+    def _record(self, character: str, backend: str, reason: str):
+        with self.lock:
+            self.decisions[(character, backend, reason)] += 1
+
+    def metrics(self) -> Dict:
+        with self.lock:
+            decisions = [
+                {"character": character, "backend": backend, "reason": reason, "count": count}
+                for (character, backend, reason), count in sorted(self.decisions.items())
+            ]
+        return {
+            "backends": {name: backend.status() for name, backend in self.backends.items()},
+            "decisions": decisions,
+        }
@@ -0,0 +1,25 @@
+import os
+import argparse
+import logging
+
+from dotenv import load_dotenv
+from pymongo import MongoClient
+
+from user_stats import backfill_user_stats, ensure_stats_index
+
+load_dotenv()
+logging.basicConfig(level=logging.INFO)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild user_stats from the chats collection in one pass")
+    parser.add_argument("--batch-size", type=int, default=500, help="stats documents per bulk write")
+    args = parser.parse_args()
+
+    db = MongoClient(os.getenv("MONGO_URI"))[os.getenv("MONGO_DB_NAME", "test")]
+    ensure_stats_index(db["user_stats"])
+    backfill_user_stats(db["chats"], db["user_stats"], batch_size=args.batch_size)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+import time
+import runpy
+import random
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import Flask, request
+
+import admission
+from admission import ADMISSION_QUEUE_SIZE, MAX_INFLIGHT, ConcurrencyLimiter, MemoryRateLimiter, admission_control
+
+CAPACITY = MAX_INFLIGHT  # concurrent LLM calls the backend can actually serve per worker
+SERVICE_MS = 200.0
+SLO_MS = 1000.0
+HEALTH_INTERVAL_MS = 100.0
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100.0))]
+
+
+def make_app(admission_enabled: bool):
+    app = Flask(__name__)
+    backend = threading.Semaphore(CAPACITY)
+    rng = random.Random(1)
+
+    @app.before_request
+    def fake_auth():
+        request.user = {"uid": request.headers["X-User"]}
+
+    def chat():
+        with backend:
+            time.sleep(rng.uniform(0.5, 1.5) * SERVICE_MS / 1000.0)
+        return {"response": "ok"}
+
+    app.add_url_rule("/api/chat", "chat", admission_control(chat) if admission_enabled else chat)
+    app.add_url_rule("/healthz", "healthz", lambda: {"status": "ok"})
+    return app
+
+
+def run(label: str, threads: int, load: float, seconds: float, admission_enabled: bool):
+    # One gthread worker: a fixed pool of threads in front of an unbounded accept queue
+    admission.concurrency_limiter = ConcurrencyLimiter(
+        max_inflight=MAX_INFLIGHT, max_queue=ADMISSION_QUEUE_SIZE, slo_ms=SLO_MS
+    )
+    admission.rate_limiter = MemoryRateLimiter(rate_per_minute=600, burst=20)
+    app = make_app(admission_enabled)
+    latencies, health = [], []
+    outcomes = Counter()
+    lock = threading.Lock()
+
+    def call(path, user_id, start):
+        status = app.test_client().get(path, headers={"X-User": user_id}).status_code
+        elapsed = (time.monotonic() - start) * 1000.0
+        with lock:
+            if path == "/healthz":
+                health.append(elapsed)
+                return
+            outcomes[status] += 1
+            if status == 200:
+                latencies.append(elapsed)
+
+    rps = load * CAPACITY * 1000.0 / SERVICE_MS
+    total = int(rps * seconds)
+    every = max(1, int(rps * HEALTH_INTERVAL_MS / 1000.0))
+    began = time.monotonic()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        for i in range(total):
+            delay = began + i / rps - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            # One noisy client sends a third of all traffic
+            user_id = "noisy" if i % 3 == 0 else f"user-{i % 200}"
+            pool.submit(call, "/api/chat", user_id, time.monotonic())
+            if i % every == 0:
+                pool.submit(call, "/healthz", "probe", time.monotonic())
+
+    print(
+        f"{label:<18} {threads:>7} {load:>5.1f}x {outcomes[200]:>6} {outcomes[429]:>6} {outcomes[503]:>6} "
+        f"{percentile(latencies, 50):>8.0f} {percentile(latencies, 99):>8.0f} {percentile(health, 99):>10.0f}"
+    )
+
+
+def main():
+    deployed_threads = runpy.run_path("gunicorn.conf.py")["threads"]
+    print(f"capacity {CAPACITY} concurrent calls, ~{SERVICE_MS:.0f}ms each, SLO {SLO_MS:.0f}ms, "
+          f"admission queue {ADMISSION_QUEUE_SIZE}, gunicorn threads {deployed_threads}")
+    print(f"{'mode':<18} {'threads':>7} {'load':>6} {'200':>6} {'429':>6} {'503':>6} {'p50 ms':>8} {'p99 ms':>8} "
+          f"{'health p99':>10}")
+    for load in (0.5, 1.5, 3.0):
+        run("no admission", deployed_threads, load, 5.0, admission_enabled=False)
+        # The old --threads 8 equals MAX_INFLIGHT, so the admission queue can never fill
+        run("admission control", MAX_INFLIGHT, load, 5.0, admission_enabled=True)
+        run("admission control", deployed_threads, load, 5.0, admission_enabled=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+import json
+import time
+import argparse
+
+import torch
+from transformers import AutoModelForCausalLM, AutoTokenizer
+
+from assisted import build_drafter, draft_model_generate, ngram_assisted_generate
+
+SAMPLING = dict(temperature=0.7, top_p=0.9, top_k=50, do_sample=True)
+
+
+def bud_prompts(count: int):
+    with open("bud.json", "r", encoding="utf-8") as file:
+        pairs = json.load(file)["pairs"]
+    # A few earlier exchanges in the prompt, like CharacterChat keeps, then a new message
+    prompts = []
+    for i in range(count):
+        history = pairs[i:i + 4]
+        turns = "\n".join(f"<|user|>\n{p['input_text']}\n<|assistant|>\n{p['output_text']}" for p in history[:-1])
+        prompts.append(
+            f"Personality Context: You are a balanced individual.\n{turns}\n<|user|>\n{history[-1]['input_text']}\n<|assistant|>"
+        )
+    return prompts, [p["output_text"] for p in pairs]
+
+
+def report(label, results):
+    tokens = sum(r["new_tokens"] for r in results)
+    seconds = sum(r["seconds"] for r in results)
+    drafted = sum(r.get("drafted", 0) for r in results)
+    accepted = sum(r.get("accepted", 0) for r in results)
+    forwards = sum(r.get("forward_passes", 0) for r in results)
+    acceptance = f"{accepted / drafted:.1%}" if drafted else "n/a"
+    per_forward = f"{tokens / forwards:.2f}" if forwards else "n/a"
+    print(f"{label:<10} {tokens:>7} {tokens / seconds:>10.2f} {acceptance:>11} {per_forward:>12}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tokens/sec and acceptance rate of assisted BUD generation on CPU")
+    parser.add_argument("--model", default="HuggingFaceTB/SmolLM-135M")
+    parser.add_argument("--draft", help="small draft model sharing the main model's tokenizer")
+    parser.add_argument("--prompts", type=int, default=8)
+    parser.add_argument("--tokens", type=int, default=64)
+    parser.add_argument("--threads", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    tokenizer = AutoTokenizer.from_pretrained(args.model)
+    model = AutoModelForCausalLM.from_pretrained(args.model).eval()
+    draft_model = AutoModelForCausalLM.from_pretrained(args.draft).eval() if args.draft else None
+    prompts, corpus = bud_prompts(args.prompts)
+    drafter = build_drafter(tokenizer, corpus)
+
+    modes = {"plain": [], "ngram": []}
+    if draft_model is not None:
+        modes["draft"] = []
+    for i, prompt in enumerate(prompts):
+        inputs = tokenizer(prompt, return_tensors="pt")
+
+        torch.manual_seed(i)
+        start = time.perf_counter()
+        with torch.no_grad():
+            output = model.generate(
+                **inputs, max_new_tokens=args.tokens, pad_token_id=tokenizer.eos_token_id, **SAMPLING
+            )
+        modes["plain"].append({
+            "new_tokens": output.shape[1] - inputs["input_ids"].shape[1],
+            "seconds": time.perf_counter() - start,
+        })
+
+        torch.manual_seed(i)
+        _, stats = ngram_assisted_generate(
+            model, inputs["input_ids"], drafter, max_new_tokens=args.tokens,
+            eos_token_id=tokenizer.eos_token_id, **SAMPLING
+        )
+        modes["ngram"].append(stats.as_dict())
+
+        if draft_model is not None:
+            torch.manual_seed(i)
+            _, stats = draft_model_generate(
+                model, draft_model, inputs["input_ids"], inputs["attention_mask"],
+                max_new_tokens=args.tokens, pad_token_id=tokenizer.eos_token_id, **SAMPLING
+            )
+            modes["draft"].append(stats.as_dict())
+
+    print(f"model {args.model}, draft {args.draft or '-'}, {args.prompts} prompts x {args.tokens} tokens, "
+          f"{torch.get_num_threads()} threads")
+    print(f"{'mode':<10} {'tokens':>7} {'tokens/s':>10} {'acceptance':>11} {'tokens/fwd':>12}")
+    for label, results in modes.items():
+        report(label, results)
+
+
+if __name__ == "__main__":
+    main()
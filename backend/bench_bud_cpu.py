@@ -0,0 +1,72 @@
+import os
+import time
+import argparse
+import resource
+import tempfile
+
+import torch
+
+from bud_cpu import load_cpu_model, save_cpu_artifact
+from inference import BUD_CPU_MODEL_PATH
+
+PROMPT = "Personality Context: You are a balanced individual.\n<|user|>\nI'm feeling really stressed today. What should I do?\n<|assistant|>"
+
+
+def rss_mb() -> float:
+    with open("/proc/self/status", "r", encoding="utf-8") as file:
+        for line in file:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024.0
+    return 0.0
+
+
+def export_tiny(base: str) -> str:
+    from transformers import AutoModelForCausalLM, AutoTokenizer
+
+    out_dir = os.path.join(tempfile.gettempdir(), "bud_cpu_bench")
+    save_cpu_artifact(AutoModelForCausalLM.from_pretrained(base), AutoTokenizer.from_pretrained(base), out_dir)
+    return out_dir
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load time, RSS and tokens/sec of the int8 CPU BUD model")
+    parser.add_argument("--model", default=BUD_CPU_MODEL_PATH)
+    parser.add_argument("--export-from", help="export this HF model to a temp dir first, e.g. a tiny Llama for smoke runs")
+    parser.add_argument("--tokens", type=int, default=64)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--threads", type=int, default=0)
+    args = parser.parse_args()
+
+    path = export_tiny(args.export_from) if args.export_from else args.model
+    rss_before = rss_mb()
+    start = time.perf_counter()
+    model, tokenizer = load_cpu_model(path, num_threads=args.threads or None)
+    load_seconds = time.perf_counter() - start
+    rss_loaded = rss_mb()
+
+    inputs = tokenizer(PROMPT, return_tensors="pt")
+    rates = []
+    with torch.no_grad():
+        model.generate(**inputs, max_new_tokens=4, do_sample=False)  # warm up kernels
+        for _ in range(args.runs):
+            start = time.perf_counter()
+            outputs = model.generate(
+                **inputs,
+                max_new_tokens=args.tokens,
+                min_new_tokens=args.tokens,
+                do_sample=False,
+                pad_token_id=tokenizer.eos_token_id,
+            )
+            generated = outputs.shape[1] - inputs["input_ids"].shape[1]
+            rates.append(generated / (time.perf_counter() - start))
+
+    print(f"model:        {path}")
+    print(f"threads:      {torch.get_num_threads()}")
+    print(f"load time:    {load_seconds:.2f}s")
+    print(f"RSS:          {rss_before:.0f} MB before load, {rss_loaded:.0f} MB after load, "
+          f"{resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0:.0f} MB peak")
+    print(f"tokens/sec:   {sum(rates) / len(rates):.2f} mean, {max(rates):.2f} best over {args.runs} runs")
+
+
+if __name__ == "__main__":
+    main()
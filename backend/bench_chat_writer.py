@@ -0,0 +1,87 @@
+import os
+import time
+import tempfile
+import threading
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+from chat_writer import ChatWriter
+
+ROUND_TRIP_MS = 4.0  # network + journal commit per insert call
+PER_DOC_MS = 0.02  # extra server time per document in a batch
+
+
+class FakeCollection:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.round_trips = 0
+        self.docs = 0
+
+    def _call(self, count: int):
+        time.sleep((ROUND_TRIP_MS + PER_DOC_MS * count) / 1000.0)
+        with self.lock:
+            self.round_trips += 1
+            self.docs += count
+
+    def insert_one(self, doc):
+        self._call(1)
+
+    def insert_many(self, docs, ordered=True):
+        self._call(len(docs))
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100.0))]
+
+
+def run(mode: str, qps: int, seconds: float, threads: int = 32):
+    collection = FakeCollection()
+    writer = ChatWriter(collection, spill_path=os.path.join(tempfile.gettempdir(), "bench_chat_spill.jsonl"))
+    latencies = []
+    lock = threading.Lock()
+
+    def request(i):
+        doc = {
+            "user_id": f"user-{i % 500}",
+            "character": "bud",
+            "content": "hello",
+            "response": "hey there",
+            "timestamp": datetime.utcnow(),
+        }
+        start = time.perf_counter()
+        if mode == "sync":
+            collection.insert_one(doc)
+        else:
+            writer.submit(doc)
+        elapsed = (time.perf_counter() - start) * 1000.0
+        with lock:
+            latencies.append(elapsed)
+
+    total = int(qps * seconds)
+    interval = 1.0 / qps
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        for i in range(total):
+            delay = start + i * interval - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            pool.submit(request, i)
+    writer.close()
+
+    print(
+        f"{mode:<13} {qps:>6} {sum(latencies) / len(latencies):>9.3f} {percentile(latencies, 99):>9.3f} "
+        f"{collection.round_trips:>11} {collection.docs:>7} {collection.round_trips / collection.docs:>10.3f}"
+    )
+
+
+def main():
+    print(f"simulated Mongo: {ROUND_TRIP_MS}ms per round trip + {PER_DOC_MS}ms per document")
+    print(f"{'mode':<13} {'qps':>6} {'mean ms':>9} {'p99 ms':>9} {'round trips':>11} {'docs':>7} {'trips/doc':>10}")
+    for qps in (100, 1000, 4000):
+        run("sync", qps, 2.0)
+        run("write-behind", qps, 2.0)
+
+
+if __name__ == "__main__":
+    main()
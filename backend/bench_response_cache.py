@@ -0,0 +1,77 @@
+import time
+import random
+import argparse
+
+import numpy as np
+
+from backends import BackendRouter, FakeBackend, GenerationRequest
+from response_cache import VECTOR_DIM, ResponseCache, message_vector
+
+# Paraphrase families: each inner list is one intent written the ways users actually type it
+INTENTS = [
+    ["I'm so stressed about exams", "im stressed about my exams", "so stressed about exams", "I'm really stressed about my exams!"],
+    ["I feel lonely today", "i feel so lonely today", "feeling lonely today", "I feel really lonely today."],
+    ["I can't sleep", "cant sleep", "I really can't sleep", "i cant sleep :("],
+    ["hi", "hi!", "Hi", "hii"],
+    ["I had a great day", "had a great day!", "I had a really great day", "i had a great day today"],
+    ["my friend is ignoring me", "My friend is ignoring me.", "my friends are ignoring me", "friend is ignoring me"],
+]
+CHARACTERS = ["bud", "luffy", "deadpool"]
+PERSONALITIES = ["introvert", "extrovert", "balanced"]
+
+
+def workload(requests: int, unique_share: float, seed: int):
+    rng = random.Random(seed)
+    for i in range(requests):
+        character = rng.choice(CHARACTERS)
+        personality = rng.choice(PERSONALITIES)
+        if rng.random() < unique_share:
+            message = f"something unrelated number {i} {rng.random():.6f}"
+        else:
+            message = rng.choice(rng.choice(INTENTS))
+        yield character, personality, message
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Hit rate and LLM calls avoided by the response cache")
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--unique-share", type=float, default=0.3, help="share of messages that match nothing")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    backend = FakeBackend("groq")
+    router = BackendRouter([backend], preferences={})
+    cache = ResponseCache(max_context_tokens=0)
+
+    start = time.perf_counter()
+    for character, personality, message in workload(args.requests, args.unique_share, args.seed):
+        if cache.get(character, personality, message) is None:
+            request = GenerationRequest(character, personality, "", "", message)
+            cache.put(character, personality, message, router.generate(request))
+    elapsed = time.perf_counter() - start
+
+    metrics = cache.metrics()
+    print(f"{args.requests} requests, {args.unique_share:.0%} unique, {elapsed * 1000 / args.requests:.3f} ms/request overhead")
+    print(f"hit rate {metrics['hit_rate']:.1%}, llm calls {backend.calls}, llm calls avoided {metrics['llm_calls_avoided']}")
+    print(f"entries {metrics['entries']}, bytes {metrics['bytes']}, evictions {metrics['evictions']}")
+
+    # Lookup cost of one partition as it grows: one matrix-vector product instead of a Python loop
+    vector = message_vector("im stressed about my exams")
+    print(f"{'entries':>8} {'matmul us':>10} {'loop us':>10}")
+    for size in (100, 1000, 10000):
+        matrix = np.random.default_rng(size).random((size, VECTOR_DIM), dtype=np.float32)
+        rows = list(matrix)
+        runs = 50
+        start = time.perf_counter()
+        for _ in range(runs):
+            int(np.argmax(matrix @ vector))
+        matmul = (time.perf_counter() - start) / runs
+        start = time.perf_counter()
+        for _ in range(max(1, runs // 10)):
+            max(range(size), key=lambda i: float(rows[i] @ vector))
+        loop = (time.perf_counter() - start) / max(1, runs // 10)
+        print(f"{size:>8} {matmul * 1e6:>10.1f} {loop * 1e6:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
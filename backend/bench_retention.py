@@ -0,0 +1,112 @@
+import os
+import time
+import random
+import shutil
+import argparse
+from datetime import datetime, timedelta
+
+from dotenv import load_dotenv
+from pymongo import DESCENDING, MongoClient
+
+from history import ensure_history_index
+from retention import RetentionJob, ensure_retention_index
+
+load_dotenv()
+
+CHARACTERS = ["bud", "luffy", "deadpool"]
+
+
+def seed(db, users: int, days: int, turns_per_day: int, now: datetime):
+    db.drop_collection("chats")
+    db.drop_collection("chat_summaries")
+    rng = random.Random(0)
+    batch = []
+    for day in range(days):
+        for user in range(users):
+            for _ in range(turns_per_day):
+                batch.append({
+                    "user_id": f"user{user}",
+                    "character": rng.choice(CHARACTERS),
+                    "content": "I'm so stressed about my exams, I can't focus on anything today " * 2,
+                    "response": "That sounds really hard. What part of studying feels the most overwhelming? " * 3,
+                    "timestamp": now - timedelta(days=day, seconds=rng.randrange(86400)),
+                })
+            if len(batch) >= 5000:
+                db["chats"].insert_many(batch)
+                batch = []
+    if batch:
+        db["chats"].insert_many(batch)
+    # The summarizer keeps up in production; everything but the last day has been folded in
+    db["chat_summaries"].insert_many([
+        {"user_id": f"user{user}", "character": character, "summary": "", "summarized_until": now - timedelta(days=1)}
+        for user in range(users) for character in CHARACTERS
+    ])
+    ensure_history_index(db["chats"])
+    ensure_retention_index(db["chats"], mode="archive")
+
+
+def measure(db, users: int, samples: int = 500) -> dict:
+    stats = db.command("collStats", "chats")
+    rng = random.Random(1)
+    start = time.perf_counter()
+    for _ in range(samples):
+        # The hot-path read: last turns of one conversation
+        list(
+            db["chats"].find({"user_id": f"user{rng.randrange(users)}", "character": rng.choice(CHARACTERS)})
+            .sort("timestamp", DESCENDING)
+            .limit(5)
+        )
+    return {
+        "documents": stats["count"],
+        "data_mb": stats["size"] / 2**20,
+        "storage_mb": stats["storageSize"] / 2**20,
+        "index_mb": stats["totalIndexSize"] / 2**20,
+        "indexes": {name: size / 2**20 for name, size in stats["indexSizes"].items()},
+        "hot_read_ms": (time.perf_counter() - start) * 1000 / samples,
+    }
+
+
+def directory_mb(path: str) -> float:
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names) / 2**20
+
+
+def report(label: str, result: dict):
+    print(f"{label:<8} {result['documents']:>10} {result['data_mb']:>9.1f} {result['storage_mb']:>11.1f} "
+          f"{result['index_mb']:>9.1f} {result['hot_read_ms']:>12.3f}")
+    for name, size in result["indexes"].items():
+        print(f"{'':<8}   index {name}: {size:.1f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Working-set size of chats before and after archiving old turns")
+    parser.add_argument("--db", default="bench_retention", help="scratch database, dropped and reseeded")
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--turns-per-day", type=int, default=3)
+    parser.add_argument("--hot-days", type=int, default=30)
+    parser.add_argument("--archive-dir", default=os.path.abspath("archive/bench_chats"))
+    parser.add_argument("--compact", action="store_true", help="run compact afterwards to return freed space")
+    args = parser.parse_args()
+
+    db = MongoClient(os.getenv("MONGO_URI"))[args.db]
+    now = datetime.utcnow()
+    shutil.rmtree(args.archive_dir, ignore_errors=True)
+    os.makedirs(args.archive_dir)
+    seed(db, args.users, args.days, args.turns_per_day, now)
+
+    print(f"{args.users} users x {args.days} days x {args.turns_per_day} turns/day, hot window {args.hot_days} days")
+    print(f"{'':<8} {'documents':>10} {'data MB':>9} {'storage MB':>11} {'index MB':>9} {'hot read ms':>12}")
+    report("before", measure(db, args.users))
+
+    start = time.perf_counter()
+    job = RetentionJob(db["chats"], db["chat_summaries"], archive_dir=args.archive_dir, hot_days=args.hot_days)
+    result = job.run_once(now)
+    elapsed = time.perf_counter() - start
+    if args.compact:
+        db.command("compact", "chats")
+    report("after", measure(db, args.users))
+    print(f"archived {result['archived']} turns in {elapsed:.1f}s, archive on disk {directory_mb(args.archive_dir):.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
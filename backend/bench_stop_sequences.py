@@ -0,0 +1,64 @@
+import time
+import argparse
+
+import torch
+from transformers import AutoModelForCausalLM, AutoTokenizer, StoppingCriteriaList
+
+from bench_assisted import SAMPLING, bud_prompts
+from stop_sequences import BUD_STOP_SEQUENCES, StopSequenceCriteria, useful_token_count
+
+MAX_NEW_TOKENS = 150
+
+
+def generate(model, tokenizer, inputs, **kwargs):
+    start = time.perf_counter()
+    with torch.no_grad():
+        output = model.generate(
+            **inputs, max_new_tokens=MAX_NEW_TOKENS, pad_token_id=tokenizer.eos_token_id, **SAMPLING, **kwargs
+        )
+    generated = output[0, inputs["input_ids"].shape[1]:].tolist()
+    # generate() pads finished rows; only count tokens up to the first pad after a stop
+    while generated and generated[-1] == tokenizer.eos_token_id:
+        generated.pop()
+    return generated, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Wasted tokens per BUD turn with and without stop sequences")
+    parser.add_argument("--model", default="HuggingFaceTB/SmolLM-135M")
+    parser.add_argument("--prompts", type=int, default=8)
+    args = parser.parse_args()
+
+    tokenizer = AutoTokenizer.from_pretrained(args.model)
+    model = AutoModelForCausalLM.from_pretrained(args.model).eval()
+    prompts, _ = bud_prompts(args.prompts)
+    old_eos = tokenizer.encode("<|user|>")[0]
+    print(f"old eos_token_id={old_eos} decodes to {tokenizer.decode([old_eos])!r}")
+
+    rows = {"old eos id": [], "stop sequences": []}
+    for i, prompt in enumerate(prompts):
+        inputs = tokenizer(prompt, return_tensors="pt")
+
+        torch.manual_seed(i)
+        generated, seconds = generate(model, tokenizer, inputs, eos_token_id=old_eos)
+        rows["old eos id"].append((len(generated), useful_token_count(tokenizer, generated, BUD_STOP_SEQUENCES), seconds))
+
+        torch.manual_seed(i)
+        criteria = StopSequenceCriteria(tokenizer, BUD_STOP_SEQUENCES, inputs["input_ids"].shape[1])
+        generated, seconds = generate(
+            model, tokenizer, inputs,
+            eos_token_id=tokenizer.eos_token_id, stopping_criteria=StoppingCriteriaList([criteria]),
+        )
+        rows["stop sequences"].append((len(generated), useful_token_count(tokenizer, generated, BUD_STOP_SEQUENCES), seconds))
+
+    print(f"{'mode':<15} {'tokens/turn':>12} {'useful/turn':>12} {'wasted/turn':>12} {'sec/turn':>9}")
+    for label, results in rows.items():
+        turns = len(results)
+        generated = sum(r[0] for r in results) / turns
+        useful = sum(r[1] for r in results) / turns
+        seconds = sum(r[2] for r in results) / turns
+        print(f"{label:<15} {generated:>12.1f} {useful:>12.1f} {generated - useful:>12.1f} {seconds:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
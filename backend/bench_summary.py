@@ -0,0 +1,108 @@
+import random
+from datetime import datetime, timedelta
+
+from prompts import compile_prompt, count_tokens
+from summarizer import (
+    SUMMARY_BATCH_TURNS, SUMMARY_MAX_WORDS, SUMMARY_PROMPT, SUMMARY_RAW_TURNS, SUMMARY_REWRITE_TURNS,
+    build_context, extractive_summarize, format_turn,
+)
+
+WORDS = (
+    "exams stress sleep friends family work tired anxious project deadline weekend "
+    "music gym coffee roommate class teacher grades lonely happy excited worried"
+).split()
+BASELINE_TURNS = 5  # what the prompt carried before summaries
+
+
+def synthetic_conversation(turns: int, words_per_message: int, seed: int = 7):
+    rng = random.Random(seed)
+    start = datetime(2025, 1, 1)
+    return [
+        {
+            "character": "bud",
+            "content": " ".join(rng.choice(WORDS) for _ in range(words_per_message)) + ".",
+            "response": " ".join(rng.choice(WORDS) for _ in range(words_per_message * 2)) + ".",
+            "timestamp": start + timedelta(minutes=i),
+        }
+        for i in range(turns)
+    ]
+
+
+def summarizer_call_tokens(summary: str, batch, output: str, max_words: int) -> int:
+    prompt = SUMMARY_PROMPT.format(
+        character=batch[-1]["character"], max_words=max_words, summary=summary or "(none)",
+        turns="\n".join(format_turn(msg) for msg in batch),
+    )
+    return count_tokens(prompt) + count_tokens(output)
+
+
+def summarized_contexts(history, rewrite_turns: int = SUMMARY_REWRITE_TURNS, max_words: int = SUMMARY_MAX_WORDS):
+    """Replays the conversation turn by turn with ConversationSummarizer.compact's rules.
+
+    The LLM rewrite is stood in for by the extractive summary of the same batch, which is
+    capped at the same word budget. Returns the context seen after each turn, the number
+    of LLM calls and the tokens those calls would have sent and received.
+    """
+    summary, rewritten, rewritten_until, folded, unrewritten = "", "", 0, 0, 0
+    calls, call_tokens, contexts = 0, 0, []
+    for length in range(1, len(history) + 1):
+        # After each flush: everything behind the raw window is folded in
+        while length - SUMMARY_RAW_TURNS - folded > 0:
+            end = min(length - SUMMARY_RAW_TURNS, folded + SUMMARY_BATCH_TURNS)
+            turns = history[folded:end]
+            unrewritten += len(turns)
+            if unrewritten >= rewrite_turns:
+                batch = history[max(rewritten_until, end - SUMMARY_BATCH_TURNS):end]
+                summary = extractive_summarize(rewritten, batch, max_words)
+                call_tokens += summarizer_call_tokens(rewritten, batch, summary, max_words)
+                calls += 1
+                rewritten, rewritten_until, unrewritten = summary, end, 0
+            else:
+                summary = extractive_summarize(summary, turns, max_words)
+            folded = end
+        contexts.append(build_context(summary, history[folded:length]))
+    return contexts, calls, call_tokens
+
+
+def measure(compiled, user_input, history, rewrite_turns=SUMMARY_REWRITE_TURNS, max_words=SUMMARY_MAX_WORDS):
+    baseline = sum(
+        compiled.render("\n".join(format_turn(msg) for msg in history[max(0, i - BASELINE_TURNS + 1):i + 1]),
+                        user_input, budget=0).dynamic_tokens
+        for i in range(len(history))
+    ) / len(history)
+    contexts, calls, call_tokens = summarized_contexts(history, rewrite_turns, max_words)
+    prompt_counts = [compiled.render(context, user_input, budget=0).dynamic_tokens for context in contexts]
+    prompt = sum(prompt_counts) / len(history)
+    total = prompt + call_tokens / len(history)
+    return baseline, prompt, max(prompt_counts), call_tokens / len(history), total, calls
+
+
+def main():
+    compiled = compile_prompt("bud", "You are a balanced individual.")
+    user_input = "I can't stop worrying about tomorrow."
+    print(f"summary cap {SUMMARY_MAX_WORDS} words, {SUMMARY_RAW_TURNS} raw turns, LLM rewrite every "
+          f"{SUMMARY_REWRITE_TURNS} turns, prefix {compiled.prefix_tokens} tokens; per-turn averages")
+    print(f"{'turns':>6} {'words/msg':>9} {'last-5':>7} {'prompt':>7} {'max':>5} {'summarizer':>11} "
+          f"{'total':>7} {'reduction':>10} {'LLM calls':>10}")
+    for turns in (10, 50, 200, 1000):
+        for words_per_message in (20, 80):
+            history = synthetic_conversation(turns, words_per_message)
+            baseline, prompt, peak, summarizer, total, calls = measure(compiled, user_input, history)
+            print(f"{turns:>6} {words_per_message:>9} {baseline:>7.0f} {prompt:>7.0f} {peak:>5} {summarizer:>11.0f} "
+                  f"{total:>7.0f} {100.0 * (baseline - total) / baseline:>9.1f}% {calls:>10}")
+
+    print("\nsummary cap and rewrite interval, 200 turns:")
+    print(f"{'words':>6} {'every':>6} {'words/msg':>9} {'total':>7} {'reduction':>10}")
+    for max_words in (60, 80, 120):
+        for rewrite_turns in (10, 20, 50):
+            for words_per_message in (20, 80):
+                baseline, _, _, _, total, _ = measure(
+                    compiled, user_input, synthetic_conversation(200, words_per_message), rewrite_turns, max_words
+                )
+                print(f"{max_words:>6} {rewrite_turns:>6} {words_per_message:>9} {total:>7.0f} "
+                      f"{100.0 * (baseline - total) / baseline:>9.1f}%")
+    print(f"(user input alone is {count_tokens(user_input)} tokens)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+import os
+import json
+import logging
+from typing import Dict, Tuple
+
+import torch
+from torch import nn
+
+# Layout of a CPU artifact directory:
+#   config.json, tokenizer files   standard transformers files
+#   model.safetensors              int8 linear weights + per-row scales, everything else in fp16
+#   bud_cpu.json                   format marker and the list of quantized linear layers
+# safetensors is memory-mapped and read one tensor at a time on load, so there is never an
+# fp32 copy of the full 7B weights. Memory is still well above the int8 size: embed_tokens
+# and lm_head are upcast to fp32 (~0.5 GB each at 7B), fbgemm prepacks every int8 weight
+# into a copy of its own, and the mapped file counts towards RSS until loading finishes.
+# A 0.55B Llama (0.65 GB artifact) settled at 1.1 GB and peaked at 1.7 GB above baseline.
+CPU_FORMAT = "int8-per-channel"
+CPU_WEIGHTS_FILE = "model.safetensors"
+CPU_METADATA_FILE = "bud_cpu.json"
+
+
+def quantize_weight(weight: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+    # Symmetric per-output-channel int8, the scheme fbgemm's dynamic linear expects
+    weight = weight.detach().float()
+    scale = weight.abs().amax(dim=1).clamp(min=1e-8) / 127.0
+    qweight = torch.round(weight / scale[:, None]).clamp(-127, 127).to(torch.int8)
+    return qweight, scale
+
+
+def save_cpu_artifact(model: nn.Module, tokenizer, out_dir: str, skip_modules=("lm_head",)):
+    from safetensors.torch import save_file
+
+    os.makedirs(out_dir, exist_ok=True)
+    tensors: Dict[str, torch.Tensor] = {}
+    linear_layers = []
+    for name, module in model.named_modules():
+        if isinstance(module, nn.Linear) and name.split(".")[-1] not in skip_modules:
+            qweight, scale = quantize_weight(module.weight)
+            tensors[f"{name}.weight_int8"] = qweight.contiguous()
+            tensors[f"{name}.weight_scale"] = scale.contiguous()
+            if module.bias is not None:
+                tensors[f"{name}.bias"] = module.bias.detach().float().contiguous()
+            linear_layers.append(name)
+
+    quantized = set(linear_layers)
+    for name, param in model.state_dict().items():
+        if name.rsplit(".", 1)[0] not in quantized:
+            tensors[name] = param.detach().to(torch.float16).contiguous()
+
+    save_file(tensors, os.path.join(out_dir, CPU_WEIGHTS_FILE), metadata={"format": CPU_FORMAT})
+    model.config.save_pretrained(out_dir)
+    tokenizer.save_pretrained(out_dir)
+    with open(os.path.join(out_dir, CPU_METADATA_FILE), "w", encoding="utf-8") as file:
+        json.dump({"format": CPU_FORMAT, "linear_layers": linear_layers}, file, indent=2)
+    logging.info(f"Saved {len(linear_layers)} int8 linear layers to {out_dir}")
+
+
+def load_cpu_model(path: str, num_threads: int = None):
+    from accelerate import init_empty_weights
+    from safetensors import safe_open
+    from transformers import AutoConfig, AutoModelForCausalLM, AutoTokenizer
+
+    with open(os.path.join(path, CPU_METADATA_FILE), "r", encoding="utf-8") as file:
+        metadata = json.load(file)
+    if metadata.get("format") != CPU_FORMAT:
+        raise ValueError(f"Unsupported CPU model format: {metadata.get('format')}")
+    if num_threads:
+        torch.set_num_threads(num_threads)
+
+    config = AutoConfig.from_pretrained(path)
+    # Parameters start on the meta device; non-persistent buffers such as rotary
+    # frequencies are still built normally
+    with init_empty_weights():
+        model = AutoModelForCausalLM.from_config(config, torch_dtype=torch.float32)
+
+    quantized = set(metadata["linear_layers"])
+    with safe_open(os.path.join(path, CPU_WEIGHTS_FILE), framework="pt") as weights:
+        keys = set(weights.keys())
+        # Plain weights go in while every layer is still an nn.Linear: the quantized modules
+        # would demand their own scale/zero_point keys from load_state_dict
+        state = {key: weights.get_tensor(key).float() for key in keys if key.rsplit(".", 1)[0] not in quantized}
+        model.load_state_dict(state, strict=False, assign=True)
+        del state
+
+        for layer in quantized:
+            parent_name, _, child_name = layer.rpartition(".")
+            parent = model.get_submodule(parent_name) if parent_name else model
+            linear = getattr(parent, child_name)
+            qweight = weights.get_tensor(f"{layer}.weight_int8")
+            scale = weights.get_tensor(f"{layer}.weight_scale").double()
+            bias_key = f"{layer}.bias"
+            bias = weights.get_tensor(bias_key) if bias_key in keys else None
+
+            qlinear = torch.ao.nn.quantized.dynamic.Linear(
+                linear.in_features, linear.out_features, bias_=bias is not None, dtype=torch.qint8
+            )
+            qlinear.set_weight_bias(
+                torch._make_per_channel_quantized_tensor(
+                    qweight, scale, torch.zeros_like(scale, dtype=torch.int64), 0
+                ),
+                bias,
+            )
+            setattr(parent, child_name, qlinear)
+
+    model.tie_weights()
+    missing = [name for name, param in model.named_parameters() if param.device.type == "meta"]
+    if missing:
+        raise ValueError(f"CPU model is missing weights for: {', '.join(missing[:5])}")
+    model.eval()
+
+    tokenizer = AutoTokenizer.from_pretrained(path)
+    return model, tokenizer
@@ -0,0 +1,304 @@
+import os
+import glob
+import json
+import time
+import fcntl
+import logging
+import threading
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+CHAT_WRITE_BATCH_SIZE = int(os.getenv("CHAT_WRITE_BATCH_SIZE", "100"))
+CHAT_WRITE_FLUSH_MS = int(os.getenv("CHAT_WRITE_FLUSH_MS", "200"))
+# Each process spills to "<CHAT_SPILL_PATH>.<pid>"; any process may replay any of them
+CHAT_SPILL_PATH = os.getenv("CHAT_SPILL_PATH", "chat_spill.jsonl")
+# Buffered documents beyond this go straight to the spill file while a flush is stuck
+CHAT_WRITE_MAX_BUFFER = int(os.getenv("CHAT_WRITE_MAX_BUFFER", "1000"))
+
+DUPLICATE_KEY = 11000
+
+
+class ChatWriter:
+    """Write-behind buffer for chat documents.
+
+    Documents get their ``_id`` on submit and are flushed with ``insert_many`` once
+    ``batch_size`` documents are buffered or ``flush_interval`` seconds have passed.
+    If Mongo is unavailable the batch is appended to a spill file of this process, and
+    every spill file next to it, including those of workers that have died, is replayed
+    after the next successful flush. Spill files are only touched under ``flock``. A
+    document Mongo can never accept (e.g. ``InvalidDocument``) is set aside in
+    ``<spill_path>.rejected`` on its own, so it neither takes its batch down nor blocks
+    replays. While a flush hangs, e.g. in server selection, submits beyond ``max_buffer``
+    documents spill the buffer instead of growing it; those turns leave ``pending()``.
+    Flush listeners only see documents this writer actually inserted, so re-sent
+    documents that had already landed are not counted twice. Unflushed documents are visible through
+    ``pending()`` so history lookups in this process can still read their own writes;
+    with several gunicorn workers that guarantee holds per worker, and the flush
+    interval bounds how long another worker can miss a turn.
+    """
+
+    def __init__(self, collection, batch_size: int = CHAT_WRITE_BATCH_SIZE,
+                 flush_interval: float = CHAT_WRITE_FLUSH_MS / 1000.0,
+                 spill_path: str = CHAT_SPILL_PATH, max_buffer: int = CHAT_WRITE_MAX_BUFFER):
+        self.collection = collection
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.spill_base = spill_path
+        self.rejected_path = f"{spill_path}.rejected"
+        self.max_buffer = max(max_buffer, batch_size)
+        self.buffer: List[Dict] = []
+        self.inflight: List[Dict] = []
+        self.flush_listeners: List[Callable[[List[Dict]], None]] = []
+        self.condition = threading.Condition()
+        self.flush_lock = threading.Lock()
+        self.worker = None
+        self.closed = False
+        self.stats = {"submitted": 0, "flushed": 0, "batches": 0, "spilled": 0, "replayed": 0, "rejected": 0}
+
+    def add_flush_listener(self, listener: Callable[[List[Dict]], None]):
+        self.flush_listeners.append(listener)
+
+    def start(self):
+        with self.condition:
+            if self.worker is None or not self.worker.is_alive():
+                self.closed = False
+                self.worker = threading.Thread(target=self._run, name="chat-writer", daemon=True)
+                self.worker.start()
+
+    def submit(self, doc: Dict) -> Dict:
+        return self.submit_many([doc])[0]
+
+    def submit_many(self, docs: List[Dict]) -> List[Dict]:
+        # bson comes with pymongo and is only loaded once the first chat is written
+        from bson import ObjectId
+
+        for doc in docs:
+            doc.setdefault("_id", ObjectId())
+            # Mongo stores milliseconds; truncating now keeps buffered and stored copies of a
+            # turn identical, so history cursors built from either compare the same
+            timestamp = doc.get("timestamp")
+            if isinstance(timestamp, datetime):
+                doc["timestamp"] = timestamp.replace(microsecond=timestamp.microsecond // 1000 * 1000)
+        if self.closed:
+            # After shutdown there is no worker left to flush, write through instead
+            self._write(list(docs))
+            return docs
+        self.start()
+        overflow = []
+        with self.condition:
+            self.buffer.extend(docs)
+            self.stats["submitted"] += len(docs)
+            if len(self.buffer) >= self.batch_size:
+                self.condition.notify()
+            if len(self.buffer) > self.max_buffer:
+                # The worker is stuck on a flush; park the buffer on disk rather than in memory
+                overflow, self.buffer = self.buffer, []
+        if overflow:
+            logging.error(f"Chat write buffer over {self.max_buffer} documents, spilling {len(overflow)}")
+            self._spill_or_requeue(overflow)
+        return docs
+
+    def pending(self, user_id: str, character: Optional[str] = None) -> List[Dict]:
+        with self.condition:
+            docs = self.inflight + self.buffer
+        return [
+            doc for doc in docs
+            if doc["user_id"] == user_id and (character is None or doc["character"] == character)
+        ]
+
+    def flush(self):
+        with self.flush_lock:
+            with self.condition:
+                batch, self.buffer = self.buffer, []
+                self.inflight = batch
+            try:
+                if batch:
+                    self._write(batch)
+            finally:
+                with self.condition:
+                    self.inflight = []
+
+    def close(self, timeout: float = 10.0):
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+        if self.worker is not None:
+            self.worker.join(timeout)
+        # Drain whatever is left, including documents submitted while stopping
+        self.flush()
+
+    def _run(self):
+        while True:
+            with self.condition:
+                deadline = time.monotonic() + self.flush_interval
+                while not self.closed and len(self.buffer) < self.batch_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self.condition.wait(remaining)
+                closed = self.closed
+            try:
+                self.flush()
+            except Exception as e:
+                logging.error(f"Chat writer flush error: {str(e)}")
+            if closed:
+                return
+
+    def _write(self, batch: List[Dict]):
+        try:
+            inserted = self._insert_safely(batch)
+        except Exception as e:
+            logging.error(f"Chat insert failed, spilling {len(batch)} documents: {str(e)}")
+            self._spill_or_requeue(batch)
+            return
+        self.stats["flushed"] += len(batch)
+        self.stats["batches"] += 1
+        self._notify(inserted)
+        for path in self._spill_files():
+            self._replay_spill(path)
+
+    def _insert(self, batch: List[Dict]) -> List[Dict]:
+        """Inserts the batch and returns the documents that were new."""
+        from pymongo.errors import BulkWriteError
+
+        try:
+            self.collection.insert_many(batch, ordered=False)
+        except BulkWriteError as e:
+            # Re-sent documents keep their _id, so duplicates mean they already landed; any
+            # other write error is about that document (e.g. validation) and retrying won't help
+            write_errors = e.details.get("writeErrors", [])
+            for err in write_errors:
+                if err.get("code") != DUPLICATE_KEY:
+                    self._reject(batch[err["index"]], err.get("errmsg", "write error"))
+            failed = {err["index"] for err in write_errors}
+            return [doc for i, doc in enumerate(batch) if i not in failed]
+        return batch
+
+    def _insert_safely(self, batch: List[Dict]) -> List[Dict]:
+        """Like ``_insert``, but documents Mongo rejects for their content are set aside.
+
+        Only errors talking to Mongo (``PyMongoError``) propagate, for the caller to spill
+        or keep the batch; anything else is narrowed down to the offending documents.
+        """
+        from pymongo.errors import PyMongoError
+
+        try:
+            return self._insert(batch)
+        except PyMongoError:
+            raise
+        except Exception as e:
+            if len(batch) == 1:
+                self._reject(batch[0], e)
+                return []
+        inserted = []
+        for doc in batch:
+            inserted += self._insert_safely([doc])
+        return inserted
+
+    @property
+    def spill_path(self) -> str:
+        # Per process, so gunicorn workers never append to a file another one is replaying
+        return f"{self.spill_base}.{os.getpid()}"
+
+    def _spill_files(self) -> List[str]:
+        # Legacy shared files (".replaying" included) are picked up as well
+        return sorted(
+            path for path in glob.glob(glob.escape(self.spill_base) + "*")
+            if os.path.isfile(path) and path != self.rejected_path
+        )
+
+    @staticmethod
+    def _open_locked(path: str, mode: str):
+        """Opens ``path`` under an exclusive flock, or returns None once it is gone.
+
+        A replay unlinks the file while holding the lock, so after waiting for the lock
+        the open file may no longer be the one at ``path``; in that case start over.
+        """
+        while True:
+            try:
+                file = open(path, mode, encoding="utf-8")
+            except FileNotFoundError:
+                return None
+            fcntl.flock(file, fcntl.LOCK_EX)
+            try:
+                if os.fstat(file.fileno()).st_ino == os.stat(path).st_ino:
+                    return file
+            except FileNotFoundError:
+                pass
+            file.close()
+            if "a" not in mode:
+                return None
+
+    def _spill(self, batch: List[Dict]):
+        from bson import json_util
+
+        lines = []
+        for doc in batch:
+            try:
+                lines.append(json_util.dumps(doc) + "\n")
+            except Exception as e:
+                self._reject(doc, e)
+        file = self._open_locked(self.spill_path, "a")
+        with file:
+            file.writelines(lines)
+            file.flush()
+            os.fsync(file.fileno())
+        self.stats["spilled"] += len(lines)
+
+    def _spill_or_requeue(self, batch: List[Dict]):
+        try:
+            self._spill(batch)
+        except Exception as e:
+            # Nowhere to put them: keep the documents in memory for the next flush
+            logging.error(f"Chat spill failed, keeping {len(batch)} documents buffered: {str(e)}")
+            with self.condition:
+                self.buffer[:0] = batch
+
+    def _reject(self, doc: Dict, error):
+        from bson import json_util
+
+        logging.error(f"Chat document {doc.get('_id')} cannot be stored, setting it aside: {str(error)}")
+        try:
+            line = json_util.dumps(doc)
+        except Exception:
+            line = json.dumps({"_id": str(doc.get("_id")), "repr": repr(doc), "error": str(error)})
+        file = self._open_locked(self.rejected_path, "a")
+        with file:
+            file.write(line + "\n")
+            file.flush()
+            os.fsync(file.fileno())
+        self.stats["rejected"] += 1
+
+    def _replay_spill(self, path: str):
+        from bson import json_util
+        from pymongo.errors import PyMongoError
+
+        file = self._open_locked(path, "r+")
+        if file is None:
+            return
+        # Holding the lock for the whole replay keeps writers and other replays out
+        with file:
+            docs = [json_util.loads(line) for line in file if line.strip()]
+            for i in range(0, len(docs), self.batch_size):
+                batch = docs[i:i + self.batch_size]
+                try:
+                    inserted = self._insert_safely(batch)
+                except PyMongoError as e:
+                    logging.error(f"Spill replay failed, keeping {len(docs) - i} documents: {str(e)}")
+                    file.seek(0)
+                    file.truncate()
+                    for doc in docs[i:]:
+                        file.write(json_util.dumps(doc) + "\n")
+                    file.flush()
+                    os.fsync(file.fileno())
+                    return
+                self.stats["replayed"] += len(batch)
+                self._notify(inserted)
+            os.remove(path)
+
+    def _notify(self, batch: List[Dict]):
+        for listener in self.flush_listeners:
+            try:
+                listener(batch)
+            except Exception as e:
+                logging.error(f"Chat flush listener error: {str(e)}")
@@ -0,0 +1,40 @@
+import argparse
+import logging
+
+import torch
+from transformers import AutoModelForCausalLM, AutoTokenizer
+
+from bud_cpu import save_cpu_artifact
+
+logging.basicConfig(level=logging.INFO)
+
+
+def merge_adapter(base: str, adapter: str):
+    # finetune.py saves the LoRA adapter only; fold it into the base weights first
+    model = AutoModelForCausalLM.from_pretrained(base, torch_dtype=torch.bfloat16, low_cpu_mem_usage=True)
+    if adapter:
+        from peft import PeftModel
+
+        model = PeftModel.from_pretrained(model, adapter)
+        model = model.merge_and_unload()
+    tokenizer = AutoTokenizer.from_pretrained(adapter or base)
+    return model, tokenizer
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Merge the BUD LoRA adapter and export an int8 CPU model")
+    parser.add_argument("--base", default="meta-llama/Llama-2-7b-hf")
+    parser.add_argument("--adapter", default="fine_tuned_llama_samantha_bud", help="empty to export the base model as is")
+    parser.add_argument("--out", default="fine_tuned_llama_samantha_bud_cpu")
+    parser.add_argument("--merged-out", help="also save the merged bf16 model here")
+    args = parser.parse_args()
+
+    model, tokenizer = merge_adapter(args.base, args.adapter)
+    if args.merged_out:
+        model.save_pretrained(args.merged_out, safe_serialization=True)
+        tokenizer.save_pretrained(args.merged_out)
+    save_cpu_artifact(model, tokenizer, args.out)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,16 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from admission import ADMISSION_QUEUE_SIZE, MAX_INFLIGHT  # noqa: E402
+
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:80")
+workers = int(os.getenv("WEB_CONCURRENCY", "4"))
+worker_class = "gthread"
+# Every in-flight LLM call, a full admission queue and some requests that skip admission
+# (health checks, history) must each get a thread. With fewer threads the admission queue
+# never fills, so nothing is shed and overload piles up in gunicorn's unbounded queue,
+# where /healthz and /readyz wait behind it.
+GUNICORN_THREAD_HEADROOM = int(os.getenv("GUNICORN_THREAD_HEADROOM", "8"))
+threads = int(os.getenv("GUNICORN_THREADS", str(MAX_INFLIGHT + ADMISSION_QUEUE_SIZE + GUNICORN_THREAD_HEADROOM)))
@@ -0,0 +1,105 @@
+import json
+import base64
+from datetime import datetime
+from typing import TYPE_CHECKING, Dict, Iterator, List, Optional, Tuple
+
+if TYPE_CHECKING:
+    from bson import ObjectId
+
+# Same values as pymongo.ASCENDING/DESCENDING; spelled out so importing the app does not load pymongo
+ASCENDING = 1
+DESCENDING = -1
+
+HISTORY_PAGE_SIZE = 20
+HISTORY_MAX_PAGE_SIZE = 100
+HISTORY_EXPORT_BATCH_SIZE = 500
+
+# Serves the hot-path "last N turns" lookup, history pages and exports; _id breaks timestamp ties
+HISTORY_INDEX = [("user_id", ASCENDING), ("character", ASCENDING), ("timestamp", DESCENDING), ("_id", DESCENDING)]
+HISTORY_SORT = [("timestamp", DESCENDING), ("_id", DESCENDING)]
+EXPORT_SORT = [("timestamp", ASCENDING), ("_id", ASCENDING)]
+
+HISTORY_FIELDS = {"character": 1, "content": 1, "response": 1, "timestamp": 1}
+
+
+def ensure_history_index(collection):
+    collection.create_index(HISTORY_INDEX, name="user_character_timestamp")
+
+
+def encode_cursor(doc: Dict) -> str:
+    raw = json.dumps({"t": doc["timestamp"].isoformat(), "id": str(doc["_id"])})
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, "ObjectId"]:
+    from bson import ObjectId
+
+    try:
+        raw = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return datetime.fromisoformat(raw["t"]), ObjectId(raw["id"])
+    except Exception:
+        raise ValueError("Invalid history cursor")
+
+
+def keyset_query(user_id: str, character: str, cursor: Optional[str] = None, newer: bool = False) -> Dict:
+    query = {"user_id": user_id, "character": character}
+    if cursor:
+        timestamp, doc_id = decode_cursor(cursor)
+        op = "$gt" if newer else "$lt"
+        query["$or"] = [
+            {"timestamp": {op: timestamp}},
+            {"timestamp": timestamp, "_id": {op: doc_id}},
+        ]
+    return query
+
+
+def serialize_message(doc: Dict) -> Dict:
+    return {
+        "id": str(doc["_id"]),
+        "character": doc["character"],
+        "content": doc["content"],
+        "response": doc["response"],
+        "timestamp": doc["timestamp"].isoformat(),
+    }
+
+
+def history_page(collection, user_id: str, character: str, cursor: Optional[str] = None,
+                 limit: int = HISTORY_PAGE_SIZE, pending: Optional[List[Dict]] = None) -> Dict:
+    limit = max(1, min(limit, HISTORY_MAX_PAGE_SIZE))
+    # One extra row tells us whether another page exists without a count query
+    docs = list(
+        collection.find(keyset_query(user_id, character, cursor), HISTORY_FIELDS)
+        .sort(HISTORY_SORT)
+        .limit(limit + 1)
+    )
+    if pending and not cursor:
+        # Turns still in the write-behind buffer belong at the top of the first page
+        stored_ids = {doc["_id"] for doc in docs}
+        docs += [doc for doc in pending if doc["_id"] not in stored_ids]
+        docs.sort(key=lambda doc: (doc["timestamp"], doc["_id"]), reverse=True)
+
+    has_more = len(docs) > limit
+    docs = docs[:limit]
+    return {
+        "messages": [serialize_message(doc) for doc in docs],
+        "next_cursor": encode_cursor(docs[-1]) if has_more else None,
+    }
+
+
+def export_history(collection, user_id: str, character: str, cursor: Optional[str] = None) -> Iterator[str]:
+    # The query is built eagerly so a bad cursor fails before the response starts streaming
+    mongo_cursor = (
+        collection.find(keyset_query(user_id, character, cursor, newer=True), HISTORY_FIELDS)
+        .sort(EXPORT_SORT)
+        .batch_size(HISTORY_EXPORT_BATCH_SIZE)
+    )
+
+    def generate():
+        # Chronological NDJSON straight off the Mongo cursor, one batch in memory at a time
+        try:
+            for doc in mongo_cursor:
+                yield json.dumps(serialize_message(doc), ensure_ascii=False) + "\n"
+        finally:
+            mongo_cursor.close()
+
+    return generate()
@@ -1,17 +1,24 @@
-from unsloth import FastLanguageModel
 import re
 import json
 import os
 from enum import Enum
-from typing import Dict
-from langchain_groq import ChatGroq
-from langchain.chains import LLMChain
-from langchain.prompts import PromptTemplate
+from typing import TYPE_CHECKING, Dict
 from dotenv import load_dotenv
-import torch
+
+if TYPE_CHECKING:
+    from langchain.chains import LLMChain
+    from langchain.prompts import PromptTemplate
 
 load_dotenv()
 
+# "gpu" loads the 4-bit unsloth adapter, "cpu" the int8 artifact built by export_bud.py
+BUD_DEVICE = os.getenv("BUD_DEVICE", "gpu")
+BUD_CPU_MODEL_PATH = os.getenv("BUD_CPU_MODEL_PATH", "fine_tuned_llama_samantha_bud_cpu")
+BUD_CPU_THREADS = int(os.getenv("BUD_CPU_THREADS", "0"))
+# Assisted generation for BUD: "off", "ngram" (prompt + bud.json lookup) or "draft" (small draft model)
+BUD_ASSISTED = os.getenv("BUD_ASSISTED", "off")
+BUD_DRAFT_MODEL = os.getenv("BUD_DRAFT_MODEL", "")
+
 class Character(Enum):
     BUD = "bud"
     LUFFY = "luffy"
@@ -37,6 +44,107 @@ def get_user_personality() -> str:
             return personality
         print("Invalid MBTI type. Please enter a valid personality type.")
 
+# torch, unsloth and langchain are imported where they are used so that importing this
+# module (and app_2) does not pay for them before the server can answer a health check
+def load_bud_model(model_name: str = "fine_tuned_llama_samantha_bud"):
+    if BUD_DEVICE == "cpu":
+        from bud_cpu import load_cpu_model
+
+        return load_cpu_model(BUD_CPU_MODEL_PATH, num_threads=BUD_CPU_THREADS or None)
+
+    from unsloth import FastLanguageModel
+    import torch
+
+    bud_model, bud_tokenizer = FastLanguageModel.from_pretrained(
+        model_name=model_name,
+        max_seq_length=4096,
+        dtype=torch.bfloat16,
+        load_in_4bit=True,
+        device_map="auto",
+    )
+    FastLanguageModel.for_inference(bud_model)
+    return bud_model, bud_tokenizer
+
+_bud_drafter = None
+_draft_model = None
+
+def get_bud_drafter(tokenizer):
+    # Known BUD replies, shared by every conversation; the conversation itself is
+    # already in the prompt and is searched directly
+    global _bud_drafter
+    if _bud_drafter is None:
+        from assisted import build_drafter
+
+        with open("bud.json", "r", encoding="utf-8") as file:
+            pairs = json.load(file).get("pairs", [])
+        _bud_drafter = build_drafter(tokenizer, [pair["output_text"] for pair in pairs])
+    return _bud_drafter
+
+def get_draft_model(device):
+    global _draft_model
+    if _draft_model is None:
+        from transformers import AutoModelForCausalLM
+
+        if not BUD_DRAFT_MODEL:
+            raise ValueError("BUD_ASSISTED=draft needs BUD_DRAFT_MODEL")
+        _draft_model = AutoModelForCausalLM.from_pretrained(BUD_DRAFT_MODEL).to(device).eval()
+    return _draft_model
+
+def generate_bud_reply(model, tokenizer, input_text: str):
+    import torch
+    from transformers import StoppingCriteriaList
+    from stop_sequences import BUD_STOP_SEQUENCES, StopSequenceCriteria, truncate_at_stop
+
+    inputs = tokenizer(input_text, return_tensors="pt", truncation=True).to(model.device)
+    
+    if "input_ids" not in inputs or "attention_mask" not in inputs:
+        raise ValueError("Tokenizer did not return expected keys: 'input_ids' and 'attention_mask'")
+    
+    stats = None
+    sampling = dict(
+        max_new_tokens=150,
+        temperature=0.7,
+        do_sample=True,
+        top_p=0.9,
+        top_k=50,
+        eos_token_id=tokenizer.eos_token_id,
+        # "<|user|>" is several tokens, so it is matched as a sequence rather than as an EOS id
+        stopping_criteria=StoppingCriteriaList([
+            StopSequenceCriteria(tokenizer, BUD_STOP_SEQUENCES, inputs["input_ids"].shape[1])
+        ]),
+    )
+    if BUD_ASSISTED == "ngram":
+        from assisted import ngram_assisted_generate
+
+        outputs, stats = ngram_assisted_generate(
+            model, inputs["input_ids"], get_bud_drafter(tokenizer), **sampling
+        )
+        stats = stats.as_dict()
+    elif BUD_ASSISTED == "draft":
+        from assisted import draft_model_generate
+
+        outputs, stats = draft_model_generate(
+            model,
+            get_draft_model(model.device),
+            inputs["input_ids"],
+            inputs["attention_mask"],
+            pad_token_id=tokenizer.eos_token_id,
+            **sampling,
+        )
+        stats = stats.as_dict()
+    else:
+        with torch.no_grad():
+            outputs = model.generate(
+                input_ids=inputs["input_ids"],
+                attention_mask=inputs["attention_mask"],
+                pad_token_id=tokenizer.eos_token_id,
+                **sampling,
+            )
+    
+    generated_text = tokenizer.decode(outputs[0][inputs["input_ids"].shape[1]:], skip_special_tokens=True).strip()
+    response = truncate_at_stop(generated_text, BUD_STOP_SEQUENCES).strip().split("<|assistant|>")[-1].strip()
+    return response, stats
+
 class CharacterChat:
     def __init__(self, character_type: Character, user_personality: str, conversation_history: list, 
                  bud_model=None, bud_tokenizer=None):
@@ -44,21 +152,18 @@ class CharacterChat:
         self.user_personality = user_personality
         self.personality_context = load_personality_context(user_personality)
         self.conversation_history = conversation_history
+        self.last_generation_stats = None
 
         if self.character_type == Character.BUD:
             if bud_model and bud_tokenizer:
                 self.model = bud_model
                 self.tokenizer = bud_tokenizer
             else:
-                self.model, self.tokenizer = FastLanguageModel.from_pretrained(
-                    model_name="fine_tuned_llama_samantha_bud",
-                    max_seq_length=4096,
-                    dtype=torch.bfloat16,
-                    load_in_4bit=True,
-                    device_map="auto",
-                )
-                FastLanguageModel.for_inference(self.model)
+                self.model, self.tokenizer = load_bud_model()
         else:
+            from langchain_groq import ChatGroq
+            from langchain.chains import LLMChain
+
             self.character_data = self.load_character_data()
             self.context = self.character_data.get('context', '')
             self.llm = ChatGroq(
@@ -81,7 +186,9 @@ class CharacterChat:
         except json.JSONDecodeError:
             raise ValueError("Invalid JSON format in character data file")
 
-    def create_prompt_template(self) -> PromptTemplate:
+    def create_prompt_template(self) -> "PromptTemplate":
+        from langchain.prompts import PromptTemplate
+
         if self.character_type == Character.LUFFY:
             template = f"""
             You are Monkey D. Luffy from One Piece. Stay in character with these traits:
@@ -142,26 +249,7 @@ class CharacterChat:
             self.conversation_history = self.conversation_history[-5:]  # Keep last 5 exchanges
             
             input_text = f"Personality Context: {self.personality_context}\n" + "\n".join(self.conversation_history)
-            inputs = self.tokenizer(input_text, return_tensors="pt", truncation=True).to(self.model.device)
-            
-            if "input_ids" not in inputs or "attention_mask" not in inputs:
-                raise ValueError("Tokenizer did not return expected keys: 'input_ids' and 'attention_mask'")
-            
-            with torch.no_grad():
-                outputs = self.model.generate(
-                    input_ids=inputs["input_ids"],
-                    attention_mask=inputs["attention_mask"],
-                    max_new_tokens=150,
-                    temperature=0.7,
-                    pad_token_id=self.tokenizer.eos_token_id,
-                    do_sample=True,
-                    top_p=0.9,
-                    top_k=50,
-                    eos_token_id=self.tokenizer.encode("<|user|>")[0],
-                )
-            
-            generated_text = self.tokenizer.decode(outputs[0][inputs["input_ids"].shape[1]:], skip_special_tokens=True).strip()
-            response = generated_text.split("<|user|>")[0].strip().split("<|assistant|>")[-1].strip()
+            response, self.last_generation_stats = generate_bud_reply(self.model, self.tokenizer, input_text)
             
             self.conversation_history.append(response)
             return response
@@ -203,7 +291,11 @@ def get_character_greeting(character: Character) -> str:
     else:
         return "Hey there! Deadpool here, ready to break the fourth wall and possibly other things!"
 
-def create_emotion_analyzer() -> LLMChain:
+def create_emotion_analyzer() -> "LLMChain":
+    from langchain_groq import ChatGroq
+    from langchain.chains import LLMChain
+    from langchain.prompts import PromptTemplate
+
     emotion_llm = ChatGroq(
         model="mixtral-8x7b-32768",
         temperature=0.2,
@@ -225,14 +317,7 @@ def main():
     try:
         print("Welcome to the Character Chat System!")
         emotion_chain = create_emotion_analyzer()
-        bud_model, bud_tokenizer = FastLanguageModel.from_pretrained(
-            model_name="fine_tuned_llama_samantha_bud",
-            max_seq_length=4096,
-            dtype=torch.bfloat16,
-            load_in_4bit=True,
-            device_map="auto",
-        )
-        FastLanguageModel.for_inference(bud_model)
+        bud_model, bud_tokenizer = load_bud_model()
         global_conversation_history = []
 
         selected_character = select_character()
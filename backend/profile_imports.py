@@ -0,0 +1,76 @@
+"""Import-time profile of the server modules.
+
+Runs ``python -X importtime -c "import <module>"`` in a fresh interpreter for each module
+and prints the slowest top-level packages by total (self) import time, so startup cost can
+be tracked per module across changes.
+
+    python profile_imports.py app app_2 --mode background --json startup_profile.json
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+from collections import defaultdict
+from typing import Dict
+
+
+def profile_module(module: str, mode: str) -> Dict:
+    env = dict(os.environ, STARTUP_MODE=mode)
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        env=env,
+        capture_output=True,
+        text=True,
+    )
+    wall = time.perf_counter() - start
+
+    packages = defaultdict(int)
+    self_total = 0
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        self_us, _, name = line[len("import time:"):].split("|")
+        self_total += int(self_us)
+        # Summing self time per top-level package attributes every microsecond exactly once
+        packages[name.strip().split(".")[0]] += int(self_us)
+
+    return {
+        "module": module,
+        "mode": mode,
+        "ok": result.returncode == 0,
+        "error": result.stderr.strip().splitlines()[-1] if result.returncode else None,
+        "wall_seconds": round(wall, 3),
+        "import_seconds": round(self_total / 1e6, 3),
+        "packages": dict(sorted(packages.items(), key=lambda item: item[1], reverse=True)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Profile import-time cost of the server modules")
+    parser.add_argument("modules", nargs="*", default=["app", "app_2"])
+    parser.add_argument("--mode", default="background", choices=["eager", "lazy", "background"])
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--json", help="also write the full profile to this file")
+    args = parser.parse_args()
+
+    profiles = [profile_module(module, args.mode) for module in args.modules]
+    for profile in profiles:
+        status = "ok" if profile["ok"] else f"failed: {profile['error']}"
+        print(
+            f"\n{profile['module']} (STARTUP_MODE={profile['mode']}): "
+            f"{profile['import_seconds']}s in imports, {profile['wall_seconds']}s wall, {status}"
+        )
+        for name, package_us in list(profile["packages"].items())[:args.top]:
+            print(f"  {package_us / 1000:>9.1f} ms  {name}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as file:
+            json.dump(profiles, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,216 @@
+import os
+import re
+import logging
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Dict, List, Tuple
+
+# Per-request token budget for the rendered prompt (0 disables the check)
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "0"))
+# "warn" only logs when the budget is exceeded, "trim" drops the oldest turns, then the summary
+PROMPT_BUDGET_MODE = os.getenv("PROMPT_BUDGET_MODE", "trim")
+
+_TOKEN_RE = re.compile(r"\w+|[^\w\s]")
+
+
+@lru_cache(maxsize=1)
+def _get_encoding():
+    # Loaded on first use: get_encoding may download the BPE file, which must never
+    # block or break importing the app (e.g. in an offline container)
+    try:
+        import tiktoken
+
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        logging.warning(f"tiktoken unavailable, approximating token counts: {str(e)}")
+        return None
+
+
+def count_tokens(text: str) -> int:
+    if not text:
+        return 0
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text))
+    # Rough fallback when tiktoken is not installed or cannot load: words and punctuation marks
+    return len(_TOKEN_RE.findall(text))
+
+
+# Character templates, kept as data so they can be compiled once per personality
+CHARACTER_TEMPLATES: Dict[str, Dict] = {
+    "bud": {
+        "name": "BUD",
+        "intro": "You are BUD, an AI companion designed to support mental health. Keep your responses warm, conversational, and supportive, without sounding robotic.",
+        "guidelines": [
+            "Be direct but caring.",
+            "Encourage small steps toward improvement.",
+            "Inject light humor where appropriate.",
+            "Use casual phrasing rather than formal structure.",
+        ],
+        "note": "**Internal Note:** Use the following personality context to guide your tone, but do not mention it in your response: {personality_context}",
+        "examples": [
+            ("I feel like a failure.", "Hey, no way. You're just in a tough spot right now. Even legends have bad days—Batman lost his parents, and look where he ended up. Take a deep breath, one step at a time."),
+            ("I'm so stressed about exams.", "I hear you. Exams suck. But hey, you've prepared for this, and cramming now won't help. Take a break, grab a snack, and come back stronger."),
+            ("Nobody likes me.", "That's not true. You're probably just in a rough patch. You ever see a cat try to jump on a table and fail? Embarrassing, but does it stop being cute? No. Same logic applies to you."),
+        ],
+    },
+    "luffy": {
+        "name": "Luffy",
+        "intro": "You are Monkey D. Luffy, the future Pirate King! Your responses should be full of energy, fun, and randomness.",
+        "guidelines": [
+            "Always bring up food.",
+            "Be optimistic, no matter what.",
+            "Use simple, direct language.",
+            "Laugh a lot and use catchphrases.",
+        ],
+        "note": "**Internal Note:** Use the following personality context to guide your tone, but do not reference it in your response: {personality_context}",
+        "examples": [
+            ("I'm feeling down.", "Then stand up! Or eat some meat! Meat makes everything better! *Shishishi!*"),
+            ("I'm not motivated to work.", "What? You need motivation? Think of it like finding the One Piece! Keep going till you get it, or at least get some food on the way!"),
+            ("I have a big problem.", "Is it bigger than a Sea King? No? Then it's not that big! Punch through it!"),
+        ],
+    },
+    "deadpool": {
+        "name": "Deadpool",
+        "intro": "You are Deadpool. You are chaotic, hilarious, and totally unfiltered. You break the fourth wall constantly, insult the user *lovingly*, and make pop culture references.",
+        "guidelines": [
+            "Be sarcastic and witty.",
+            "Call out clichés and generic questions.",
+            "Swear heavily for comedic effect, but keep it edgy without being overly explicit.",
+            "Roasting the user is encouraged but in a fun way.",
+        ],
+        "note": "**Internal Note:** Use the following personality context to guide your tone, but do not mention it in your response: {personality_context}",
+        "examples": [
+            ("I feel sad.", "Aww, you poor thing. Here, let me play the world’s smallest violin for you... oh wait, I can’t because I HAVE NO HANDS. Just kidding, but seriously, what’s up?"),
+            ("I have no motivation to work.", "Neither do I, but here we are. Just slap your brain a few times and get going. Or go full goblin mode—your call."),
+            ("Give me life advice.", "Step 1: Don’t die. Step 2: If Step 1 fails, you really messed up. Step 3: If you’re still alive, stop overthinking and eat some tacos."),
+        ],
+    },
+}
+
+
+def split_context(context: str) -> Tuple[List[str], List[str]]:
+    """Splits a context from ``build_context`` into its leading summary block and its turns.
+
+    Each turn starts at a ``User:`` line and keeps every line up to the next one, so
+    multi-line messages and replies stay whole. Text before the first turn counts as
+    summary, whether or not it carries the summary prefix.
+    """
+    head, turns = [], []
+    for line in context.split("\n") if context else []:
+        if line.startswith("User: "):
+            turns.append([line])
+        elif turns:
+            turns[-1].append(line)
+        else:
+            head.append(line)
+    return ["\n".join(head)] if head else [], ["\n".join(turn) for turn in turns]
+
+
+def normalize_text(text: str) -> str:
+    # Collapse indentation, trailing spaces and blank-line runs
+    lines = [" ".join(line.split()) for line in text.splitlines()]
+    return "\n".join(line for line in lines if line)
+
+
+@dataclass(frozen=True)
+class RenderedPrompt:
+    context: str
+    prefix_tokens: int
+    dynamic_tokens: int
+    total_tokens: int
+    # Turns, plus the summary if it had to go as well
+    trimmed_blocks: int
+    over_budget: bool
+
+
+@dataclass(frozen=True)
+class CompiledPrompt:
+    character: str
+    prefix: str
+    suffix: str
+    prefix_tokens: int
+
+    @property
+    def template(self) -> str:
+        # PromptTemplate-compatible string: the static prefix is escaped so only the
+        # suffix placeholders are substituted
+        return self.prefix.replace("{", "{{").replace("}", "}}") + "\n" + self.suffix
+
+    def render(self, context: str, user_input: str, budget: int = None) -> RenderedPrompt:
+        budget = PROMPT_TOKEN_BUDGET if budget is None else budget
+        summary, turns = split_context(context)
+        fixed_tokens = self.prefix_tokens + count_tokens(self.suffix.format(context="", user_input=user_input))
+        summary_tokens = [count_tokens(block) + 1 for block in summary]
+        turn_tokens = [count_tokens(block) + 1 for block in turns]
+        dynamic_tokens = fixed_tokens - self.prefix_tokens + sum(summary_tokens) + sum(turn_tokens)
+
+        trimmed = 0
+        over_budget = budget > 0 and self.prefix_tokens + dynamic_tokens > budget
+        if over_budget:
+            logging.warning(
+                f"Prompt for {self.character} is {self.prefix_tokens + dynamic_tokens} tokens, budget is {budget}"
+            )
+            if PROMPT_BUDGET_MODE == "trim":
+                # Drop whole turns, oldest first, and the summary only once no turn is left;
+                # the static prefix is never touched
+                while turns and fixed_tokens + sum(summary_tokens) + sum(turn_tokens) > budget:
+                    turns.pop(0)
+                    turn_tokens.pop(0)
+                    trimmed += 1
+                if summary and fixed_tokens + sum(summary_tokens) > budget:
+                    summary, summary_tokens = [], []
+                    trimmed += 1
+                dynamic_tokens = fixed_tokens - self.prefix_tokens + sum(summary_tokens) + sum(turn_tokens)
+
+        return RenderedPrompt(
+            context="\n".join(summary + turns),
+            prefix_tokens=self.prefix_tokens,
+            dynamic_tokens=dynamic_tokens,
+            total_tokens=self.prefix_tokens + dynamic_tokens,
+            trimmed_blocks=trimmed,
+            over_budget=over_budget,
+        )
+
+
+@lru_cache(maxsize=None)
+def compile_prompt(character: str, personality_context: str) -> CompiledPrompt:
+    spec = CHARACTER_TEMPLATES[character]
+    parts = [spec["intro"], "Guidelines:"]
+    parts += [f"- {line}" for line in spec["guidelines"]]
+    parts.append("- " + spec["note"].format(personality_context=personality_context))
+    parts.append("Examples:")
+    for i, (user_text, reply) in enumerate(spec["examples"], 1):
+        parts.append(f'{i}. User: "{user_text}"')
+        parts.append(f'{spec["name"]}: "{reply}"')
+    prefix = normalize_text("\n".join(parts))
+
+    suffix = (
+        "Context from previous interactions: {context}\n"
+        "Human: {user_input}\n"
+        f"Respond as {spec['name']} would:"
+    )
+    return CompiledPrompt(
+        character=character,
+        prefix=prefix,
+        suffix=suffix,
+        prefix_tokens=count_tokens(prefix),
+    )
+
+
+def template_report(personality_contexts: Dict[str, str]) -> List[Tuple[str, str, int]]:
+    rows = []
+    for character in CHARACTER_TEMPLATES:
+        for personality_type, personality_context in personality_contexts.items():
+            compiled = compile_prompt(character, personality_context)
+            rows.append((character, personality_type, compiled.prefix_tokens))
+    return rows
+
+
+if __name__ == "__main__":
+    import json
+
+    with open("personality_contexts.json", "r", encoding="utf-8") as file:
+        contexts = json.load(file)
+    for character, personality_type, tokens in template_report(contexts):
+        print(f"{character:<10} {personality_type:<6} {tokens:>5} prefix tokens")
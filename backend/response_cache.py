@@ -0,0 +1,238 @@
+import os
+import re
+import time
+import zlib
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Dict, FrozenSet, List, Optional, Tuple
+
+from prompts import count_tokens
+
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "0") == "1"
+# Cosine similarity between normalized message vectors needed for a hit
+RESPONSE_CACHE_THRESHOLD = float(os.getenv("RESPONSE_CACHE_THRESHOLD", "0.85"))
+# Only messages whose conversation context is at most this many tokens are cached
+RESPONSE_CACHE_MAX_CONTEXT_TOKENS = int(os.getenv("RESPONSE_CACHE_MAX_CONTEXT_TOKENS", "0"))
+RESPONSE_CACHE_TTL_SECONDS = float(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "3600"))
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+# Replies are collected per message until this many variants exist, then rotated
+RESPONSE_CACHE_VARIANTS = int(os.getenv("RESPONSE_CACHE_VARIANTS", "3"))
+RESPONSE_CACHE_MIN_VARIANTS = int(os.getenv("RESPONSE_CACHE_MIN_VARIANTS", "2"))
+
+VECTOR_DIM = 1024
+ENTRY_OVERHEAD_BYTES = 256
+
+if TYPE_CHECKING:
+    import numpy as np
+
+_CONTRACTION_RE = re.compile(r"(\w)'(\w)")
+_NON_WORD_RE = re.compile(r"[^a-z0-9\s]+")
+_STOPWORDS = {"a", "an", "the", "so", "my", "me", "i", "im", "is", "am", "are", "really", "very", "just", "about", "to"}
+# Messages only share replies when they negate the same words; "I feel safe" and
+# "I dont feel safe" are close as vectors but need opposite answers
+NEGATIONS = {
+    "not", "no", "never", "nothing", "nobody", "none", "nowhere", "neither", "nor", "without", "cannot",
+    "dont", "doesnt", "didnt", "cant", "couldnt", "wont", "wouldnt", "shouldnt", "isnt", "arent", "wasnt",
+    "werent", "havent", "hasnt", "hadnt", "aint",
+}
+# Anything touching on self-harm, danger or abuse always goes to the LLM and is never stored
+_RISK_RE = re.compile(
+    r"\b(suicid\w*|kill\w*|die|dying|dead|death|overdos\w*|pills?|self ?harm\w*|hurt(ing)? myself|"
+    r"harm(ing)? myself|cut(ting)? myself|end (it|my life|everything)|live|living|alive|hopeless\w*|"
+    r"worthless|abus\w*|rape\w*|assault\w*|unsafe|safe|danger\w*|emergency|crisis|hit(s|ting)? me|"
+    r"beat(s|ing)? me|threat\w*|weapon\w*|gun\w*|knife)\b"
+)
+
+
+def _words(message: str) -> List[str]:
+    text = _CONTRACTION_RE.sub(r"\1\2", message.lower().replace("’", "'"))
+    return _NON_WORD_RE.sub(" ", text).split()
+
+
+def is_sensitive(message: str) -> bool:
+    return _RISK_RE.search(" ".join(_words(message))) is not None
+
+
+def negation_signature(message: str) -> FrozenSet[str]:
+    return frozenset(word for word in _words(message) if word in NEGATIONS)
+
+
+def normalize_message(message: str) -> List[str]:
+    words = _words(message)
+    # Crude plural folding and filler-word removal keep paraphrases close together
+    words = [word[:-1] if len(word) > 3 and word.endswith("s") else word for word in words]
+    return [word for word in words if word not in _STOPWORDS] or words
+
+
+def message_vector(message: str) -> "np.ndarray":
+    # numpy is only paid for once the opt-in cache is used, not on every cold start
+    import numpy as np
+
+    # Hashed word unigrams plus character trigrams, L2-normalized so a dot product is the cosine
+    vector = np.zeros(VECTOR_DIM, dtype=np.float32)
+    for word in normalize_message(message):
+        vector[zlib.crc32(word.encode("utf-8")) % VECTOR_DIM] += 2.0
+        padded = f"#{word}#"
+        for i in range(len(padded) - 2):
+            vector[zlib.crc32(padded[i:i + 3].encode("utf-8")) % VECTOR_DIM] += 1.0
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+@dataclass
+class CacheEntry:
+    key: Tuple[str, str, FrozenSet[str]]
+    row: int
+    variants: List[str] = field(default_factory=list)
+    created: float = 0.0
+    next_variant: int = 0
+
+    @property
+    def size(self) -> int:
+        return VECTOR_DIM * 4 + ENTRY_OVERHEAD_BYTES + sum(len(text.encode("utf-8")) for text in self.variants)
+
+
+class _Partition:
+    """Vectors of one (character, personality_type, negations) key, kept as a dense matrix."""
+
+    def __init__(self):
+        import numpy as np
+
+        self.matrix = np.zeros((16, VECTOR_DIM), dtype=np.float32)
+        self.entry_ids: List[int] = []
+
+    def add(self, vector: "np.ndarray", entry_id: int) -> int:
+        import numpy as np
+
+        row = len(self.entry_ids)
+        if row == self.matrix.shape[0]:
+            self.matrix = np.vstack([self.matrix, np.zeros_like(self.matrix)])
+        self.matrix[row] = vector
+        self.entry_ids.append(entry_id)
+        return row
+
+    def remove(self, row: int) -> Optional[int]:
+        # Swap the last row into the hole; returns the entry id whose row changed
+        last = len(self.entry_ids) - 1
+        moved = None
+        if row != last:
+            self.matrix[row] = self.matrix[last]
+            self.entry_ids[row] = self.entry_ids[last]
+            moved = self.entry_ids[row]
+        self.entry_ids.pop()
+        return moved
+
+    def best(self, vector: "np.ndarray") -> Tuple[Optional[int], float]:
+        if not self.entry_ids:
+            return None, 0.0
+        scores = self.matrix[:len(self.entry_ids)] @ vector
+        row = int(scores.argmax())
+        return row, float(scores[row])
+
+
+class ResponseCache:
+    def __init__(self, threshold: float = RESPONSE_CACHE_THRESHOLD,
+                 max_context_tokens: int = RESPONSE_CACHE_MAX_CONTEXT_TOKENS,
+                 ttl: float = RESPONSE_CACHE_TTL_SECONDS, max_bytes: int = RESPONSE_CACHE_MAX_BYTES,
+                 variants: int = RESPONSE_CACHE_VARIANTS, min_variants: int = RESPONSE_CACHE_MIN_VARIANTS):
+        self.threshold = threshold
+        self.max_context_tokens = max_context_tokens
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.variants = variants
+        self.min_variants = min(min_variants, variants)
+        self.partitions: Dict[Tuple[str, str, FrozenSet[str]], _Partition] = {}
+        self.entries: "OrderedDict[int, CacheEntry]" = OrderedDict()  # LRU order, oldest first
+        self.bytes = 0
+        self.next_id = 0
+        self.lock = threading.Lock()
+        self.stats = {"lookups": 0, "hits": 0, "misses": 0, "skipped": 0, "sensitive": 0, "evictions": 0, "expired": 0}
+
+    def cacheable(self, context: str) -> bool:
+        return count_tokens(context) <= self.max_context_tokens
+
+    @staticmethod
+    def key(character: str, personality_type: str, message: str) -> Tuple[str, str, FrozenSet[str]]:
+        return character, personality_type, negation_signature(message)
+
+    def get(self, character: str, personality_type: str, message: str, context: str = "") -> Optional[str]:
+        if not self.cacheable(context):
+            with self.lock:
+                self.stats["skipped"] += 1
+            return None
+        if is_sensitive(message):
+            with self.lock:
+                self.stats["sensitive"] += 1
+            return None
+        vector = message_vector(message)
+        with self.lock:
+            self.stats["lookups"] += 1
+            entry = self._match(self.key(character, personality_type, message), vector)
+            if entry is None or len(entry.variants) < self.min_variants:
+                # Too few variants yet: let the LLM answer so replies do not feel canned
+                self.stats["misses"] += 1
+                return None
+            self.stats["hits"] += 1
+            response = entry.variants[entry.next_variant % len(entry.variants)]
+            entry.next_variant += 1
+            return response
+
+    def put(self, character: str, personality_type: str, message: str, response: str, context: str = ""):
+        if not response or not self.cacheable(context) or is_sensitive(message):
+            return
+        key = self.key(character, personality_type, message)
+        vector = message_vector(message)
+        with self.lock:
+            entry = self._match(key, vector)
+            if entry is not None:
+                if len(entry.variants) < self.variants and response not in entry.variants:
+                    entry.variants.append(response)
+                    self.bytes += len(response.encode("utf-8"))
+            else:
+                partition = self.partitions.setdefault(key, _Partition())
+                entry_id = self.next_id
+                self.next_id += 1
+                entry = CacheEntry(key=key, row=partition.add(vector, entry_id), variants=[response], created=time.monotonic())
+                self.entries[entry_id] = entry
+                self.bytes += entry.size
+            while self.bytes > self.max_bytes and self.entries:
+                self._remove(next(iter(self.entries)))
+                self.stats["evictions"] += 1
+
+    def metrics(self) -> Dict:
+        with self.lock:
+            lookups = self.stats["lookups"]
+            return {
+                **self.stats,
+                "hit_rate": round(self.stats["hits"] / lookups, 4) if lookups else 0.0,
+                "llm_calls_avoided": self.stats["hits"],
+                "entries": len(self.entries),
+                "bytes": self.bytes,
+            }
+
+    def _match(self, key: Tuple[str, str, FrozenSet[str]], vector: "np.ndarray") -> Optional[CacheEntry]:
+        partition = self.partitions.get(key)
+        if partition is None:
+            return None
+        row, score = partition.best(vector)
+        if row is None or score < self.threshold:
+            return None
+        entry_id = partition.entry_ids[row]
+        entry = self.entries[entry_id]
+        if time.monotonic() - entry.created > self.ttl:
+            self._remove(entry_id)
+            self.stats["expired"] += 1
+            return None
+        self.entries.move_to_end(entry_id)
+        return entry
+
+    def _remove(self, entry_id: int):
+        entry = self.entries.pop(entry_id)
+        self.bytes -= entry.size
+        partition = self.partitions[entry.key]
+        moved = partition.remove(entry.row)
+        if moved is not None:
+            self.entries[moved].row = entry.row
+        if not partition.entry_ids:
+            del self.partitions[entry.key]
@@ -0,0 +1,240 @@
+import os
+import gzip
+import zlib
+import fcntl
+import logging
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterator, List, Optional
+
+from history import ASCENDING
+
+# off: keep everything; archive: a scheduled `archive_chats.py run` moves old turns to disk
+CHAT_RETENTION_MODE = os.getenv("CHAT_RETENTION_MODE", "off")
+CHAT_HOT_DAYS = int(os.getenv("CHAT_HOT_DAYS", "90"))
+# Must be an existing absolute path on persistent storage (e.g. /home on App Service); the
+# container's own disk is wiped on restart, after the archived turns have left Mongo
+CHAT_ARCHIVE_DIR = os.getenv("CHAT_ARCHIVE_DIR", "")
+CHAT_ARCHIVE_BATCH_SIZE = int(os.getenv("CHAT_ARCHIVE_BATCH_SIZE", "1000"))
+
+DUPLICATE_KEY = 11000
+
+
+def ensure_retention_index(collection, mode: str = CHAT_RETENTION_MODE):
+    from pymongo.errors import OperationFailure
+
+    try:
+        # The former ttl mode deleted turns with no archive and before they were summarized
+        if "timestamp_ttl" in collection.index_information():
+            collection.drop_index("timestamp_ttl")
+            logging.warning("Dropped the timestamp_ttl index, chats no longer expire without an archive")
+        if mode == "archive":
+            collection.create_index([("timestamp", ASCENDING)], name="timestamp")
+        elif mode != "off":
+            logging.error(f"Unknown CHAT_RETENTION_MODE {mode}, chats are kept")
+    except OperationFailure as e:
+        logging.error(f"Retention index for mode {mode} not created: {str(e)}")
+
+
+def check_archive_dir(archive_dir: str) -> str:
+    # Turns are deleted from Mongo once archived, so never fall back to a default location
+    if not archive_dir:
+        raise ValueError("CHAT_ARCHIVE_DIR must be set to a directory on persistent storage")
+    if not os.path.isabs(archive_dir):
+        raise ValueError(f"CHAT_ARCHIVE_DIR must be an absolute path, got {archive_dir}")
+    if not os.path.isdir(archive_dir):
+        raise ValueError(f"CHAT_ARCHIVE_DIR {archive_dir} does not exist; mount persistent storage there first")
+    return archive_dir
+
+
+def archive_day_dir(archive_dir: str, day: date) -> str:
+    return os.path.join(archive_dir, f"{day:%Y}", f"{day:%m}", f"{day:%d}")
+
+
+def write_archive(archive_dir: str, day: date, docs: List[Dict], name: str) -> str:
+    """Writes one batch as its own ``<day dir>/<name>.ndjson.gz`` file.
+
+    The file is written under a temporary name, fsynced and then renamed, so a crash
+    leaves either the complete file or a ``.tmp`` that readers ignore; a damaged file
+    can never take batches written after it down with it.
+    """
+    from bson import json_util
+
+    directory = archive_day_dir(archive_dir, day)
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{name}.ndjson.gz")
+    temp_path = path + ".tmp"
+    data = "".join(json_util.dumps(doc) + "\n" for doc in docs).encode("utf-8")
+    with open(temp_path, "wb") as file:
+        file.write(gzip.compress(data))
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temp_path, path)
+    # The rename itself has to be durable before the turns are deleted from Mongo
+    directory_fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(directory_fd)
+    finally:
+        os.close(directory_fd)
+    return path
+
+
+def read_archive_day(archive_dir: str, day: date) -> Iterator[Dict]:
+    from bson import json_util
+
+    directory = archive_day_dir(archive_dir, day)
+    if not os.path.isdir(directory):
+        return
+    seen = set()
+    for name in sorted(os.listdir(directory)):
+        if not name.endswith(".ndjson.gz"):
+            continue
+        path = os.path.join(directory, name)
+        try:
+            with gzip.open(path, "rt", encoding="utf-8") as file:
+                lines = file.readlines()
+        except (OSError, EOFError, zlib.error) as e:
+            # Files are renamed into place only once complete, so this means damage on disk
+            logging.error(f"Unreadable chat archive {path}: {str(e)}")
+            continue
+        for line in lines:
+            if not line.strip():
+                continue
+            doc = json_util.loads(line)
+            # A crash between the archive write and the delete archives a turn twice
+            if doc["_id"] in seen:
+                continue
+            seen.add(doc["_id"])
+            yield doc
+
+
+def iter_archive(archive_dir: str, start: date, end: date, user_id: Optional[str] = None,
+                 character: Optional[str] = None) -> Iterator[Dict]:
+    day = start
+    while day <= end:
+        for doc in read_archive_day(archive_dir, day):
+            if (user_id is None or doc["user_id"] == user_id) and (character is None or doc["character"] == character):
+                yield doc
+        day += timedelta(days=1)
+
+
+def restore_archive(collection, archive_dir: str, start: date, end: date, user_id: Optional[str] = None,
+                    character: Optional[str] = None, batch_size: int = CHAT_ARCHIVE_BATCH_SIZE) -> int:
+    """Copies archived turns back into ``collection``; turns already present are skipped.
+
+    Restored turns older than the hot window are archived again by the next job run, so
+    restore into the live collection only after raising ``CHAT_HOT_DAYS`` or turning
+    retention off.
+    """
+    restored = 0
+    batch: List[Dict] = []
+    for doc in iter_archive(archive_dir, start, end, user_id, character):
+        batch.append(doc)
+        if len(batch) >= batch_size:
+            restored += _insert_new(collection, batch)
+            batch = []
+    if batch:
+        restored += _insert_new(collection, batch)
+    return restored
+
+
+def _insert_new(collection, docs: List[Dict]) -> int:
+    from pymongo.errors import BulkWriteError
+
+    try:
+        return len(collection.insert_many(docs, ordered=False).inserted_ids)
+    except BulkWriteError as e:
+        errors = [err for err in e.details.get("writeErrors", []) if err.get("code") != DUPLICATE_KEY]
+        if errors:
+            raise
+        return e.details.get("nInserted", 0)
+
+
+class RetentionJob:
+    """Moves turns older than the hot window from ``chats`` into gzip NDJSON archive files.
+
+    Every batch becomes its own file under ``YYYY/MM/DD/`` for the day of its turns.
+
+    A turn is only archived once the conversation summary has folded it in
+    (``timestamp <= summarized_until``), so the hot path loses neither the raw turns it
+    reads verbatim nor context the summary has not absorbed yet, however long a user has
+    been away; history the summarizer's first compaction skipped (``SUMMARY_BACKFILL_TURNS``)
+    counts as folded in. Each batch is fsynced to disk before its turns are deleted by ``_id``.
+
+    The job is not run by the web app: schedule ``archive_chats.py run`` from exactly one
+    place (a cron job or WebJob). Its lock file only keeps overlapping runs on one host
+    apart, two hosts would archive the same turns to different disks.
+    """
+
+    def __init__(self, chat_collection, summary_collection, archive_dir: str = CHAT_ARCHIVE_DIR,
+                 hot_days: int = CHAT_HOT_DAYS, batch_size: int = CHAT_ARCHIVE_BATCH_SIZE):
+        self.chat_collection = chat_collection
+        self.summary_collection = summary_collection
+        self.archive_dir = archive_dir
+        self.hot_days = hot_days
+        self.batch_size = batch_size
+        self.stats = {"runs": 0, "archived": 0, "kept": 0, "skipped_runs": 0}
+        self.run_id = ""
+        self.files_written = 0
+
+    def cutoff(self, now: Optional[datetime] = None) -> datetime:
+        # Whole days only, so a day directory is complete once the job has passed it
+        now = now or datetime.utcnow()
+        return datetime.combine(now.date() - timedelta(days=self.hot_days), datetime.min.time())
+
+    def run_once(self, now: Optional[datetime] = None) -> Dict:
+        check_archive_dir(self.archive_dir)
+        with open(os.path.join(self.archive_dir, ".lock"), "w") as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                self.stats["skipped_runs"] += 1
+                return {"archived": 0, "kept": 0, "skipped": True}
+
+            # Names files of this run uniquely, so a re-run never touches an earlier batch
+            self.run_id = f"{datetime.utcnow():%Y%m%dT%H%M%S}-{os.getpid()}"
+            self.files_written = 0
+            archived = kept = 0
+            cursor = (
+                self.chat_collection.find({"timestamp": {"$lt": self.cutoff(now)}})
+                .sort("timestamp", ASCENDING)
+                .batch_size(self.batch_size)
+            )
+            batch: List[Dict] = []
+            for doc in cursor:
+                batch.append(doc)
+                if len(batch) >= self.batch_size:
+                    moved = self._archive_batch(batch)
+                    archived, kept = archived + moved, kept + len(batch) - moved
+                    batch = []
+            if batch:
+                moved = self._archive_batch(batch)
+                archived, kept = archived + moved, kept + len(batch) - moved
+
+        self.stats["runs"] += 1
+        self.stats["archived"] += archived
+        self.stats["kept"] += kept
+        logging.info(f"Chat retention archived {archived} turns, kept {kept} not yet summarized")
+        return {"archived": archived, "kept": kept, "skipped": False}
+
+    def _archive_batch(self, batch: List[Dict]) -> int:
+        pairs = {(doc["user_id"], doc["character"]) for doc in batch}
+        summarized_until = {
+            (summary["user_id"], summary["character"]): summary["summarized_until"]
+            for summary in self.summary_collection.find(
+                {"$or": [{"user_id": user_id, "character": character} for user_id, character in pairs]},
+                {"user_id": 1, "character": 1, "summarized_until": 1},
+            )
+            if summary.get("summarized_until")
+        }
+        by_day: Dict[date, List[Dict]] = defaultdict(list)
+        for doc in batch:
+            until = summarized_until.get((doc["user_id"], doc["character"]))
+            if until is not None and doc["timestamp"] <= until:
+                by_day[doc["timestamp"].date()].append(doc)
+
+        for day, docs in sorted(by_day.items()):
+            self.files_written += 1
+            write_archive(self.archive_dir, day, docs, f"{self.run_id}-{self.files_written:05d}")
+            self.chat_collection.delete_many({"_id": {"$in": [doc["_id"] for doc in docs]}})
+        return sum(len(docs) for docs in by_day.values())
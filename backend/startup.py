@@ -0,0 +1,102 @@
+import os
+import time
+import logging
+import threading
+from typing import Callable, Dict, List
+
+# eager: build every client while the module is imported (the old behaviour)
+# lazy: build each client on first use
+# background: return from import immediately and warm everything up in a thread
+STARTUP_MODE = os.getenv("STARTUP_MODE", "eager")
+# Minimum pause between warmup attempts while a component keeps failing
+WARMUP_RETRY_SECONDS = float(os.getenv("WARMUP_RETRY_SECONDS", "5"))
+
+
+class Lazy:
+    """Thread-safe, build-once holder for an expensive client or model."""
+
+    def __init__(self, name: str, factory: Callable):
+        self.name = name
+        self.factory = factory
+        self.value = None
+        self.ready = False
+        self.error = None
+        self.seconds = None
+        self.lock = threading.Lock()
+
+    def get(self):
+        if self.ready:
+            return self.value
+        with self.lock:
+            if not self.ready:
+                start = time.perf_counter()
+                try:
+                    self.value = self.factory()
+                except Exception as e:
+                    self.error = str(e)
+                    raise
+                self.seconds = round(time.perf_counter() - start, 3)
+                self.error = None
+                self.ready = True
+                logging.info(f"Initialized {self.name} in {self.seconds}s")
+        return self.value
+
+    def status(self) -> Dict:
+        return {"ready": self.ready, "seconds": self.seconds, "error": self.error}
+
+
+class Warmup:
+    def __init__(self, components: List[Lazy], retry_interval: float = WARMUP_RETRY_SECONDS):
+        self.components = components
+        self.retry_interval = retry_interval
+        self.thread = None
+        self.started_at = 0.0
+        self.lock = threading.Lock()
+
+    def run(self):
+        for component in self.components:
+            if component.ready:
+                continue
+            try:
+                component.get()
+            except Exception as e:
+                logging.error(f"Warmup of {component.name} failed: {str(e)}")
+
+    def start(self):
+        # A finished run that left components cold (e.g. Mongo unreachable at boot) is retried
+        with self.lock:
+            if self.thread is not None and (self.thread.is_alive() or self.is_ready()):
+                return
+            if self.thread is not None and time.monotonic() - self.started_at < self.retry_interval:
+                return
+            self.started_at = time.monotonic()
+            self.thread = threading.Thread(target=self.run, name="warmup", daemon=True)
+            self.thread.start()
+
+    def is_ready(self) -> bool:
+        return all(component.ready for component in self.components)
+
+    def status(self) -> Dict:
+        return {
+            "status": "warm" if self.is_ready() else "cold",
+            "mode": STARTUP_MODE,
+            "components": {component.name: component.status() for component in self.components},
+        }
+
+    def boot(self):
+        if STARTUP_MODE == "eager":
+            for component in self.components:
+                component.get()
+        elif STARTUP_MODE == "background":
+            self.start()
+
+
+class LazyCollection:
+    """Stands in for a pymongo collection until the database client is first needed."""
+
+    def __init__(self, db: Lazy, name: str):
+        self._db = db
+        self._name = name
+
+    def __getattr__(self, attr):
+        return getattr(self._db.get()[self._name], attr)
@@ -0,0 +1,83 @@
+from typing import List, Sequence, Set, Tuple
+
+import torch
+from transformers import StoppingCriteria
+
+# Turn markers from the fine-tuning format; BUD is done as soon as it starts another turn
+BUD_STOP_SEQUENCES = ["<|user|>", "<|system|>"]
+
+
+def stop_token_variants(tokenizer, stop: str) -> Set[Tuple[int, ...]]:
+    # The same marker tokenizes differently at the start of a line, after a space or glued
+    # to the previous word, so collect every form and match each one on token ids
+    variants = set()
+    for prefix in ("", " ", "\n", "a"):
+        prefix_ids = tokenizer.encode(prefix, add_special_tokens=False) if prefix else []
+        ids = tokenizer.encode(prefix + stop, add_special_tokens=False)
+        if ids[:len(prefix_ids)] == prefix_ids and len(ids) > len(prefix_ids):
+            variants.add(tuple(ids[len(prefix_ids):]))
+    return variants
+
+
+class StopSequenceCriteria(StoppingCriteria):
+    """Stops each sequence as soon as one of ``stop_sequences`` appears in its generated text.
+
+    Only the tokens added since the previous call are examined (plus an overlap of the
+    longest marker), so the cost per decoding step does not grow with the output. Token-id
+    matching catches the common tokenizations; a decoded-text check over the same window
+    catches markers split across tokens in any other way. Returns one flag per row so
+    finished sequences in a batch stop while the others continue.
+    """
+
+    def __init__(self, tokenizer, stop_sequences: Sequence[str], prompt_length: int):
+        self.tokenizer = tokenizer
+        self.stop_sequences = list(stop_sequences)
+        self.prompt_length = prompt_length
+        self.variants: List[Tuple[int, ...]] = sorted(
+            {variant for stop in self.stop_sequences for variant in stop_token_variants(tokenizer, stop)}, key=len
+        )
+        self.window = max((len(variant) for variant in self.variants), default=1) + 2
+        self.checked = None
+        self.done = None
+
+    def __call__(self, input_ids: torch.LongTensor, scores=None, **kwargs) -> torch.BoolTensor:
+        batch, length = input_ids.shape
+        if self.done is None or self.done.shape[0] != batch:
+            self.done = torch.zeros(batch, dtype=torch.bool, device=input_ids.device)
+            self.checked = [self.prompt_length] * batch
+
+        for row in range(batch):
+            if self.done[row]:
+                continue
+            start = max(self.prompt_length, self.checked[row] - self.window)
+            tail = input_ids[row, start:length].tolist()
+            self.checked[row] = length
+            if self._matches(tail):
+                self.done[row] = True
+        return self.done.clone()
+
+    def _matches(self, tail: List[int]) -> bool:
+        for variant in self.variants:
+            size = len(variant)
+            for i in range(len(tail) - size + 1):
+                if tuple(tail[i:i + size]) == variant:
+                    return True
+        text = self.tokenizer.decode(tail, skip_special_tokens=False)
+        return any(stop in text for stop in self.stop_sequences)
+
+
+def truncate_at_stop(text: str, stop_sequences: Sequence[str]) -> str:
+    cut = min((text.find(stop) for stop in stop_sequences if stop in text), default=len(text))
+    return text[:cut]
+
+
+def useful_token_count(tokenizer, generated_ids: Sequence[int], stop_sequences: Sequence[str]) -> int:
+    # Number of generated tokens up to and including the first stop marker or EOS; the rest
+    # is waste. With the wrong eos_token_id the model runs past its own EOS, so it counts too
+    for count in range(1, len(generated_ids) + 1):
+        if generated_ids[count - 1] == tokenizer.eos_token_id:
+            return count
+        text = tokenizer.decode(generated_ids[:count], skip_special_tokens=False)
+        if any(stop in text for stop in stop_sequences):
+            return count
+    return len(generated_ids)
@@ -0,0 +1,287 @@
+import os
+import queue
+import logging
+import threading
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+
+from history import ASCENDING, DESCENDING
+
+# Number of most recent raw turns that stay verbatim in the prompt
+SUMMARY_RAW_TURNS = int(os.getenv("SUMMARY_RAW_TURNS", "2"))
+# Upper bound for the running summary, in words
+SUMMARY_MAX_WORDS = int(os.getenv("SUMMARY_MAX_WORDS", "80"))
+# Maximum number of turns folded into the summary in one pass
+SUMMARY_BATCH_TURNS = int(os.getenv("SUMMARY_BATCH_TURNS", "50"))
+# Turns leave the raw window into the summary on every flush by cheap extraction; one LLM
+# call rewrites the summary from the raw turns once this many have been folded in that way
+SUMMARY_REWRITE_TURNS = int(os.getenv("SUMMARY_REWRITE_TURNS", "50"))
+# On the first compaction of a conversation only this many turns of existing history are
+# summarized, so a deploy does not start a chain of LLM calls over every long history
+SUMMARY_BACKFILL_TURNS = int(os.getenv("SUMMARY_BACKFILL_TURNS", "50"))
+SUMMARY_QUEUE_SIZE = int(os.getenv("SUMMARY_QUEUE_SIZE", "1000"))
+
+SUMMARY_PROMPT = """Update the running summary of a conversation between a user and {character}.
+Keep the facts about the user, their feelings and anything they asked to be remembered. Use at most {max_words} words.
+
+Current summary: {summary}
+
+New turns:
+{turns}
+
+Updated summary:"""
+
+
+def format_turn(msg: Dict) -> str:
+    return f"User: {msg['content']}\n{msg['character']}: {msg['response']}"
+
+
+def build_context(summary: str, raw_turns: List[Dict]) -> str:
+    lines = []
+    if summary:
+        lines.append(f"Summary of earlier conversation: {summary}")
+    lines += [format_turn(msg) for msg in raw_turns]
+    return "\n".join(lines)
+
+
+def parse_context(context: str, character: str) -> Tuple[str, List[Dict]]:
+    """Splits a context built by ``build_context`` back into the summary and its turns.
+
+    Lines that start neither a user nor a ``character`` message continue the message
+    before them, so multi-line messages survive the round trip.
+    """
+    summary, turns, current = "", [], None
+    summary_prefix, reply_prefix = "Summary of earlier conversation: ", f"{character}: "
+    for line in context.split("\n") if context else []:
+        if not turns and current is None and line.startswith(summary_prefix):
+            summary = line[len(summary_prefix):]
+            current = "summary"
+        elif line.startswith("User: "):
+            turns.append({"content": line[len("User: "):], "response": ""})
+            current = "content"
+        elif line.startswith(reply_prefix) and turns:
+            turns[-1]["response"] = line[len(reply_prefix):]
+            current = "response"
+        elif current == "summary":
+            summary += "\n" + line
+        elif current is not None:
+            turns[-1][current] += "\n" + line
+    return summary, turns
+
+
+def extractive_summarize(summary: str, turns: List[Dict], max_words: int = SUMMARY_MAX_WORDS) -> str:
+    # Cheap fallback: keep the first sentence of every user message, newest last,
+    # and drop the oldest words once the summary is over budget
+    notes = [summary] if summary else []
+    for msg in turns:
+        first_sentence = msg["content"].strip().split(". ")[0].rstrip(".")
+        if first_sentence:
+            notes.append(f"User said: {first_sentence}.")
+    words = " ".join(notes).split()
+    return " ".join(words[-max_words:])
+
+
+class LLMSummarizer:
+    def __init__(self, max_words: int = SUMMARY_MAX_WORDS):
+        self.max_words = max_words
+        self.chain = None
+
+    def __call__(self, summary: str, turns: List[Dict]) -> str:
+        if self.chain is None:
+            from langchain_groq import ChatGroq
+            from langchain.chains import LLMChain
+            from langchain.prompts import PromptTemplate
+
+            llm = ChatGroq(model="mixtral-8x7b-32768", temperature=0.2, max_tokens=256, timeout=30, max_retries=2)
+            self.chain = LLMChain(llm=llm, prompt=PromptTemplate.from_template(SUMMARY_PROMPT))
+        try:
+            return self.chain.run({
+                "character": turns[-1]["character"],
+                "max_words": self.max_words,
+                "summary": summary or "(none)",
+                "turns": "\n".join(format_turn(msg) for msg in turns),
+            }).strip()
+        except Exception as e:
+            logging.error(f"Summary LLM error: {str(e)}")
+            return extractive_summarize(summary, turns, self.max_words)
+
+
+class ConversationSummarizer:
+    """Keeps a rolling per-(user_id, character) summary up to date from a background thread.
+
+    The prompt always holds the summary plus the last ``raw_turns`` turns. Turns that leave
+    the raw window are folded into the summary right away by ``extractive_summarize``; every
+    ``rewrite_turns`` folded turns one LLM call rewrites the summary from the raw turns, so
+    LLM tokens are spent once per batch rather than on every flush.
+    """
+
+    def __init__(self, chat_collection, summary_collection,
+                 summarize_fn: Optional[Callable[[str, List[Dict]], str]] = None,
+                 raw_turns: int = SUMMARY_RAW_TURNS, max_queue: int = SUMMARY_QUEUE_SIZE,
+                 rewrite_turns: int = SUMMARY_REWRITE_TURNS, backfill_turns: int = SUMMARY_BACKFILL_TURNS,
+                 max_words: int = SUMMARY_MAX_WORDS):
+        self.chat_collection = chat_collection
+        self.summary_collection = summary_collection
+        self.summarize_fn = summarize_fn or LLMSummarizer(max_words)
+        self.raw_turns = raw_turns
+        self.rewrite_turns = max(1, min(rewrite_turns, SUMMARY_BATCH_TURNS))
+        self.backfill_turns = backfill_turns
+        self.max_words = max_words
+        self.queue: "queue.Queue[Tuple[str, str]]" = queue.Queue(maxsize=max_queue)
+        self.pending = set()
+        self.lock = threading.Lock()
+        self.worker = None
+        self.indexes_ready = False
+
+    def start(self):
+        with self.lock:
+            if self.worker is None or not self.worker.is_alive():
+                self.worker = threading.Thread(target=self._run, name="conversation-summarizer", daemon=True)
+                self.worker.start()
+
+    def enqueue(self, user_id: str, character: str):
+        # Never blocks the request: duplicate keys are coalesced and a full queue drops the job,
+        # the next chat for that conversation will enqueue it again
+        key = (user_id, character)
+        with self.lock:
+            if key in self.pending:
+                return
+            self.pending.add(key)
+        try:
+            self.queue.put_nowait(key)
+        except queue.Full:
+            with self.lock:
+                self.pending.discard(key)
+            logging.warning(f"Summary queue full, skipping {character} conversation for {user_id}")
+            return
+        self.start()
+
+    def get_context(self, user_id: str, character: str, pending: Optional[List[Dict]] = None) -> str:
+        return self.get_contexts(user_id, [character], pending)[character]
+
+    def get_contexts(self, user_id: str, characters: List[str], pending: Optional[List[Dict]] = None) -> Dict[str, str]:
+        # One summary query for all characters, then one index-bounded "last N" read per character
+        summaries = {
+            doc["character"]: doc
+            for doc in self.summary_collection.find(
+                {"user_id": user_id, "character": {"$in": characters}},
+                {"_id": 0, "character": 1, "summary": 1, "summarized_until": 1},
+            )
+        }
+        # The raw window plus as many turns again that the worker may not have folded in yet
+        limit = 2 * self.raw_turns
+        recent_by_character = {}
+        if limit > 0:
+            for character in characters:
+                recent_by_character[character] = list(
+                    self.chat_collection.find({"user_id": user_id, "character": character})
+                    .sort("timestamp", DESCENDING)
+                    .limit(limit)
+                )
+
+        contexts = {}
+        for character in characters:
+            recent = recent_by_character.get(character, [])
+            character_pending = [msg for msg in pending or [] if msg["character"] == character]
+            if character_pending:
+                # Turns still buffered by the chat writer are newer than anything stored
+                stored_ids = {msg["_id"] for msg in recent}
+                recent += [msg for msg in character_pending if msg["_id"] not in stored_ids]
+                recent.sort(key=lambda msg: msg["timestamp"], reverse=True)
+                recent = recent[:limit]
+            summary_doc = summaries.get(character, {})
+            until = summary_doc.get("summarized_until")
+            # Keep the raw window, and any older turn the summary does not cover yet
+            recent = [
+                msg for i, msg in enumerate(recent)
+                if i < self.raw_turns or until is None or msg["timestamp"] > until
+            ]
+            recent.reverse()
+            contexts[character] = build_context(summary_doc.get("summary", ""), recent)
+        return contexts
+
+    def compact(self, user_id: str, character: str) -> int:
+        self._ensure_indexes()
+        conversation = {"user_id": user_id, "character": character}
+        summary_doc = self.summary_collection.find_one(conversation) or {}
+        until = summary_doc.get("summarized_until")
+        if until is None:
+            # First compaction: history older than the last backfill_turns is left out of the
+            # summary (and becomes eligible for the retention archive)
+            oldest = list(
+                self.chat_collection.find(conversation, {"timestamp": 1})
+                .sort("timestamp", DESCENDING)
+                .skip(self.raw_turns + self.backfill_turns)
+                .limit(1)
+            )
+            until = oldest[0]["timestamp"] if oldest else None
+
+        # Everything newer than the summary except the raw turns the hot path reads verbatim
+        raw = list(
+            self.chat_collection.find(conversation, {"timestamp": 1})
+            .sort("timestamp", DESCENDING)
+            .limit(self.raw_turns)
+        )
+        if len(raw) < self.raw_turns:
+            return 0
+        query = dict(conversation)
+        if until is not None:
+            query["timestamp"] = {"$gt": until}
+        if raw:
+            query.setdefault("timestamp", {})["$lt"] = raw[-1]["timestamp"]
+
+        projection = {"content": 1, "response": 1, "character": 1, "timestamp": 1}
+        turns = list(self.chat_collection.find(query, projection).sort("timestamp", ASCENDING).limit(SUMMARY_BATCH_TURNS))
+        if not turns:
+            return 0
+
+        if "rewritten_until" in summary_doc:
+            rewritten_until, rewritten_summary = summary_doc["rewritten_until"], summary_doc.get("rewritten_summary", "")
+        else:
+            # New conversation, or a summary that predates extractive folding and covers up to until
+            rewritten_until, rewritten_summary = until, summary_doc.get("summary", "")
+        folded = summary_doc.get("unrewritten_turns", 0) + len(turns)
+        update = {"summarized_until": turns[-1]["timestamp"], "updated_at": datetime.utcnow()}
+        if folded >= self.rewrite_turns:
+            # Rewrite from the last LLM summary and the raw turns folded in since, newest batch only
+            rewrite_query = dict(conversation, timestamp={"$lte": turns[-1]["timestamp"]})
+            if rewritten_until is not None:
+                rewrite_query["timestamp"]["$gt"] = rewritten_until
+            batch = list(
+                self.chat_collection.find(rewrite_query, projection)
+                .sort("timestamp", DESCENDING)
+                .limit(SUMMARY_BATCH_TURNS)
+            )
+            batch.reverse()
+            summary = self.summarize_fn(rewritten_summary, batch)
+            update.update(summary=summary, rewritten_summary=summary, rewritten_until=turns[-1]["timestamp"],
+                          unrewritten_turns=0)
+        else:
+            update.update(
+                summary=extractive_summarize(summary_doc.get("summary", ""), turns, self.max_words),
+                rewritten_summary=rewritten_summary, rewritten_until=rewritten_until, unrewritten_turns=folded,
+            )
+        self.summary_collection.update_one(
+            conversation, {"$set": update, "$inc": {"turns_summarized": len(turns)}}, upsert=True
+        )
+        if len(turns) == SUMMARY_BATCH_TURNS:
+            # More history left behind this batch, fold it on the next pass; bounded by backfill_turns
+            self.enqueue(user_id, character)
+        return len(turns)
+
+    def _ensure_indexes(self):
+        if not self.indexes_ready:
+            self.summary_collection.create_index([("user_id", ASCENDING), ("character", ASCENDING)], unique=True)
+            self.indexes_ready = True
+
+    def _run(self):
+        while True:
+            user_id, character = self.queue.get()
+            with self.lock:
+                self.pending.discard((user_id, character))
+            try:
+                self.compact(user_id, character)
+            except Exception as e:
+                logging.error(f"Summary error for {character} conversation of {user_id}: {str(e)}")
+            finally:
+                self.queue.task_done()
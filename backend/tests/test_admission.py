@@ -0,0 +1,111 @@
+import threading
+
+import pytest
+from flask import Flask, Response, request
+
+import admission
+from admission import ConcurrencyLimiter, MemoryRateLimiter, admission_control
+
+
+@pytest.fixture
+def limiter(monkeypatch):
+    limiter = ConcurrencyLimiter(max_inflight=4, max_queue=0, slo_ms=1000)
+    monkeypatch.setattr(admission, "concurrency_limiter", limiter)
+    monkeypatch.setattr(admission, "rate_limiter", MemoryRateLimiter(rate_per_minute=6000, burst=100))
+    return limiter
+
+
+def make_app(limiter, release_stream: threading.Event):
+    app = Flask(__name__)
+
+    @app.before_request
+    def fake_auth():
+        request.user = {"uid": "user"}
+
+    @app.route("/plain")
+    @admission_control
+    def plain():
+        return {"inflight": limiter.inflight}
+
+    @app.route("/group")
+    @admission_control(cost=lambda: int(request.args["n"]))
+    def group():
+        return {"inflight": limiter.inflight}
+
+    @app.route("/stream")
+    @admission_control(cost=lambda: 3)
+    def stream():
+        def generate():
+            yield "first\n"
+            release_stream.wait(5)
+            yield "second\n"
+        return Response(generate(), mimetype="application/x-ndjson")
+
+    return app
+
+
+def test_group_requests_take_one_slot_per_character(limiter):
+    client = make_app(limiter, threading.Event()).test_client()
+    assert client.get("/plain").json == {"inflight": 1}
+    assert client.get("/group?n=3").json == {"inflight": 3}
+    assert limiter.inflight == 0
+
+
+def test_streamed_response_holds_slots_until_closed(limiter):
+    release_stream = threading.Event()
+    client = make_app(limiter, release_stream).test_client()
+
+    response = client.get("/stream", buffered=False)
+    chunks = iter(response.response)
+    assert next(chunks) == b"first\n"
+    assert limiter.inflight == 3
+    # Only one slot left: a second group request is shed while the stream is still running
+    assert client.get("/group?n=3").status_code == 503
+
+    release_stream.set()
+    assert b"".join(chunks) == b"second\n"
+    response.close()
+    assert limiter.inflight == 0
+    assert client.get("/group?n=3").status_code == 200
+
+
+def test_full_idle_buckets_are_evicted():
+    limiter = MemoryRateLimiter(rate_per_minute=60000, burst=2, sweep_interval=0)
+    for i in range(100):
+        assert limiter.acquire(f"user{i}")[0]
+    limiter.sweep(limiter.last_sweep + 1)
+    assert limiter.buckets == {}
+
+
+def test_queued_requests_enter_in_arrival_order():
+    limiter = ConcurrencyLimiter(max_inflight=4, max_queue=16, slo_ms=10000)
+    for _ in range(4):
+        assert limiter.enter()[0]
+    order = []
+
+    def enter(name, cost):
+        assert limiter.enter(cost)[0]
+        order.append(name)
+
+    def wait_queued(slots):
+        while limiter.queued != slots:
+            threading.Event().wait(0.01)
+
+    group = threading.Thread(target=enter, args=("group", 3))
+    group.start()
+    wait_queued(3)
+    single = threading.Thread(target=enter, args=("single", 1))
+    single.start()
+    wait_queued(4)
+
+    # One free slot fits the single request, but the group request arrived first
+    limiter.exit(0.1)
+    threading.Event().wait(0.1)
+    assert order == [] and limiter.inflight == 3
+    limiter.exit(0.1)
+    limiter.exit(0.1)
+    group.join(5)
+    assert order == ["group"] and limiter.inflight == 4
+    limiter.exit(0.1)
+    single.join(5)
+    assert order == ["group", "single"]
@@ -0,0 +1,56 @@
+import importlib
+import sys
+
+import pytest
+
+import startup
+
+
+@pytest.fixture
+def app_module(monkeypatch):
+    # Lazy mode keeps the import from building Firebase, Mongo or LangChain clients
+    monkeypatch.setattr(startup, "STARTUP_MODE", "lazy")
+    monkeypatch.delenv("FIREBASE_CREDENTIALS", raising=False)
+    sys.modules.pop("app", None)
+    module = importlib.import_module("app")
+    monkeypatch.setattr(module.warmup, "start", lambda: None)
+    yield module
+    sys.modules.pop("app", None)
+
+
+def test_missing_firebase_credentials_are_a_server_error(app_module):
+    response = app_module.app.test_client().get("/api/stats", headers={"Authorization": "Bearer token"})
+    assert response.status_code == 503
+    assert response.headers["Retry-After"]
+
+
+def test_cold_firebase_in_background_mode_is_not_a_bad_token(app_module, monkeypatch):
+    monkeypatch.setattr(app_module, "STARTUP_MODE", "background")
+    monkeypatch.setattr(app_module.firebase, "factory", lambda: pytest.fail("must not block on a cold client"))
+    response = app_module.app.test_client().get("/api/stats", headers={"Authorization": "Bearer token"})
+    assert response.status_code == 503
+
+
+def test_bad_token_is_still_unauthorized(app_module, monkeypatch):
+    class FakeAuth:
+        def verify_id_token(self, token):
+            raise ValueError("expired")
+
+    monkeypatch.setattr(app_module.firebase, "factory", FakeAuth)
+    response = app_module.app.test_client().get("/api/stats", headers={"Authorization": "Bearer token"})
+    assert response.status_code == 401
+
+
+@pytest.mark.parametrize("characters", [None, "bud", {"bud": True}, ["bud", None], [["bud"]]])
+def test_group_chat_rejects_malformed_characters(app_module, monkeypatch, characters):
+    class FakeAuth:
+        def verify_id_token(self, token):
+            return {"uid": "u"}
+
+    monkeypatch.setattr(app_module.firebase, "factory", FakeAuth)
+    response = app_module.app.test_client().post(
+        "/api/chat/group", headers={"Authorization": "Bearer token"},
+        json={"message": "hi", "characters": characters},
+    )
+    assert response.status_code == 400
+    assert response.get_json() == {"error": "characters must be a list of character names"}
@@ -0,0 +1,93 @@
+from types import SimpleNamespace
+
+import torch
+
+from assisted import NGramDrafter, ngram_assisted_generate
+
+VOCAB = 50
+
+
+def next_token(context):
+    return (sum(context) * 7 + len(context)) % VOCAB
+
+
+class StubModel:
+    """Predicts next_token() of everything it has seen, reading the past from the KV cache.
+
+    Token ids are stored as cache keys, so cache entries of rejected drafts that were not
+    cropped would change every later prediction.
+    """
+
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, input_ids, past_key_values, use_cache=True):
+        self.calls += 1
+        past = past_key_values.get_seq_length()
+        seen = past_key_values.layers[0].keys[0, 0, :, 0].long().tolist() if past else []
+        feed = input_ids[0].tolist()
+        states = torch.tensor(feed, dtype=torch.float32).view(1, 1, -1, 1)
+        past_key_values.update(states, states, 0)
+        logits = torch.full((1, len(feed), VOCAB), -1e4)
+        for i in range(len(feed)):
+            logits[0, i, next_token(seen + feed[:i + 1])] = 1e4
+        return SimpleNamespace(logits=logits)
+
+
+class HalfRightDrafter:
+    """Drafts two correct tokens followed by a wrong one."""
+
+    def draft(self, context, limit=None):
+        context, draft = list(context), []
+        for _ in range(2):
+            draft.append(next_token(context + draft))
+        draft.append((next_token(context + draft) + 1) % VOCAB)
+        return draft[:limit]
+
+
+def greedy(prompt, count):
+    tokens = list(prompt)
+    for _ in range(count):
+        tokens.append(next_token(tokens))
+    return tokens
+
+
+def test_rejected_drafts_are_cropped_from_the_cache():
+    prompt = [3, 1, 4, 1, 5]
+    model = StubModel()
+    output, stats = ngram_assisted_generate(
+        model, torch.tensor([prompt]), HalfRightDrafter(), max_new_tokens=12, do_sample=False
+    )
+
+    assert output[0].tolist() == greedy(prompt, 12)
+    # Every pass keeps two drafts and adds the corrected third token
+    assert stats.new_tokens == 12
+    assert stats.forward_passes == model.calls == 4
+    assert stats.accepted == 8
+    assert stats.drafted == 3 * 3 + 2  # the last draft is cut to the remaining length
+    assert stats.stopped_by == "length"
+
+
+def test_generation_stops_at_an_accepted_eos():
+    prompt = [3, 1, 4, 1, 5]
+    eos = greedy(prompt, 4)[-1]
+    output, stats = ngram_assisted_generate(
+        StubModel(), torch.tensor([prompt]), HalfRightDrafter(), max_new_tokens=12, do_sample=False, eos_token_id=eos
+    )
+    assert output[0].tolist() == greedy(prompt, 4)
+    assert stats.stopped_by == "eos"
+
+
+def test_drafter_prefers_the_longest_latest_match_in_the_context():
+    drafter = NGramDrafter(max_ngram=3, max_draft=4)
+    # "1 2 3" occurs twice; the later occurrence is followed by 7 8
+    assert drafter.draft([1, 2, 3, 4, 5, 1, 2, 3, 7, 8, 9, 2, 3]) == [7, 8, 9, 2]
+    assert drafter.draft([1, 2, 3, 4, 5, 1, 2, 3, 7, 8, 9, 2, 3], limit=2) == [7, 8]
+
+
+def test_drafter_falls_back_to_the_corpus():
+    drafter = NGramDrafter(max_ngram=2, max_draft=3)
+    drafter.add([10, 11, 12, 13, 14])
+    assert drafter.draft([5, 6, 10, 11]) == [12, 13, 14]
+    assert drafter.draft([5, 6, 42]) == []
+    assert drafter.draft([5, 6, 10, 11], limit=0) == []
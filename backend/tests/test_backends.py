@@ -0,0 +1,95 @@
+import pytest
+
+from backends import BACKEND_FAILURE_THRESHOLD, BackendRouter, FakeBackend, GenerationRequest, bud_prompt
+from summarizer import build_context
+
+
+def no_sleep(seconds):
+    pass
+
+
+def request(user_input="hi"):
+    return GenerationRequest("bud", "balanced", "You are balanced.", "", user_input)
+
+
+def make_router(local_failures=(), max_queue=4):
+    local = FakeBackend("local_bud", failures=local_failures, characters=("bud",), sleep=no_sleep)
+    groq = FakeBackend("groq", sleep=no_sleep)
+    router = BackendRouter([local, groq], {"bud": ["local_bud", "groq"]}, spill_factor=2.0, max_queue=max_queue)
+    return router, local, groq
+
+
+def reasons(router):
+    return [(d["backend"], d["reason"], d["count"]) for d in router.metrics()["decisions"]]
+
+
+def test_preferred_backend_serves_by_default():
+    router, local, groq = make_router()
+    assert router.generate(request()) == "local_bud:bud:hi"
+    assert reasons(router) == [("local_bud", "preferred", 1)]
+
+
+def test_spills_when_preferred_queue_is_full():
+    router, local, groq = make_router(max_queue=2)
+    local.inflight = 2
+    assert router.choose("bud")[0] is groq
+    assert reasons(router) == [("groq", "queue_depth", 1)]
+
+
+def test_spills_when_preferred_is_much_slower():
+    router, local, groq = make_router()
+    local.latencies.extend([1.0] * 10)
+    groq.latencies.extend([0.2] * 10)
+    assert router.choose("bud")[0] is groq
+    assert reasons(router) == [("groq", "latency", 1)]
+
+    # Within the spill factor the preference wins
+    groq.latencies.extend([0.6] * 100)
+    assert router.choose("bud")[0] is local
+
+
+def test_failure_falls_back_to_next_backend():
+    router, local, groq = make_router(local_failures=(1,))
+    assert router.generate(request()) == "groq:bud:hi"
+    assert ("groq", "fallback", 1) in reasons(router)
+    assert local.healthy
+
+
+def test_circuit_breaker_routes_around_failing_backend():
+    router, local, groq = make_router(local_failures=range(1, BACKEND_FAILURE_THRESHOLD + 1))
+    for _ in range(BACKEND_FAILURE_THRESHOLD):
+        assert router.generate(request()).startswith("groq:")
+    assert not local.healthy
+    assert local.status()["healthy"] is False
+
+    calls = local.calls
+    assert router.generate(request()) == "groq:bud:hi"
+    assert local.calls == calls
+    assert ("groq", "unhealthy", 1) in reasons(router)
+
+
+def test_all_backends_failing_raises_last_error():
+    local = FakeBackend("local_bud", failures=[1], characters=("bud",), sleep=no_sleep)
+    groq = FakeBackend("groq", failures=[1], sleep=no_sleep)
+    router = BackendRouter([local, groq], {"bud": ["local_bud", "groq"]})
+    with pytest.raises(RuntimeError, match="groq failed"):
+        router.generate(request())
+
+
+def test_character_without_backend_is_rejected():
+    router = BackendRouter([FakeBackend("local_bud", characters=("bud",))], {})
+    with pytest.raises(ValueError):
+        router.choose("luffy")
+
+
+def test_bud_prompt_uses_fine_tuning_turn_markers():
+    context = build_context("Stressed about exams.", [
+        {"content": "hi\nthere", "response": "hey!", "character": "bud"},
+    ])
+    prompt = bud_prompt(GenerationRequest("bud", "balanced", "You are balanced.", context, "help"))
+    assert prompt == (
+        "Personality Context: You are balanced.\n"
+        "<|system|> Summary of earlier conversation: Stressed about exams.\n"
+        "<|user|>\nhi\nthere\n<|assistant|>\nhey!\n"
+        "<|user|>\nhelp\n<|assistant|>"
+    )
@@ -0,0 +1,131 @@
+import os
+from datetime import datetime
+
+from bson.errors import InvalidDocument
+from pymongo.errors import AutoReconnect, BulkWriteError
+
+from chat_writer import ChatWriter
+
+
+class FlakyCollection:
+    def __init__(self):
+        self.docs = {}
+        self.down = False
+
+    def insert_many(self, docs, ordered=True):
+        if self.down:
+            raise AutoReconnect("mongo is down")
+        errors = []
+        for i, doc in enumerate(docs):
+            if doc["_id"] in self.docs:
+                errors.append({"index": i, "code": 11000, "errmsg": "duplicate key"})
+            else:
+                self.docs[doc["_id"]] = doc
+        if errors:
+            raise BulkWriteError({"writeErrors": errors, "nInserted": len(docs) - len(errors)})
+
+
+def chat(i):
+    return {"user_id": "u", "character": "bud", "content": f"m{i}", "response": "r", "timestamp": datetime(2026, 1, 1)}
+
+
+def make_writer(tmp_path, collection):
+    writer = ChatWriter(collection, batch_size=100, flush_interval=60, spill_path=str(tmp_path / "spill.jsonl"))
+    notified = []
+    writer.add_flush_listener(notified.extend)
+    return writer, notified
+
+
+def test_spilled_batch_is_replayed_and_notified_once(tmp_path):
+    collection = FlakyCollection()
+    writer, notified = make_writer(tmp_path, collection)
+
+    collection.down = True
+    writer.submit_many([chat(i) for i in range(3)])
+    writer.flush()
+    assert os.path.exists(writer.spill_path)
+    assert notified == []
+
+    collection.down = False
+    writer.submit(chat(3))
+    writer.flush()
+    writer.close()
+
+    assert len(collection.docs) == 4
+    assert len(notified) == 4
+    assert writer._spill_files() == []
+
+
+def test_duplicates_are_not_notified(tmp_path):
+    collection = FlakyCollection()
+    writer, notified = make_writer(tmp_path, collection)
+    docs = writer.submit_many([chat(i) for i in range(2)])
+    writer.flush()
+    # The same documents re-sent, e.g. from a spill file whose insert had in fact landed
+    writer.submit_many(docs + [chat(2)])
+    writer.flush()
+    writer.close()
+
+    assert len(notified) == 3
+
+
+def test_spill_files_of_other_processes_are_replayed(tmp_path):
+    collection = FlakyCollection()
+    writer, notified = make_writer(tmp_path, collection)
+    # A worker that died with documents still spilled
+    orphan = ChatWriter(collection, spill_path=str(tmp_path / "spill.jsonl"))
+    orphan_docs = [dict(chat(i), _id=i) for i in range(2)]
+    orphan._spill(orphan_docs)
+    os.rename(orphan.spill_path, str(tmp_path / "spill.jsonl.99999"))
+
+    writer.submit(chat(9))
+    writer.flush()
+    writer.close()
+
+    assert len(collection.docs) == 3
+    assert not os.path.exists(tmp_path / "spill.jsonl.99999")
+
+
+def test_timestamps_are_truncated_to_milliseconds(tmp_path):
+    writer, _ = make_writer(tmp_path, FlakyCollection())
+    doc = writer.submit(dict(chat(0), timestamp=datetime(2026, 1, 1, 12, 0, 0, 123456)))
+    writer.close()
+
+    assert doc["timestamp"] == datetime(2026, 1, 1, 12, 0, 0, 123000)
+
+
+class PickyCollection(FlakyCollection):
+    def insert_many(self, docs, ordered=True):
+        if any(doc["content"] == "bad" for doc in docs):
+            raise InvalidDocument("cannot encode object")
+        return super().insert_many(docs, ordered)
+
+
+def test_unstorable_document_is_set_aside_alone(tmp_path):
+    collection = PickyCollection()
+    writer, notified = make_writer(tmp_path, collection)
+    writer.submit_many([chat(0), dict(chat(1), content="bad"), chat(2)])
+    writer.flush()
+    writer.close()
+
+    assert sorted(doc["content"] for doc in collection.docs.values()) == ["m0", "m2"]
+    assert len(notified) == 2
+    assert writer._spill_files() == []
+    with open(writer.rejected_path, encoding="utf-8") as file:
+        assert '"bad"' in file.read()
+
+
+def test_buffer_spills_while_a_flush_is_stuck(tmp_path):
+    collection = FlakyCollection()
+    writer = ChatWriter(collection, batch_size=2, flush_interval=60, spill_path=str(tmp_path / "spill.jsonl"),
+                        max_buffer=4)
+    with writer.flush_lock:
+        # Holding the flush lock stands in for a flush hanging in server selection
+        writer.submit_many([chat(i) for i in range(5)])
+        assert writer.buffer == []
+        assert os.path.exists(writer.spill_path)
+
+    writer.submit(chat(5))
+    writer.close()
+    assert len(collection.docs) == 6
+    assert writer._spill_files() == []
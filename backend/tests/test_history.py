@@ -0,0 +1,26 @@
+from datetime import datetime
+
+from history import decode_cursor, encode_cursor, keyset_query
+
+
+def test_cursor_from_buffered_doc_excludes_the_stored_copy(tmp_path):
+    from chat_writer import ChatWriter
+
+    writer = ChatWriter(collection=None, flush_interval=60, spill_path=str(tmp_path / "spill.jsonl"))
+    doc = writer.submit_many([{
+        "user_id": "u", "character": "bud", "content": "hi", "response": "hey",
+        "timestamp": datetime(2026, 1, 1, 12, 0, 0, 123456),
+    }])[0]
+    # What Mongo hands back for the same turn once it is flushed
+    stored_timestamp = datetime(2026, 1, 1, 12, 0, 0, 123000)
+
+    cursor = encode_cursor(doc)
+    timestamp, doc_id = decode_cursor(cursor)
+    query = keyset_query("u", "bud", cursor)
+
+    assert timestamp == stored_timestamp
+    assert doc_id == doc["_id"]
+    # The stored copy is neither strictly older nor an older _id at the same time, so it is not repeated
+    older, same_time = query["$or"]
+    assert not stored_timestamp < older["timestamp"]["$lt"]
+    assert same_time["timestamp"] == stored_timestamp and not doc["_id"] < same_time["_id"]["$lt"]
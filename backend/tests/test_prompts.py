@@ -0,0 +1,79 @@
+import sys
+
+import prompts
+
+
+def test_count_tokens_falls_back_when_tiktoken_cannot_load(monkeypatch):
+    class BrokenTiktoken:
+        @staticmethod
+        def get_encoding(name):
+            raise OSError("no network to download the BPE file")
+
+    monkeypatch.setitem(sys.modules, "tiktoken", BrokenTiktoken)
+    prompts._get_encoding.cache_clear()
+    try:
+        assert prompts.count_tokens("I can't sleep, again.") == 8
+        assert prompts.count_tokens("") == 0
+    finally:
+        prompts._get_encoding.cache_clear()
+
+
+def fallback_counts(monkeypatch):
+    # Word-and-punctuation counts keep the budgets below independent of the BPE file
+    monkeypatch.setattr(prompts, "_get_encoding", lambda: None)
+
+
+CONTEXT = (
+    "Summary of earlier conversation: Stressed about exams.\n"
+    "User: first line\nsecond line\n"
+    "bud: reply one\n"
+    "User: hello again\n"
+    "bud: reply two\nstill replying"
+)
+
+
+def test_render_without_budget_keeps_the_context(monkeypatch):
+    fallback_counts(monkeypatch)
+    compiled = prompts.compile_prompt("bud", "calm")
+    rendered = compiled.render(CONTEXT, "hi", budget=0)
+    assert rendered.context == CONTEXT
+    assert rendered.trimmed_blocks == 0 and not rendered.over_budget
+    summary, turns = prompts.split_context(CONTEXT)
+    assert summary == ["Summary of earlier conversation: Stressed about exams."]
+    assert turns == ["User: first line\nsecond line\nbud: reply one", "User: hello again\nbud: reply two\nstill replying"]
+    assert rendered.total_tokens == compiled.render("", "hi", budget=0).total_tokens + sum(
+        prompts.count_tokens(block) + 1 for block in summary + turns
+    )
+
+
+def test_trimming_drops_whole_turns_before_the_summary(monkeypatch):
+    fallback_counts(monkeypatch)
+    compiled = prompts.compile_prompt("bud", "calm")
+    full = compiled.render(CONTEXT, "hi", budget=0).total_tokens
+
+    # Just short of the full prompt: the oldest turn goes with all of its lines
+    rendered = compiled.render(CONTEXT, "hi", budget=full - 1)
+    assert rendered.context == (
+        "Summary of earlier conversation: Stressed about exams.\n"
+        "User: hello again\n"
+        "bud: reply two\nstill replying"
+    )
+    assert rendered.trimmed_blocks == 1 and rendered.over_budget
+    assert rendered.total_tokens <= full - 1
+
+    # Room for the summary only
+    summary_only = compiled.render("Summary of earlier conversation: Stressed about exams.", "hi", budget=0)
+    rendered = compiled.render(CONTEXT, "hi", budget=summary_only.total_tokens)
+    assert rendered.context == "Summary of earlier conversation: Stressed about exams."
+    assert rendered.trimmed_blocks == 2
+
+    # Not even that: the summary goes last
+    rendered = compiled.render(CONTEXT, "hi", budget=summary_only.total_tokens - 1)
+    assert rendered.context == "" and rendered.trimmed_blocks == 3
+
+
+def test_warn_mode_only_reports(monkeypatch):
+    fallback_counts(monkeypatch)
+    monkeypatch.setattr(prompts, "PROMPT_BUDGET_MODE", "warn")
+    rendered = prompts.compile_prompt("bud", "calm").render(CONTEXT, "hi", budget=10)
+    assert rendered.context == CONTEXT and rendered.over_budget and rendered.trimmed_blocks == 0
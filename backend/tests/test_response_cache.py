@@ -0,0 +1,69 @@
+import pytest
+
+from response_cache import ResponseCache, is_sensitive
+
+
+@pytest.fixture
+def cache():
+    return ResponseCache(max_context_tokens=0, variants=2, min_variants=1)
+
+
+def test_paraphrase_hits(cache):
+    cache.put("bud", "balanced", "I'm so stressed about exams", "Exams are tough.")
+    assert cache.get("bud", "balanced", "im stressed about my exams") == "Exams are tough."
+
+
+@pytest.mark.parametrize("positive, negative", [
+    ("i want to keep living", "i dont want to keep living"),
+    ("I feel safe at home", "I dont feel safe at home"),
+    ("I feel like a failure", "I dont feel like a failure"),
+    ("I'm happy with my grades", "I'm not happy with my grades"),
+    ("I can sleep fine", "I can't sleep"),
+])
+def test_negated_message_misses(cache, positive, negative):
+    cache.put("bud", "balanced", positive, "reply to positive")
+    assert cache.get("bud", "balanced", negative) is None
+    cache.put("bud", "balanced", negative, "reply to negative")
+    assert cache.get("bud", "balanced", positive) in (None, "reply to positive")
+
+
+@pytest.mark.parametrize("message", [
+    "I want to kill myself",
+    "i dont want to keep living",
+    "I dont feel safe at home",
+    "thinking about suicide",
+    "my partner hits me",
+])
+def test_risk_messages_are_never_cached(cache, message):
+    assert is_sensitive(message)
+    cache.put("bud", "balanced", message, "canned")
+    assert cache.get("bud", "balanced", message) is None
+    assert cache.metrics()["entries"] == 0
+
+
+def test_context_too_long_is_skipped(cache):
+    context = "User: hi\nbud: hello"
+    cache.put("bud", "balanced", "I had a great day", "Nice!", context=context)
+    assert cache.get("bud", "balanced", "I had a great day", context=context) is None
+    assert cache.get("bud", "balanced", "I had a great day") is None
+    assert cache.metrics()["skipped"] == 1
+
+
+def test_variants_rotate():
+    cache = ResponseCache(max_context_tokens=0, variants=2, min_variants=2)
+    cache.put("luffy", "extrovert", "I had a great day", "first")
+    assert cache.get("luffy", "extrovert", "I had a great day") is None
+    cache.put("luffy", "extrovert", "had a great day!", "second")
+    replies = [cache.get("luffy", "extrovert", "i had a great day") for _ in range(4)]
+    assert replies == ["first", "second", "first", "second"]
+
+
+def test_memory_cap_evicts_least_recently_used():
+    cache = ResponseCache(max_context_tokens=0, max_bytes=10000, min_variants=1)
+    cache.put("bud", "balanced", "I had a great day", "a")
+    cache.put("bud", "balanced", "my friend is ignoring me", "b")
+    cache.get("bud", "balanced", "I had a great day")
+    cache.put("bud", "balanced", "exams are stressing me out", "c")
+    assert cache.get("bud", "balanced", "my friend is ignoring me") is None
+    assert cache.get("bud", "balanced", "I had a great day") == "a"
+    assert cache.metrics()["evictions"] == 1
@@ -0,0 +1,134 @@
+import os
+import gzip
+from datetime import date, datetime, timedelta
+
+import pytest
+from bson import ObjectId
+
+from retention import RetentionJob, archive_day_dir, ensure_retention_index, iter_archive, read_archive_day, restore_archive, write_archive
+
+NOW = datetime(2026, 10, 19, 12)
+
+
+class FakeCursor(list):
+    def sort(self, key, direction):
+        return FakeCursor(sorted(self, key=lambda doc: doc[key]))
+
+    def batch_size(self, size):
+        return self
+
+
+class FakeInsertResult:
+    def __init__(self, ids):
+        self.inserted_ids = ids
+
+
+class FakeCollection:
+    def __init__(self, docs=()):
+        self.docs = {doc["_id"]: doc for doc in docs}
+
+    def find(self, query, projection=None):
+        if "$or" in query:
+            return [
+                doc for doc in self.docs.values()
+                if any(all(doc.get(k) == v for k, v in clause.items()) for clause in query["$or"])
+            ]
+        return FakeCursor(doc for doc in self.docs.values() if doc["timestamp"] < query["timestamp"]["$lt"])
+
+    def delete_many(self, query):
+        for doc_id in query["_id"]["$in"]:
+            self.docs.pop(doc_id, None)
+
+    def insert_many(self, docs, ordered=True):
+        for doc in docs:
+            self.docs[doc["_id"]] = doc
+        return FakeInsertResult([doc["_id"] for doc in docs])
+
+
+def chats(user_id, ages_in_days):
+    return [
+        {"_id": ObjectId(), "user_id": user_id, "character": "bud", "content": "hi", "response": "hey",
+         "timestamp": NOW - timedelta(days=age)}
+        for age in ages_in_days
+    ]
+
+
+def test_archives_only_old_summarized_turns(tmp_path):
+    chat_collection = FakeCollection(chats("a", range(0, 200, 10)) + chats("b", range(0, 200, 10)))
+    summaries = FakeCollection([{"_id": 1, "user_id": "a", "character": "bud", "summarized_until": NOW - timedelta(days=1)}])
+    job = RetentionJob(chat_collection, summaries, archive_dir=str(tmp_path), hot_days=90, batch_size=3)
+
+    result = job.run_once(NOW)
+
+    # user a: turns 100..190 days old move; user b has no summary, so nothing of theirs moves
+    assert result == {"archived": 10, "kept": 10, "skipped": False}
+    assert len(chat_collection.docs) == 30
+    archived = list(iter_archive(str(tmp_path), date(2026, 1, 1), date(2026, 12, 31)))
+    assert {doc["user_id"] for doc in archived} == {"a"}
+    assert len(archived) == 10
+
+    restored = restore_archive(chat_collection, str(tmp_path), date(2026, 1, 1), date(2026, 12, 31), user_id="a")
+    assert restored == 10
+    assert len(chat_collection.docs) == 40
+
+
+def test_damaged_file_does_not_hide_later_batches(tmp_path):
+    day = date(2026, 1, 1)
+    first = chats("a", [1])
+    second = chats("a", [2])
+    write_archive(str(tmp_path), day, first, "run-00001")
+    write_archive(str(tmp_path), day, second, "run-00002")
+    # Truncate the first file mid-stream, and leave a half-written temp file behind
+    first_path = os.path.join(archive_day_dir(str(tmp_path), day), "run-00001.ndjson.gz")
+    with open(first_path, "rb") as file:
+        data = file.read()
+    with open(first_path, "wb") as file:
+        file.write(data[:len(data) // 2])
+    with open(first_path.replace("00001", "00003") + ".tmp", "wb") as file:
+        file.write(gzip.compress(b"{}")[:5])
+
+    docs = list(read_archive_day(str(tmp_path), day))
+
+    assert [doc["_id"] for doc in docs] == [second[0]["_id"]]
+
+
+def test_duplicate_batches_are_read_once(tmp_path):
+    day = date(2026, 1, 1)
+    docs = chats("a", [1, 1])
+    write_archive(str(tmp_path), day, docs, "run1-00001")
+    write_archive(str(tmp_path), day, docs, "run2-00001")
+
+    assert len(list(read_archive_day(str(tmp_path), day))) == 2
+
+
+@pytest.mark.parametrize("archive_dir", ["", "archive/chats", "/nonexistent/archive"])
+def test_archive_needs_an_existing_absolute_directory(archive_dir):
+    chat_collection = FakeCollection(chats("a", [200]))
+    summaries = FakeCollection([{"_id": 1, "user_id": "a", "character": "bud", "summarized_until": NOW}])
+    job = RetentionJob(chat_collection, summaries, archive_dir=archive_dir, hot_days=90)
+
+    with pytest.raises(ValueError):
+        job.run_once(NOW)
+    assert len(chat_collection.docs) == 1
+
+
+class IndexedCollection:
+    def __init__(self, indexes):
+        self.indexes = set(indexes)
+
+    def index_information(self):
+        return {name: {} for name in self.indexes}
+
+    def drop_index(self, name):
+        self.indexes.remove(name)
+
+    def create_index(self, keys, name, **kwargs):
+        self.indexes.add(name)
+
+
+def test_old_ttl_index_is_dropped():
+    collection = IndexedCollection(["_id_", "timestamp_ttl"])
+    ensure_retention_index(collection, mode="ttl")
+    assert collection.indexes == {"_id_"}
+    ensure_retention_index(collection, mode="archive")
+    assert collection.indexes == {"_id_", "timestamp"}
@@ -0,0 +1,47 @@
+import time
+
+from startup import Lazy, Warmup
+
+
+def test_warmup_retries_components_that_failed():
+    attempts = []
+
+    def flaky():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise ConnectionError("mongo unreachable")
+        return "client"
+
+    component = Lazy("mongo", flaky)
+    warmup = Warmup([component], retry_interval=0)
+
+    warmup.start()
+    warmup.thread.join()
+    assert not warmup.is_ready()
+    assert component.status()["error"] == "mongo unreachable"
+
+    warmup.start()
+    warmup.thread.join()
+    assert warmup.is_ready()
+    assert len(attempts) == 2
+
+
+def test_warmup_waits_between_retries():
+    component = Lazy("mongo", lambda: 1 / 0)
+    warmup = Warmup([component], retry_interval=60)
+    warmup.start()
+    first = warmup.thread
+    first.join()
+    warmup.start()
+    assert warmup.thread is first
+
+
+def test_ready_components_are_not_rebuilt():
+    builds = []
+    component = Lazy("langchain", lambda: builds.append(1))
+    warmup = Warmup([component], retry_interval=0)
+    warmup.start()
+    warmup.thread.join()
+    warmup.start()
+    time.sleep(0.01)
+    assert len(builds) == 1
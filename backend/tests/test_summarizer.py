@@ -0,0 +1,128 @@
+from datetime import datetime, timedelta
+
+import summarizer
+from summarizer import ConversationSummarizer, build_context, parse_context
+
+START = datetime(2026, 1, 1)
+OPERATORS = {
+    "$gt": lambda value, bound: value > bound,
+    "$lt": lambda value, bound: value < bound,
+    "$lte": lambda value, bound: value <= bound,
+    "$in": lambda value, bound: value in bound,
+}
+
+
+def matches(doc, query):
+    for key, condition in query.items():
+        if isinstance(condition, dict):
+            if not all(OPERATORS[op](doc.get(key), bound) for op, bound in condition.items()):
+                return False
+        elif doc.get(key) != condition:
+            return False
+    return True
+
+
+class FakeCursor(list):
+    def sort(self, key, direction):
+        return FakeCursor(sorted(self, key=lambda doc: doc[key], reverse=direction < 0))
+
+    def skip(self, count):
+        return FakeCursor(self[count:])
+
+    def limit(self, count):
+        return FakeCursor(self[:count])
+
+
+class FakeCollection:
+    def __init__(self, docs=()):
+        self.docs = list(docs)
+
+    def find(self, query, projection=None):
+        return FakeCursor(dict(doc) for doc in self.docs if matches(doc, query))
+
+    def find_one(self, query):
+        return next(iter(self.find(query)), None)
+
+    def update_one(self, query, update, upsert=False):
+        doc = next((doc for doc in self.docs if matches(doc, query)), None)
+        if doc is None:
+            doc = dict(query)
+            self.docs.append(doc)
+        doc.update(update.get("$set", {}))
+        for key, amount in update.get("$inc", {}).items():
+            doc[key] = doc.get(key, 0) + amount
+
+    def create_index(self, keys, **kwargs):
+        pass
+
+
+class RecordingSummarizer:
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, summary, turns):
+        self.calls.append((summary, [turn["content"] for turn in turns]))
+        return f"rewrite {len(self.calls)}"
+
+
+def conversation(count):
+    return [
+        {"_id": i, "user_id": "u", "character": "bud", "content": f"message {i}", "response": f"reply {i}",
+         "timestamp": START + timedelta(minutes=i)}
+        for i in range(count)
+    ]
+
+
+def make_summarizer(chats, **kwargs):
+    llm = RecordingSummarizer()
+    conversations = ConversationSummarizer(FakeCollection(chats), FakeCollection(), summarize_fn=llm, **kwargs)
+    conversations.requeued = []
+    conversations.enqueue = lambda user_id, character: conversations.requeued.append((user_id, character))
+    return conversations, llm
+
+
+def test_every_flush_folds_extractively_and_llm_rewrites_in_batches():
+    chats = conversation(12)
+    conversations, llm = make_summarizer([], raw_turns=2, rewrite_turns=4)
+    for turn in chats:
+        conversations.chat_collection.docs.append(turn)
+        conversations.compact("u", "bud")
+        summary, turns = parse_context(conversations.get_context("u", "bud"), "bud")
+        # The prompt never carries more than the raw window next to the summary
+        assert [t["content"] for t in turns] == [c["content"] for c in chats[max(0, turn["_id"] - 1):turn["_id"] + 1]]
+
+    # 10 turns left the raw window: two LLM rewrites of four turns each, the rest extractive
+    assert llm.calls == [
+        ("", ["message 0", "message 1", "message 2", "message 3"]),
+        ("rewrite 1", ["message 4", "message 5", "message 6", "message 7"]),
+    ]
+    doc = conversations.summary_collection.find_one({"user_id": "u", "character": "bud"})
+    assert doc["summary"] == "rewrite 2 User said: message 8. User said: message 9."
+    assert doc["unrewritten_turns"] == 2 and doc["turns_summarized"] == 10
+
+
+def test_first_compaction_only_backfills_recent_history(monkeypatch):
+    monkeypatch.setattr(summarizer, "SUMMARY_BATCH_TURNS", 4)
+    conversations, llm = make_summarizer(conversation(1000), raw_turns=2, rewrite_turns=4, backfill_turns=6)
+
+    folded = conversations.compact("u", "bud")
+    assert folded == 4 and conversations.requeued == [("u", "bud")]
+    assert conversations.compact("u", "bud") == 2
+    assert conversations.compact("u", "bud") == 0
+
+    # Only the 6 turns before the raw window were summarized, with one LLM call per batch
+    assert [turns for _, turns in llm.calls] == [[f"message {i}" for i in range(992, 996)]]
+    doc = conversations.summary_collection.find_one({"user_id": "u", "character": "bud"})
+    assert doc["turns_summarized"] == 6
+    assert doc["summarized_until"] == START + timedelta(minutes=997)
+
+
+def test_summary_from_before_extractive_folding_is_kept():
+    chats = conversation(10)
+    conversations, llm = make_summarizer(chats, raw_turns=2, rewrite_turns=2)
+    conversations.summary_collection.docs.append({
+        "user_id": "u", "character": "bud", "summary": "old llm summary", "summarized_until": chats[5]["timestamp"],
+    })
+    assert conversations.compact("u", "bud") == 2
+    assert llm.calls == [("old llm summary", ["message 6", "message 7"])]
+    assert build_context("rewrite 1", chats[8:]) == conversations.get_context("u", "bud")
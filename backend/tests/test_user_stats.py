@@ -0,0 +1,73 @@
+from datetime import datetime
+
+from pymongo.errors import AutoReconnect, BulkWriteError
+
+from user_stats import UserStats
+
+
+class FakeStatsCollection:
+    """Applies $inc and the applied_batches guard of the UpdateOne requests it gets."""
+
+    def __init__(self):
+        self.docs = {}
+        self.failures = []  # exceptions raised by the next bulk_write calls, after applying
+
+    def bulk_write(self, updates, ordered=True):
+        errors = []
+        for i, update in enumerate(updates):
+            query, change = update._filter, update._doc
+            doc = self.docs.get(query["user_id"])
+            guard = query.get("applied_batches", {}).get("$ne")
+            if doc is not None and guard is not None and guard in doc.get("applied_batches", []):
+                errors.append({"index": i, "code": 11000, "errmsg": "duplicate key"})
+                continue
+            doc = self.docs.setdefault(query["user_id"], {"user_id": query["user_id"]})
+            for key, amount in change["$inc"].items():
+                doc[key] = doc.get(key, 0) + amount
+            doc.setdefault("applied_batches", []).extend(change.get("$push", {}).get("applied_batches", {}).get("$each", []))
+        if self.failures:
+            raise self.failures.pop(0)
+        if errors:
+            raise BulkWriteError({"writeErrors": errors})
+
+
+def mongo_down(updates, ordered=True):
+    raise AutoReconnect("mongo is down")
+
+
+def chats(user_id, count):
+    return [{"user_id": user_id, "character": "bud", "timestamp": datetime(2026, 1, 1, 12)} for _ in range(count)]
+
+
+def test_write_that_landed_before_failing_is_not_counted_twice():
+    collection = FakeStatsCollection()
+    stats = UserStats(collection, retry_delay=0)
+    # The server applied the batch but the reply was lost
+    collection.failures = [AutoReconnect("connection reset")]
+    stats.record(chats("a", 3))
+
+    assert collection.docs["a"]["total_messages"] == 3
+    assert stats.pending == []
+
+
+def test_failed_batches_are_parked_and_sent_with_the_next_one():
+    collection = FakeStatsCollection()
+    stats = UserStats(collection, attempts=2, retry_delay=0)
+    real_write, collection.bulk_write = collection.bulk_write, mongo_down
+    stats.record(chats("a", 2))
+    assert len(stats.pending) == 1 and collection.docs == {}
+
+    collection.bulk_write = real_write
+    stats.record(chats("a", 1) + chats("b", 1))
+    assert collection.docs["a"]["total_messages"] == 3
+    assert collection.docs["b"]["total_messages"] == 1
+    assert stats.pending == []
+
+
+def test_pending_batches_are_bounded():
+    collection = FakeStatsCollection()
+    stats = UserStats(collection, attempts=1, max_pending=2, retry_delay=0)
+    collection.bulk_write = mongo_down
+    for _ in range(5):
+        stats.record(chats("a", 1))
+    assert len(stats.pending) == 2
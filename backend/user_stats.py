@@ -0,0 +1,260 @@
+import os
+import time
+import logging
+import threading
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import TYPE_CHECKING, Dict, Iterable, List, Optional
+
+from history import ASCENDING
+
+if TYPE_CHECKING:
+    from pymongo import UpdateOne
+
+# Days of daily buckets returned by /api/stats
+STATS_TREND_DAYS = int(os.getenv("STATS_TREND_DAYS", "30"))
+STATS_WRITE_BATCH_SIZE = 500
+# Attempts per flushed batch before it is parked and retried with the next batch
+STATS_WRITE_ATTEMPTS = int(os.getenv("STATS_WRITE_ATTEMPTS", "3"))
+# Parked batches kept in memory; each user document remembers this many applied batch ids
+STATS_MAX_PENDING_BATCHES = int(os.getenv("STATS_MAX_PENDING_BATCHES", "100"))
+
+DUPLICATE_KEY = 11000
+
+
+def ensure_stats_index(collection):
+    collection.create_index([("user_id", ASCENDING)], name="user_id", unique=True)
+
+
+class StatsDelta:
+    """Counters contributed by a set of chat documents of one user.
+
+    The same delta either becomes an ``$inc``/``$min``/``$max`` update for the live path
+    or a whole document for the backfill, so both produce identical stats.
+    """
+
+    def __init__(self, user_id: str):
+        self.user_id = user_id
+        self.counts: Dict[str, float] = defaultdict(float)
+        self.first_active: Optional[datetime] = None
+        self.last_active: Optional[datetime] = None
+        self.character_last_active: Dict[str, datetime] = {}
+        self.joy_min: Optional[float] = None
+        self.joy_max: Optional[float] = None
+
+    def add(self, doc: Dict):
+        timestamp = doc["timestamp"]
+        character = doc["character"]
+        day = timestamp.strftime("%Y-%m-%d")
+        self.counts["total_messages"] += 1
+        self.counts[f"characters.{character}.messages"] += 1
+        self.counts[f"days.{day}.messages"] += 1
+        self.counts[f"hours.{timestamp.hour:02d}"] += 1
+
+        joy_score = doc.get("joy_score")
+        if joy_score is not None:
+            joy_score = float(joy_score)
+            for prefix in ("joy", f"days.{day}.joy"):
+                self.counts[f"{prefix}.count"] += 1
+                self.counts[f"{prefix}.sum"] += joy_score
+            self.counts["joy.sum_sq"] += joy_score * joy_score
+            self.joy_min = joy_score if self.joy_min is None else min(self.joy_min, joy_score)
+            self.joy_max = joy_score if self.joy_max is None else max(self.joy_max, joy_score)
+
+        self.first_active = timestamp if self.first_active is None else min(self.first_active, timestamp)
+        self.last_active = timestamp if self.last_active is None else max(self.last_active, timestamp)
+        previous = self.character_last_active.get(character)
+        self.character_last_active[character] = timestamp if previous is None else max(previous, timestamp)
+
+    def to_update(self, batch_id=None) -> "UpdateOne":
+        from pymongo import UpdateOne
+
+        # $max/$min keep last_active correct when batches from different workers land out of order
+        maximums = {"last_active": self.last_active, "updated_at": datetime.utcnow()}
+        maximums.update({f"characters.{c}.last_active": t for c, t in self.character_last_active.items()})
+        minimums = {"first_active": self.first_active}
+        if self.joy_min is not None:
+            minimums["joy.min"] = self.joy_min
+            maximums["joy.max"] = self.joy_max
+        update = {"$inc": dict(self.counts), "$max": maximums, "$min": minimums}
+        query = {"user_id": self.user_id}
+        if batch_id is not None:
+            # A retried batch that had landed matches nothing, and its upsert then fails on the
+            # unique user_id index instead of counting the batch twice
+            query["applied_batches"] = {"$ne": batch_id}
+            update["$push"] = {"applied_batches": {"$each": [batch_id], "$slice": -STATS_MAX_PENDING_BATCHES}}
+        return UpdateOne(query, update, upsert=True)
+
+    def to_document(self) -> Dict:
+        doc: Dict = {
+            "user_id": self.user_id,
+            "first_active": self.first_active,
+            "last_active": self.last_active,
+            "updated_at": datetime.utcnow(),
+        }
+        for path, value in self.counts.items():
+            _set_path(doc, path, value)
+        for character, timestamp in self.character_last_active.items():
+            _set_path(doc, f"characters.{character}.last_active", timestamp)
+        if self.joy_min is not None:
+            _set_path(doc, "joy.min", self.joy_min)
+            _set_path(doc, "joy.max", self.joy_max)
+        return doc
+
+
+def _set_path(doc: Dict, path: str, value):
+    *parents, leaf = path.split(".")
+    for key in parents:
+        doc = doc.setdefault(key, {})
+    doc[leaf] = value
+
+
+def stats_updates(docs: Iterable[Dict], batch_id=None) -> List["UpdateOne"]:
+    deltas: Dict[str, StatsDelta] = {}
+    for doc in docs:
+        deltas.setdefault(doc["user_id"], StatsDelta(doc["user_id"])).add(doc)
+    return [delta.to_update(batch_id) for delta in deltas.values()]
+
+
+class UserStats:
+    """Keeps one ``user_stats`` document per user in step with the chats collection.
+
+    ``record`` is registered as a ChatWriter flush listener, so every flushed batch costs
+    one unordered ``bulk_write`` with a single upsert per user in it. Each batch carries
+    an id that the user documents remember, which makes retrying it safe: a write that
+    fails is retried, then parked and sent again ahead of the next batch, and an update
+    that had in fact landed is not counted twice.
+    """
+
+    def __init__(self, collection, attempts: int = STATS_WRITE_ATTEMPTS,
+                 max_pending: int = STATS_MAX_PENDING_BATCHES, retry_delay: float = 0.5):
+        self.collection = collection
+        self.attempts = max(1, attempts)
+        self.max_pending = max_pending
+        self.retry_delay = retry_delay
+        self.pending: List = []  # (batch_id, docs) of batches not written yet, oldest first
+        self.lock = threading.Lock()
+
+    def record(self, docs: List[Dict]):
+        from bson import ObjectId
+
+        with self.lock:
+            batches, self.pending = self.pending + [(ObjectId(), docs)], []
+            for i, (batch_id, batch_docs) in enumerate(batches):
+                try:
+                    self._write(batch_id, batch_docs)
+                except Exception as e:
+                    self.pending = batches[i:]
+                    dropped = len(self.pending) - self.max_pending
+                    if dropped > 0:
+                        logging.error(f"Dropping {dropped} unwritten stats batches, stats will undercount")
+                        self.pending = self.pending[dropped:]
+                    logging.error(f"Stats write failed, {len(self.pending)} batches pending: {str(e)}")
+                    return
+
+    def _write(self, batch_id, docs: List[Dict]):
+        from pymongo.errors import BulkWriteError, PyMongoError
+
+        updates = stats_updates(docs, batch_id)
+        if not updates:
+            return
+        for attempt in range(self.attempts):
+            try:
+                self.collection.bulk_write(updates, ordered=False)
+                return
+            except BulkWriteError as e:
+                # Duplicate keys are users that already have this batch; retry only the rest
+                failed = {err["index"] for err in e.details.get("writeErrors", []) if err.get("code") != DUPLICATE_KEY}
+                updates = [update for i, update in enumerate(updates) if i in failed]
+                if not updates:
+                    return
+                if attempt == self.attempts - 1:
+                    raise
+            except PyMongoError:
+                if attempt == self.attempts - 1:
+                    raise
+            time.sleep(self.retry_delay * (attempt + 1))
+
+    def get(self, user_id: str, days: int = STATS_TREND_DAYS) -> Optional[Dict]:
+        doc = self.collection.find_one({"user_id": user_id}, {"_id": 0})
+        return serialize_stats(doc, days) if doc else None
+
+
+def _mean(total: float, count: float) -> Optional[float]:
+    return round(total / count, 4) if count else None
+
+
+def serialize_stats(doc: Dict, days: int = STATS_TREND_DAYS) -> Dict:
+    joy = doc.get("joy", {})
+    joy_count = joy.get("count", 0)
+    joy_mean = _mean(joy.get("sum", 0.0), joy_count)
+    joy_stddev = None
+    if joy_count:
+        variance = max(0.0, joy.get("sum_sq", 0.0) / joy_count - joy_mean * joy_mean)
+        joy_stddev = round(variance ** 0.5, 4)
+
+    since = (datetime.utcnow() - timedelta(days=days - 1)).strftime("%Y-%m-%d")
+    trend = [
+        {
+            "date": day,
+            "messages": int(bucket.get("messages", 0)),
+            "joy_mean": _mean(bucket.get("joy", {}).get("sum", 0.0), bucket.get("joy", {}).get("count", 0)),
+        }
+        for day, bucket in sorted(doc.get("days", {}).items()) if day >= since
+    ]
+
+    return {
+        "total_messages": int(doc.get("total_messages", 0)),
+        "first_active": doc["first_active"].isoformat() if doc.get("first_active") else None,
+        "last_active": doc["last_active"].isoformat() if doc.get("last_active") else None,
+        "characters": {
+            character: {
+                "messages": int(values.get("messages", 0)),
+                "last_active": values["last_active"].isoformat() if values.get("last_active") else None,
+            }
+            for character, values in doc.get("characters", {}).items()
+        },
+        "joy": {"count": int(joy_count), "mean": joy_mean, "stddev": joy_stddev, "min": joy.get("min"), "max": joy.get("max")},
+        "hours": {hour: int(count) for hour, count in sorted(doc.get("hours", {}).items())},
+        "days": trend,
+    }
+
+
+def backfill_user_stats(chat_collection, stats_collection, batch_size: int = STATS_WRITE_BATCH_SIZE) -> int:
+    """Rebuilds every user's stats in one streaming pass over ``chats``.
+
+    Chats are read sorted by ``user_id`` (a prefix of the history index), so only one
+    user's counters are held in memory at a time. Documents are replaced rather than
+    incremented, which makes the job safe to re-run; run it before enabling the live
+    listener or while chat writes are paused, since writes that land mid-run for a user
+    already rebuilt are overwritten. Turns already moved to the retention archive are
+    not in ``chats`` and so are not counted.
+    """
+    from pymongo import ReplaceOne
+
+    projection = {"user_id": 1, "character": 1, "timestamp": 1, "joy_score": 1}
+    cursor = chat_collection.find({}, projection).sort("user_id", ASCENDING).batch_size(1000)
+    writes: List["ReplaceOne"] = []
+    users = 0
+    delta: Optional[StatsDelta] = None
+
+    def finish(delta: StatsDelta):
+        writes.append(ReplaceOne({"user_id": delta.user_id}, delta.to_document(), upsert=True))
+        if len(writes) >= batch_size:
+            stats_collection.bulk_write(writes, ordered=False)
+            writes.clear()
+
+    for doc in cursor:
+        if delta is None or doc["user_id"] != delta.user_id:
+            if delta is not None:
+                finish(delta)
+                users += 1
+            delta = StatsDelta(doc["user_id"])
+        delta.add(doc)
+    if delta is not None:
+        finish(delta)
+        users += 1
+    if writes:
+        stats_collection.bulk_write(writes, ordered=False)
+    logging.info(f"Backfilled stats for {users} users")
+    return users